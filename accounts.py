@@ -0,0 +1,135 @@
+"""
+Account sign-up, shared by /api/signup in app.py (requests, psycopg2) and in
+asgi.py (aiohttp, asyncpg), which differ only in how they do the I/O:
+
+1. parse_signup() the body.
+2. With Supabase configured, create the Auth user from auth_request(). If
+   that fails because the email is already_registered() and no profile has
+   it (EMAIL_TAKEN_SQL), queue orphan_job() and answer RELEASING; otherwise
+   answer signup_failed(). Without Supabase, the user id is generated.
+3. Write the profile with PROFILE_SQL and answer signup_created().
+
+Responses are (body, status) or (body, status, headers) tuples.
+"""
+import re
+
+EMAIL_TAKEN_SQL = "SELECT user_id FROM public.users WHERE email = %s"
+EMAIL_TAKEN_SQL_ASYNCPG = "SELECT user_id FROM public.users WHERE email = $1"
+
+# The profile and its role row in one statement. The Supabase Auth trigger
+# (handle_new_user in schema.sql) may already have created the users row, so
+# it is updated if present. The first administrator is approved at once when
+# first_admin_approved is set; everyone else waits for an administrator.
+PROFILE_SQL = """
+    WITH approval AS (
+        SELECT %(first_admin_approved)s::boolean AND %(role)s::text = 'administrator' AND NOT EXISTS (
+            SELECT 1 FROM public.users WHERE role = 'administrator' AND COALESCE(approved, false)
+        ) AS approved
+    ), profile AS (
+        INSERT INTO public.users (user_id, name, email, role, approved)
+        SELECT %(user_id)s::uuid, %(name)s::text, %(email)s::text, %(role)s::text, approved FROM approval
+        ON CONFLICT (user_id) DO UPDATE
+            SET name = EXCLUDED.name, role = EXCLUDED.role, approved = EXCLUDED.approved
+        RETURNING user_id, role, approved
+    ), student AS (
+        INSERT INTO public.student (user_id)
+        SELECT user_id FROM profile WHERE role = 'student'
+        ON CONFLICT (user_id) DO NOTHING
+    ), instructor AS (
+        INSERT INTO public.instructor (user_id)
+        SELECT user_id FROM profile WHERE role = 'instructor'
+        ON CONFLICT (user_id) DO NOTHING
+    )
+    SELECT approved FROM profile
+"""
+PROFILE_PARAMS = ("first_admin_approved", "role", "user_id", "name", "email")
+PROFILE_SQL_ASYNCPG = re.sub(
+    r"%\((\w+)\)s", lambda m: f"${PROFILE_PARAMS.index(m.group(1)) + 1}", PROFILE_SQL
+)
+
+RELEASING = (
+    {"error": "This email is being released from a previous signup. Please try again shortly."},
+    409, {"Retry-After": "10"},
+)
+
+
+def parse_signup(data):
+    """(fields, None) for a valid sign-up body, else (None, error response)."""
+    fields = {
+        "name": data.get("name"),
+        "email": data.get("email"),
+        "password": data.get("password"),
+        "role": data.get("role", "student"),  # Default to student
+    }
+    if not all([fields["name"], fields["email"], fields["password"]]):
+        return None, ({"error": "Name, email, and password are required"}, 400)
+    return fields, None
+
+
+def service_headers(service_key):
+    """Headers for Supabase Auth admin calls (the JSON content type is set by the client)."""
+    return {
+        "apikey": service_key,
+        "Authorization": f"Bearer {service_key}",
+    }
+
+
+def auth_request(supabase_url, service_key, fields):
+    """(url, headers, JSON payload) creating the Supabase Auth user, email confirmed."""
+    return f"{supabase_url}/auth/v1/admin/users", service_headers(service_key), {
+        "email": fields["email"],
+        "password": fields["password"],
+        "email_confirm": True,  # Auto-confirm email
+        "user_metadata": {"name": fields["name"]},
+    }
+
+
+def auth_error(body):
+    """Supabase Auth's message from a failed create-user response body."""
+    return body.get("msg", "Failed to create user") if isinstance(body, dict) else "Failed to create user"
+
+
+def already_registered(message):
+    """True when Auth has the email already (e.g. a rejected signup left it there)."""
+    return "already" in message.lower() and "registered" in message.lower()
+
+
+def signup_failed(message):
+    return {"error": f"Signup failed: {message}"}, 400
+
+
+def orphan_job(email):
+    """(kind, payload, dedup_key) of the job removing an Auth user that has no profile."""
+    return "remove_orphan_auth_user", {"email": email}, f"remove_orphan_auth_user:{email.lower()}"
+
+
+def profile_params(fields, user_id, first_admin_approved):
+    """PROFILE_SQL parameters (a dict; profile_args() for asyncpg)."""
+    return {
+        "first_admin_approved": first_admin_approved,
+        "role": fields["role"],
+        "user_id": str(user_id),
+        "name": fields["name"],
+        "email": fields["email"],
+    }
+
+
+def profile_args(params):
+    """PROFILE_SQL_ASYNCPG arguments, in order."""
+    return [params[name] for name in PROFILE_PARAMS]
+
+
+def signup_created(fields, user_id, approved):
+    """The sign-up response once the profile is written."""
+    if approved:
+        return {
+            "success": True,
+            "message": "Admin account created.",
+            "user": {"user_id": str(user_id), "name": fields["name"], "email": fields["email"],
+                     "role": fields["role"]}
+        }, 200
+    return {
+        "success": True,
+        "message": "Account created. Please wait for admin approval before logging in.",
+        "user": None
+    }, 200
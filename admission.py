@@ -0,0 +1,235 @@
+"""
+Admission control for the Flask app.
+
+Every request belongs to a route class: auth (login/signup), writes (any
+non-GET), analytics (GET /api/analyst/*) or catalog (every other GET). Per
+worker process, each class may run ADMISSION_LIMITS requests at once and
+queue ADMISSION_QUEUES more for up to ADMISSION_QUEUE_TIMEOUT_MS. Requests
+outside the writes class, running or queued, never hold more than all but
+ADMISSION_RESERVED_WRITE_SLOTS of the worker's threads, so enrollments and
+grading keep capacity while analytics or catalog traffic is piling up. Each
+identified caller (the user id a route takes, or the login email) also has a
+token bucket per class (ADMISSION_RATES, "rate/burst" per second); anonymous
+requests are only subject to the concurrency limits.
+
+Requests over their rate get 429 and requests that cannot be admitted get 503
+right away, both with Retry-After. Limits and buckets are per process, so a
+deployment's totals are these values times the number of workers.
+ADMISSION_CONTROL=off disables all of it.
+
+Under asgi.py, login and signup are async handlers that hold no thread, so
+they get the auth rate limits (rate_limit_wait) but no thread slot.
+"""
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from flask import g, jsonify, request
+
+import metrics
+from db import WORKER_THREADS
+
+ADMISSION_CONTROL = os.getenv("ADMISSION_CONTROL", "on")
+
+# Request threads per worker process, under gunicorn or asgi.py
+_THREADS = WORKER_THREADS
+RESERVED_WRITE_SLOTS = int(os.getenv("ADMISSION_RESERVED_WRITE_SLOTS", "1"))
+QUEUE_TIMEOUT_MS = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_MS", "500"))
+# Callers tracked for rate limiting; the least recently seen are forgotten first
+MAX_TRACKED_CALLERS = 10000
+
+AUTH_ROUTES = {"/api/login", "/api/signup"}
+UNLIMITED_ROUTES = {"unmatched", "/api/health", "/api/metrics"}
+CALLER_FIELDS = ("user_id", "instructor_id", "student_id", "admin_user_id", "email")
+
+
+def _parse(setting, default):
+    """Parse "class=value,class=value" into a dict, on top of the defaults."""
+    values = dict(default)
+    for item in os.getenv(setting, "").split(","):
+        if "=" in item:
+            name, value = item.split("=", 1)
+            values[name.strip()] = value.strip()
+    return values
+
+
+LIMITS = {name: int(value) for name, value in _parse("ADMISSION_LIMITS", {
+    "auth": max(_THREADS - RESERVED_WRITE_SLOTS, 1),
+    "writes": _THREADS,
+    "analytics": max(_THREADS // 4, 1),
+    "catalog": max(_THREADS - RESERVED_WRITE_SLOTS, 1),
+}).items()}
+QUEUES = {name: int(value) for name, value in _parse("ADMISSION_QUEUES", LIMITS).items()}
+RATES = {name: tuple(float(part) for part in value.split("/")) for name, value in _parse("ADMISSION_RATES", {
+    "auth": "1/5",
+    "writes": "5/20",
+    "analytics": "0.5/5",
+    "catalog": "20/40",
+}).items()}
+SHARED_SLOTS = max(_THREADS - RESERVED_WRITE_SLOTS, 1)
+
+
+class RouteClass:
+    """Concurrency limit with a bounded wait queue."""
+
+    def __init__(self, name, limit, queue):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.running = 0
+        self.waiting = 0
+        self._cond = threading.Condition()
+
+    def acquire(self, timeout):
+        with self._cond:
+            if self.running < self.limit:
+                self.running += 1
+                return True
+            if self.waiting >= self.queue:
+                return False
+            self.waiting += 1
+            try:
+                admitted = self._cond.wait_for(lambda: self.running < self.limit, timeout)
+                if admitted:
+                    self.running += 1
+                return admitted
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        with self._cond:
+            self.running -= 1
+            self._cond.notify()
+
+
+class SharedSlots:
+    """Counts the threads held (running or queued) by classes other than writes."""
+
+    def __init__(self, size):
+        self.size = size
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def take(self):
+        with self._lock:
+            if self.used >= self.size:
+                return False
+            self.used += 1
+            return True
+
+    def give_back(self):
+        with self._lock:
+            self.used -= 1
+
+
+class TokenBuckets:
+    """One token bucket per key, refilled continuously."""
+
+    def __init__(self, max_keys):
+        self.max_keys = max_keys
+        self._buckets = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key, rate, burst):
+        """Spend a token; returns 0 on success, else seconds until one is available."""
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.pop(key, (burst, now))
+            tokens = min(burst, tokens + (now - last) * rate)
+            wait = 0.0
+            if tokens >= 1:
+                tokens -= 1
+            else:
+                wait = (1 - tokens) / rate
+            self._buckets[key] = (tokens, now)
+            if len(self._buckets) > self.max_keys:
+                self._buckets.popitem(last=False)
+            return wait
+
+
+_classes = {name: RouteClass(name, LIMITS[name], QUEUES.get(name, LIMITS[name])) for name in LIMITS}
+_shared = SharedSlots(SHARED_SLOTS)
+_buckets = TokenBuckets(MAX_TRACKED_CALLERS)
+
+
+def route_class(method, route):
+    """Class name of a request, or None for requests that are never limited."""
+    if route in UNLIMITED_ROUTES or method == "OPTIONS":
+        return None
+    if route in AUTH_ROUTES:
+        return "auth"
+    if method != "GET":
+        return "writes"
+    if route.startswith("/api/analyst/"):
+        return "analytics"
+    return "catalog"
+
+
+def caller_id():
+    """Who is calling: the user id the route takes, else the login email, else None."""
+    body = request.get_json(silent=True) if request.is_json else None
+    for field in CALLER_FIELDS:
+        value = request.args.get(field) or (body.get(field) if isinstance(body, dict) else None)
+        if value:
+            return f"{field}:{value}"
+    return None
+
+
+def rate_limit_wait(name, caller):
+    """Spend one of `caller`'s tokens for class `name`; returns 0 if it had
+    one, else seconds until it will."""
+    if ADMISSION_CONTROL == "off":
+        return 0
+    rate, burst = RATES[name]
+    return _buckets.take((name, caller), rate, burst)
+
+
+def _reject(status, name, reason, retry_after, message):
+    metrics.REQUESTS_SHED.labels(name, reason).inc()
+    response = jsonify({"error": message})
+    response.status_code = status
+    response.headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def _before_request():
+    name = route_class(request.method, metrics.current_route())
+    if name is None:
+        return None
+
+    caller = caller_id()
+    if caller is not None:
+        wait = rate_limit_wait(name, caller)
+        if wait:
+            return _reject(429, name, "rate_limited", wait, "Too many requests, slow down")
+
+    shared = name != "writes"
+    if shared and not _shared.take():
+        return _reject(503, name, "overloaded", QUEUE_TIMEOUT_MS / 1000, "Server busy, try again shortly")
+    if not _classes[name].acquire(QUEUE_TIMEOUT_MS / 1000):
+        if shared:
+            _shared.give_back()
+        return _reject(503, name, "queue", QUEUE_TIMEOUT_MS / 1000, "Server busy, try again shortly")
+    g.admission_class = name
+    metrics.ADMISSION_RUNNING.labels(name).inc()
+    return None
+
+
+def _teardown_request(exc):
+    name = g.pop("admission_class", None)
+    if name is None:
+        return
+    _classes[name].release()
+    if name != "writes":
+        _shared.give_back()
+    metrics.ADMISSION_RUNNING.labels(name).dec()
+
+
+def init_app(app):
+    """Apply admission control to every request of a Flask app (unless disabled)."""
+    if ADMISSION_CONTROL == "off":
+        return
+    app.before_request(_before_request)
+    app.teardown_request(_teardown_request)
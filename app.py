@@ -1,16 +1,121 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Blueprint, Response, request, jsonify, send_file
 from flask_cors import CORS
-from db import get_connection
+from db import get_connection, release_connections, reads_from_replica
+import accounts
+import metrics
+import cache
+import admission
+import idempotency
+import course_content
+import prepared
+import singleflight
+import wire
+import slow_queries
+import query_budget
+import profiling
+import jobs
+import events
 import os
+import time
+import uuid
+from datetime import datetime
 from dotenv import load_dotenv
 import requests
 import json
 
 load_dotenv()
 
-app = Flask(__name__)
-app.secret_key = os.getenv("FLASK_SECRET_KEY", "change-me-in-production")
-CORS(app)  # Enable CORS for React frontend
+api = Blueprint("api", __name__)
+
+
+def create_app():
+    """Application factory: builds the Flask app and registers the API routes."""
+    app = Flask(__name__)
+    app.secret_key = os.getenv("FLASK_SECRET_KEY", "change-me-in-production")
+    CORS(app)  # Enable CORS for React frontend
+    metrics.init_app(app)
+    admission.init_app(app)
+    idempotency.init_app(app)
+    slow_queries.init_app(app)
+    query_budget.init_app(app)
+    profiling.init_app(app, authorize=lambda user_id: require_admin(user_id)[0])
+    app.register_blueprint(api)
+
+    @app.teardown_request
+    def _release_db_connections(exc):
+        # Hand back pooled connections left open by early returns
+        release_connections()
+
+    return app
+
+
+# Page size of the keyset-paginated lists (announcement feed, grading inbox)
+PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
+
+# Analyst dashboards are invalidated by writes to courses, enrollments (enroll,
+# drop, promotion, final grades) and assignments; user and university counts
+# follow this TTL alone, so they may be this many seconds old
+ANALYST_CACHE_TTL = float(os.getenv("ANALYST_CACHE_TTL", "300"))
+
+# "python" (the default) builds the large list routes' JSON from the rows as the
+# other routes do; "db" opts in to having Postgres build the payload, which is
+# passed through as is (compare the two with bench/json_render.py)
+JSON_RENDERING = os.getenv("JSON_RENDERING", "python")
+
+# Statements run on most requests, prepared once per connection (prepared.py).
+# Not the enrolled_in checks: on the partitioned table
+# (migrations/partition_large_tables.sql) Postgres plans them per execution
+# anyway, so preparing them saves nothing.
+USER_ROLE = prepared.statement("user_role", "SELECT role FROM public.users WHERE user_id = %s::uuid")
+USER_PROFILE = prepared.statement("user_profile", """
+    SELECT user_id, name, email, role, COALESCE(approved, false)
+    FROM public.users
+    WHERE user_id = %s
+""")
+TEACHES_COURSE = prepared.statement("teaches_course", """
+    SELECT COUNT(*) FROM public.teaches
+    WHERE instructor_id = %s AND course_id = %s
+""")
+COURSE_CATALOG = prepared.statement("course_catalog", """
+    SELECT c.course_id, c.title, c.duration, c.level, c.description, c.fees,
+           un.name AS university_name, un.ranking AS university_ranking,
+           (SELECT string_agg('Prof. ' || u.name, ', ')
+            FROM public.teaches t
+            JOIN public.users u ON t.instructor_id = u.user_id
+            WHERE t.course_id = c.course_id) AS instructor_names
+    FROM public.course c
+    LEFT JOIN public.university un ON c.university_id = un.university_id
+    ORDER BY c.title
+""")
+# The /api/courses list, for sparse fieldsets and the compact and MessagePack
+# formats (wire.py); its full payload is also prepared for the default request
+CATALOG_LIST = wire.ListQuery("courses", {
+    "course_id": "c.course_id::text",
+    "title": "c.title",
+    "duration": "c.duration",
+    "level": "c.level",
+    "description": "c.description",
+    "fees": "NULLIF(c.fees, 0)::float8",
+    "university_name": "NULLIF(un.name, '')",
+    "university_ranking": "un.ranking",
+    "instructor_names": """(SELECT string_agg('Prof. ' || u.name, ', ')
+                            FROM public.teaches t
+                            JOIN public.users u ON t.instructor_id = u.user_id
+                            WHERE t.course_id = c.course_id)""",
+}, source="""FROM public.course c
+    LEFT JOIN public.university un ON c.university_id = un.university_id""", order_by="c.title")
+COURSE_CATALOG_JSON = prepared.statement("course_catalog_json", CATALOG_LIST.json_sql(list(CATALOG_LIST.fields)))
+
+# Get-or-create by name in one statement; keeps the stored ranking unless a new one is given.
+# Relies on the unique name index from migrations/add_performance_indexes.sql.
+UPSERT_UNIVERSITY_SQL = """
+    INSERT INTO public.university (name, ranking)
+    VALUES (%s, %s)
+    ON CONFLICT (name) DO UPDATE
+        SET ranking = COALESCE(EXCLUDED.ranking, public.university.ranking)
+    RETURNING university_id
+"""
 
 
 def require_admin(user_id):
@@ -19,7 +124,7 @@ def require_admin(user_id):
         return False, (jsonify({"error": "user_id is required"}), 400)
     conn = get_connection()
     cur = conn.cursor()
-    cur.execute("SELECT role FROM public.users WHERE user_id = %s::uuid", (user_id,))
+    prepared.execute(cur, USER_ROLE, (user_id,))
     row = cur.fetchone()
     cur.close()
     conn.close()
@@ -33,11 +138,88 @@ SUPABASE_ANON_KEY = os.getenv("SUPABASE_ANON_KEY", "")
 SUPABASE_SERVICE_KEY = os.getenv("SUPABASE_SERVICE_KEY", "")
 
 
+def supabase_request(operation, method, url, **kwargs):
+    """requests.request() for Supabase Auth calls, recording latency under `operation`."""
+    start = time.perf_counter()
+    status = "error"
+    try:
+        response = requests.request(method, url, **kwargs)
+        status = str(response.status_code)
+        return response
+    finally:
+        metrics.observe_supabase(operation, status, time.perf_counter() - start)
+
+
+# Supabase Auth calls made by background jobs give up after this many seconds
+SUPABASE_JOB_TIMEOUT = float(os.getenv("SUPABASE_JOB_TIMEOUT", "10"))
+
+
+# =============================
+# BACKGROUND JOBS
+# =============================
+# Run by worker.py (see jobs.py). A handler that raises is retried with backoff.
+
+def _service_headers():
+    return accounts.service_headers(SUPABASE_SERVICE_KEY)
+
+
+@jobs.handler("delete_auth_user")
+def delete_auth_user_job(payload):
+    """Delete a removed user from Supabase Auth."""
+    response = supabase_request(
+        "delete_user", "DELETE", f"{SUPABASE_URL}/auth/v1/admin/users/{payload['user_id']}",
+        headers=_service_headers(), timeout=SUPABASE_JOB_TIMEOUT
+    )
+    # 404 means it is already gone
+    if response.status_code not in (200, 204, 404):
+        raise RuntimeError(f"Supabase Auth delete returned {response.status_code}: {response.text[:200]}")
+
+
+@jobs.handler("remove_orphan_auth_user")
+def remove_orphan_auth_user_job(payload):
+    """Delete an Auth user whose email has no profile row (e.g. a rejected signup)."""
+    email = payload["email"]
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT user_id FROM public.users WHERE email = %s", (email,))
+    row = cur.fetchone()
+    cur.close()
+    conn.close()
+    if row:
+        return  # signed up in the meantime; not an orphan any more
+
+    list_resp = supabase_request(
+        "list_users", "GET", f"{SUPABASE_URL}/auth/v1/admin/users?per_page=1000",
+        headers=_service_headers(), timeout=SUPABASE_JOB_TIMEOUT
+    )
+    if list_resp.status_code != 200:
+        raise RuntimeError(f"Supabase Auth list returned {list_resp.status_code}: {list_resp.text[:200]}")
+    data = list_resp.json()
+    users_list = data if isinstance(data, list) else (data.get("users") or []) if isinstance(data, dict) else []
+    for u in users_list:
+        if isinstance(u, dict) and (u.get("email") or "").lower() == email.lower() and u.get("id"):
+            delete_auth_user_job({"user_id": u["id"]})
+            return
+
+
+@jobs.handler("promote_waitlist")
+def promote_waitlist_job(payload):
+    """Fill seats freed outside a request that promotes (e.g. a deleted student)."""
+    conn = get_connection()
+    cur = conn.cursor()
+    promoted = promote_waitlisted(cur, payload["course_id"])
+    conn.commit()
+    cache.invalidate(cur, f"course:{payload['course_id']}", *(f"user:{u}" for u in promoted),
+                     *(["table:enrolled_in"] if promoted else []))
+    cur.close()
+    conn.close()
+
+
 # =============================
 # AUTHENTICATION
 # =============================
 
-@app.route("/api/login", methods=["POST"])
+@api.route("/api/login", methods=["POST"])
 def login():
     """Login endpoint - verifies password via Supabase Auth, returns user data"""
     try:
@@ -56,7 +238,7 @@ def login():
                 "Content-Type": "application/json"
             }
             payload = {"email": email, "password": password}
-            auth_response = requests.post(auth_url, headers=headers, json=payload)
+            auth_response = supabase_request("token", "POST", auth_url, headers=headers, json=payload)
             if auth_response.status_code != 200:
                 return jsonify({"error": "Invalid email or password"}), 401
             auth_data = auth_response.json()
@@ -66,11 +248,7 @@ def login():
 
         conn = get_connection()
         cur = conn.cursor()
-        cur.execute("""
-            SELECT user_id, name, email, role, COALESCE(approved, false)
-            FROM public.users
-            WHERE user_id = %s
-        """, (auth_user_id,))
+        prepared.execute(cur, USER_PROFILE, (auth_user_id,))
         user = cur.fetchone()
         cur.close()
         conn.close()
@@ -97,169 +275,72 @@ def login():
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/api/signup", methods=["POST"])
+@api.route("/api/signup", methods=["POST"])
 def signup():
-    """Sign up endpoint - creates new user via Supabase Auth"""
+    """Sign up endpoint - creates new user via Supabase Auth (steps in accounts.py)"""
     try:
-        data = request.get_json()
-        name = data.get("name")
-        email = data.get("email")
-        password = data.get("password")
-        role = data.get("role", "student")  # Default to student
+        fields, error = accounts.parse_signup(request.get_json())
+        if error:
+            return _json_reply(error)
 
-        if not all([name, email, password]):
-            return jsonify({"error": "Name, email, and password are required"}), 400
-
-        # Create user in Supabase Auth
+        # Create user in Supabase Auth first: no pooled connection is held across the call
         if SUPABASE_URL and SUPABASE_SERVICE_KEY:
-            auth_url = f"{SUPABASE_URL}/auth/v1/admin/users"
-            headers = {
-                "apikey": SUPABASE_SERVICE_KEY,
-                "Authorization": f"Bearer {SUPABASE_SERVICE_KEY}",
-                "Content-Type": "application/json"
-            }
-            
-            payload = {
-                "email": email,
-                "password": password,
-                "email_confirm": True,  # Auto-confirm email
-                "user_metadata": {
-                    "name": name
-                }
-            }
-
-            response = requests.post(auth_url, headers=headers, json=payload)
-            
+            auth_url, headers, payload = accounts.auth_request(SUPABASE_URL, SUPABASE_SERVICE_KEY, fields)
+            response = supabase_request("create_user", "POST", auth_url, headers=headers, json=payload)
             if response.status_code not in [200, 201]:
-                error_msg = response.json().get("msg", "Failed to create user")
-                # If email already registered in Auth but not in our DB (e.g. rejected signup), remove orphan and retry
-                if "already" in error_msg.lower() and "registered" in error_msg.lower():
+                error_msg = accounts.auth_error(response.json())
+                # Registered in Auth but not here (e.g. a rejected signup): queue removal
+                # of the orphan Auth user; the client retries once the worker has run
+                if accounts.already_registered(error_msg):
                     conn = get_connection()
                     cur = conn.cursor()
-                    cur.execute("SELECT user_id FROM public.users WHERE email = %s", (email,))
-                    row = cur.fetchone()
-                    cur.close()
-                    conn.close()
-                    if not row:
-                        # Email not in our DB -> orphan auth user; delete from Auth and retry once
-                        list_url = f"{SUPABASE_URL}/auth/v1/admin/users?per_page=1000"
-                        list_resp = requests.get(list_url, headers=headers)
-                        if list_resp.status_code == 200:
-                            data = list_resp.json()
-                            users_list = data if isinstance(data, list) else (data.get("users") or []) if isinstance(data, dict) else []
-                            for u in users_list:
-                                    if isinstance(u, dict) and (u.get("email") or "").lower() == email.lower():
-                                        orphan_id = u.get("id")
-                                        if orphan_id:
-                                            requests.delete(
-                                                f"{SUPABASE_URL}/auth/v1/admin/users/{orphan_id}",
-                                                headers=headers
-                                            )
-                                        response = requests.post(auth_url, headers=headers, json=payload)
-                                        break
-                if response.status_code not in [200, 201]:
-                    error_msg = response.json().get("msg", "Failed to create user") if response.text else error_msg
-                    return jsonify({"error": f"Signup failed: {error_msg}"}), 400
-
-            auth_user = response.json()
-            user_id = auth_user.get("id")
-
-            # The trigger should auto-create the profile, but let's ensure it exists
-            conn = get_connection()
-            cur = conn.cursor()
-
-            # Check if first admin - auto-approve
-            cur.execute("SELECT COUNT(*) FROM public.users WHERE role = 'administrator' AND COALESCE(approved, false) = true")
-            admin_count = cur.fetchone()[0]
-            auto_approve = (role == "administrator" and admin_count == 0)
-
-            cur.execute("""
-                UPDATE public.users 
-                SET name = %s, role = %s, approved = %s
-                WHERE user_id = %s
-            """, (name, role, auto_approve, user_id))
-
-            if cur.rowcount == 0:
-                cur.execute("""
-                    INSERT INTO public.users (user_id, name, email, role, approved)
-                    VALUES (%s, %s, %s, %s, %s)
-                """, (user_id, name, email, role, auto_approve))
-
-            # Create student/instructor record based on role
-            if role == "student":
-                cur.execute("""
-                    INSERT INTO public.student (user_id)
-                    VALUES (%s)
-                    ON CONFLICT (user_id) DO NOTHING
-                """, (user_id,))
-            elif role == "instructor":
-                cur.execute("""
-                    INSERT INTO public.instructor (user_id)
-                    VALUES (%s)
-                    ON CONFLICT (user_id) DO NOTHING
-                """, (user_id,))
-
-            conn.commit()
-            cur.close()
-            conn.close()
-
-            if auto_approve:
-                return jsonify({
-                    "success": True,
-                    "message": "Admin account created.",
-                    "user": {"user_id": str(user_id), "name": name, "email": email, "role": role}
-                })
-            return jsonify({
-                "success": True,
-                "message": "Account created. Please wait for admin approval before logging in.",
-                "user": None
-            })
-
+                    try:
+                        cur.execute(accounts.EMAIL_TAKEN_SQL, (fields["email"],))
+                        orphan = cur.fetchone() is None
+                        if orphan:
+                            kind, job, dedup_key = accounts.orphan_job(fields["email"])
+                            jobs.enqueue(kind, job, cur=cur, dedup_key=dedup_key)
+                            conn.commit()
+                    finally:
+                        cur.close()
+                        conn.close()
+                    if orphan:
+                        return _json_reply(accounts.RELEASING)
+                return _json_reply(accounts.signup_failed(error_msg))
+            user_id = response.json().get("id")
+            first_admin_approved = True
         else:
-            # Fallback: Create user directly in database (for testing without Supabase Auth)
-            conn = get_connection()
-            cur = conn.cursor()
-
-            # Generate UUID (you'll need to import uuid)
-            import uuid
+            # Fallback: create the user directly (for testing without Supabase Auth)
             user_id = uuid.uuid4()
+            first_admin_approved = False
 
-            cur.execute("""
-                INSERT INTO public.users (user_id, name, email, role, approved)
-                VALUES (%s, %s, %s, %s, false)
-                RETURNING user_id
-            """, (user_id, name, email, role))
-
-            if role == "student":
-                cur.execute("""
-                    INSERT INTO public.student (user_id)
-                    VALUES (%s)
-                """, (user_id,))
-            elif role == "instructor":
-                cur.execute("""
-                    INSERT INTO public.instructor (user_id)
-                    VALUES (%s)
-                """, (user_id,))
-
+        conn = get_connection()
+        cur = conn.cursor()
+        try:
+            cur.execute(accounts.PROFILE_SQL, accounts.profile_params(fields, user_id, first_admin_approved))
+            approved = cur.fetchone()[0]
             conn.commit()
+        finally:
             cur.close()
             conn.close()
 
-            return jsonify({
-                "success": True,
-                "message": "Account created. Please wait for admin approval before logging in.",
-                "user": None
-            })
+        return _json_reply(accounts.signup_created(fields, user_id, approved))
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
+def _json_reply(reply):
+    """A Flask response from one of accounts.py's (body, status[, headers]) replies."""
+    body, *rest = reply
+    return (jsonify(body), *rest)
+
+
 # =============================
 # DASHBOARD DATA
 # =============================
 
-@app.route("/api/dashboard", methods=["GET"])
+@api.route("/api/dashboard", methods=["GET"])
 def dashboard():
     """Get dashboard data based on user role"""
     try:
@@ -331,24 +412,29 @@ def dashboard():
 # COURSES
 # =============================
 
-@app.route("/api/courses", methods=["GET"])
+@api.route("/api/courses", methods=["GET"])
+@cache.cached(ttl=60, tags=["table:course", "table:teaches"])
+@reads_from_replica
 def courses():
     """Get all courses with university and instructor(s)"""
     try:
         conn = get_connection()
         cur = conn.cursor()
 
-        cur.execute("""
-            SELECT c.course_id, c.title, c.duration, c.level, c.description, c.fees,
-                   un.name AS university_name, un.ranking AS university_ranking,
-                   (SELECT string_agg('Prof. ' || u.name, ', ')
-                    FROM public.teaches t
-                    JOIN public.users u ON t.instructor_id = u.user_id
-                    WHERE t.course_id = c.course_id) AS instructor_names
-            FROM public.course c
-            LEFT JOIN public.university un ON c.university_id = un.university_id
-            ORDER BY c.title
-        """)
+        if not wire.is_default():
+            response = wire.respond(cur, CATALOG_LIST, None, db_json=JSON_RENDERING == "db")
+            cur.close()
+            conn.close()
+            return response
+
+        if JSON_RENDERING == "db":
+            prepared.execute(cur, COURSE_CATALOG_JSON)
+            body = cur.fetchone()[0]
+            cur.close()
+            conn.close()
+            return Response(body, mimetype="application/json")
+
+        prepared.execute(cur, COURSE_CATALOG)
 
         courses = cur.fetchall()
         cur.close()
@@ -374,7 +460,25 @@ def courses():
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/api/courses/enroll", methods=["POST"])
+# Takes a seat (migrations/add_seat_reservations.sql) and inserts the enrollment
+# in one statement; inserts nothing when the course is full or has students
+# waiting for a seat. The seat's stripe stays locked until commit, so keep
+# this the last statement before it.
+ENROLL_SQL = """
+    WITH seat AS (
+        SELECT public.claim_course_seat(%(course_id)s::uuid) AS stripe
+        WHERE NOT EXISTS (SELECT 1 FROM public.course_waitlist WHERE course_id = %(course_id)s::uuid)
+    )
+    INSERT INTO public.enrolled_in(user_id, course_id, status, seat_stripe)
+    SELECT %(user_id)s, %(course_id)s::uuid, 'ongoing', NULLIF(stripe, -1)
+    FROM seat
+    WHERE stripe IS NOT NULL
+    ON CONFLICT (user_id, course_id) DO NOTHING
+    RETURNING enroll_date
+"""
+
+
+@api.route("/api/courses/enroll", methods=["POST"])
 def enroll():
     """Enroll in a course"""
     try:
@@ -388,17 +492,28 @@ def enroll():
         conn = get_connection()
         cur = conn.cursor()
 
-        cur.execute("""
-            INSERT INTO public.enrolled_in(user_id, course_id, status)
-            VALUES (%s, %s::uuid, 'ongoing')
-            ON CONFLICT (user_id, course_id) DO NOTHING
-            RETURNING enroll_date
-        """, (user_id, course_id))
+        cur.execute(ENROLL_SQL, {"course_id": course_id, "user_id": user_id})
 
         if cur.rowcount == 0:
-            return jsonify({"error": "Already enrolled or invalid course"}), 400
+            # Nothing inserted: the seat claim (if any) is undone with the transaction
+            conn.rollback()
+            cur.execute("""
+                SELECT EXISTS (SELECT 1 FROM public.enrolled_in WHERE user_id = %s AND course_id = %s::uuid),
+                       EXISTS (SELECT 1 FROM public.course_waitlist WHERE course_id = %s::uuid)
+            """, (user_id, course_id, course_id))
+            already, queued = cur.fetchone()
+            cur.close()
+            conn.close()
+            if already:
+                return jsonify({"error": "Already enrolled or invalid course"}), 400
+            if queued:
+                # Free seats go to the waitlist first
+                return jsonify({"error": "Students are waiting for this course; join the waitlist",
+                                "reason": "waitlist", "waitlist": True}), 409
+            return jsonify({"error": "Course is full", "reason": "full", "waitlist": True}), 409
 
         conn.commit()
+        cache.invalidate(cur, f"user:{user_id}", f"course:{course_id}", "table:enrolled_in")
         cur.close()
         conn.close()
 
@@ -408,7 +523,32 @@ def enroll():
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/api/courses/my-courses", methods=["GET"])
+# The /api/courses/my-courses list (wire.py), its JSON built by Postgres
+# when JSON_RENDERING=db
+MY_COURSES_LIST = wire.ListQuery("courses", {
+    "course_id": "c.course_id::text",
+    "title": "c.title",
+    "duration": "c.duration",
+    "level": "c.level",
+    "status": "e.status",
+    "enroll_date": "e.enroll_date::text",
+    "grade": "e.grade",
+    "completion_date": "e.completion_date::text",
+    "university_name": "un.name",
+    "university_ranking": "un.ranking",
+    "instructor_names": """(SELECT string_agg('Prof. ' || u.name, ', ')
+                            FROM public.teaches t
+                            JOIN public.users u ON t.instructor_id = u.user_id
+                            WHERE t.course_id = c.course_id)""",
+}, source="""FROM public.enrolled_in e
+    JOIN public.course c ON c.course_id = e.course_id
+    LEFT JOIN public.university un ON c.university_id = un.university_id
+    WHERE e.user_id = %(user_id)s AND (%(status)s::text IS NULL OR e.status = %(status)s)""",
+    order_by="e.enroll_date DESC")
+
+
+@api.route("/api/courses/my-courses", methods=["GET"])
+@cache.cached(ttl=60, tags=["user:{user_id}", "table:course", "table:teaches"])
 def my_courses():
     """Get enrolled courses for a user"""
     try:
@@ -421,6 +561,13 @@ def my_courses():
         conn = get_connection()
         cur = conn.cursor()
 
+        if JSON_RENDERING == "db" or not wire.is_default():
+            response = wire.respond(cur, MY_COURSES_LIST, {"user_id": user_id, "status": status or None},
+                                    db_json=JSON_RENDERING == "db")
+            cur.close()
+            conn.close()
+            return response
+
         if status:
             cur.execute("""
                 SELECT c.course_id, c.title, c.duration, c.level, e.status,
@@ -478,7 +625,153 @@ def my_courses():
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/api/student/profile", methods=["GET"])
+# Waitlist tickets (migrations/add_course_waitlist.sql) have gaps where students
+# left, so a position is counted from the queue (idx_course_waitlist_queue).
+WAITLIST_SQL = """
+    SELECT w.course_id, c.title, q.position, q.waiting, w.joined_at
+    FROM public.course_waitlist w
+    JOIN public.course c ON c.course_id = w.course_id
+    CROSS JOIN LATERAL (
+        SELECT COUNT(*) FILTER (WHERE x.ticket <= w.ticket) AS position, COUNT(*) AS waiting
+        FROM public.course_waitlist x
+        WHERE x.course_id = w.course_id
+    ) q
+    WHERE w.user_id = %s
+"""
+
+
+def promote_waitlisted(cur, course_id):
+    """Enroll waitlisted students into a course's free seats, in the caller's
+    transaction, and tell each of them. Returns their ids."""
+    cur.execute("SELECT promoted FROM public.promote_waitlisted(%s::uuid) AS promoted", (course_id,))
+    promoted = [str(r[0]) for r in cur.fetchall()]
+    for user_id in promoted:
+        events.publish(cur, "waitlist_promoted", {"course_id": course_id},
+                       course_id=course_id, user_id=user_id)
+    return promoted
+
+
+@api.route("/api/courses/waitlist", methods=["GET"])
+def my_waitlist():
+    """Courses a student is waiting for, with their place in each queue"""
+    try:
+        user_id = request.args.get("user_id")
+        if not user_id:
+            return jsonify({"error": "user_id is required"}), 400
+
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute(WAITLIST_SQL + " ORDER BY w.joined_at", (user_id,))
+        rows = cur.fetchall()
+        cur.close()
+        conn.close()
+
+        return jsonify({"success": True, "waitlist": [{
+            "course_id": str(r[0]),
+            "title": r[1],
+            "position": r[2],
+            "waiting": r[3],
+            "joined_at": r[4].isoformat()
+        } for r in rows]})
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@api.route("/api/courses/waitlist", methods=["POST"])
+def join_waitlist():
+    """Join a full course's waitlist (enrolls straight away if a seat is free)"""
+    try:
+        data = request.get_json()
+        user_id = data.get("user_id")
+        course_id = data.get("course_id")
+
+        if not user_id or not course_id:
+            return jsonify({"error": "user_id and course_id are required"}), 400
+
+        conn = get_connection()
+        cur = conn.cursor()
+
+        cur.execute("""
+            SELECT EXISTS (SELECT 1 FROM public.course WHERE course_id = %s::uuid),
+                   EXISTS (SELECT 1 FROM public.enrolled_in WHERE user_id = %s AND course_id = %s::uuid)
+        """, (course_id, user_id, course_id))
+        course_exists, enrolled = cur.fetchone()
+        if not course_exists or enrolled:
+            cur.close()
+            conn.close()
+            if not course_exists:
+                return jsonify({"error": "Course not found"}), 404
+            return jsonify({"error": "Already enrolled in this course"}), 400
+
+        cur.execute("SELECT public.join_course_waitlist(%s::uuid, %s::uuid)", (course_id, user_id))
+        if cur.fetchone()[0] is None:
+            conn.rollback()
+            cur.close()
+            conn.close()
+            return jsonify({"error": "Already on the waitlist for this course"}), 400
+
+        promoted = promote_waitlisted(cur, course_id)
+        cur.execute(WAITLIST_SQL + " AND w.course_id = %s::uuid", (user_id, course_id))
+        row = cur.fetchone()
+        conn.commit()
+        # No longer waiting after joining: the join enrolled them
+        if row is None or promoted:
+            cache.invalidate(cur, f"course:{course_id}", f"user:{user_id}", *(f"user:{u}" for u in promoted),
+                             "table:enrolled_in")
+        cur.close()
+        conn.close()
+
+        if row is None:
+            return jsonify({"success": True, "enrolled": True, "message": "Enrolled successfully"})
+        return jsonify({
+            "success": True,
+            "enrolled": False,
+            "position": row[2],
+            "waiting": row[3],
+            "message": f"Added to the waitlist at position {row[2]}"
+        })
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@api.route("/api/courses/waitlist/leave", methods=["POST"])
+def leave_waitlist():
+    """Leave a course's waitlist"""
+    try:
+        data = request.get_json()
+        user_id = data.get("user_id")
+        course_id = data.get("course_id")
+
+        if not user_id or not course_id:
+            return jsonify({"error": "user_id and course_id are required"}), 400
+
+        conn = get_connection()
+        cur = conn.cursor()
+
+        # Queue lock before the row lock, as promotion takes them
+        cur.execute("SELECT public.lock_course_waitlist(%s::uuid)", (course_id,))
+        cur.execute("""
+            DELETE FROM public.course_waitlist WHERE user_id = %s AND course_id = %s::uuid
+        """, (user_id, course_id))
+        if cur.rowcount == 0:
+            conn.rollback()
+            cur.close()
+            conn.close()
+            return jsonify({"error": "Not on the waitlist for this course"}), 404
+
+        conn.commit()
+        cur.close()
+        conn.close()
+
+        return jsonify({"success": True, "message": "Left the waitlist"})
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@api.route("/api/student/profile", methods=["GET"])
 def get_student_profile():
     """Get student personal information"""
     try:
@@ -520,7 +813,7 @@ def get_student_profile():
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/api/student/profile", methods=["PUT"])
+@api.route("/api/student/profile", methods=["PUT"])
 def update_student_profile():
     """Update student personal information (except email and password)"""
     try:
@@ -566,6 +859,8 @@ def update_student_profile():
             cur.execute(f"UPDATE public.student SET {', '.join(updates)} WHERE user_id = %s", params)
 
         conn.commit()
+        if name is not None:
+            cache.invalidate(cur, "table:users")
 
         cur.close()
         conn.close()
@@ -580,7 +875,7 @@ def update_student_profile():
 # ADMIN ROUTES
 # =============================
 
-@app.route("/api/admin/users", methods=["GET"])
+@api.route("/api/admin/users", methods=["GET"])
 def get_users():
     """Get all users (admin only)"""
     try:
@@ -613,7 +908,7 @@ def get_users():
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/api/admin/approve", methods=["POST"])
+@api.route("/api/admin/approve", methods=["POST"])
 def approve_user():
     """Approve a user (admin only)"""
     try:
@@ -636,42 +931,50 @@ def approve_user():
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/api/admin/users/<user_id>", methods=["DELETE"])
+@api.route("/api/admin/users/<user_id>", methods=["DELETE"])
 def delete_student(user_id):
     """Delete a user (admin only). Removes from DB and from Supabase Auth so the email can sign up again."""
     try:
         conn = get_connection()
         cur = conn.cursor()
 
+        # Queues the student is in are locked before their rows, as promotion does
+        cur.execute("""
+            SELECT public.lock_course_waitlist(course_id) FROM public.course_waitlist
+            WHERE user_id = %s::uuid ORDER BY course_id
+        """, (user_id,))
+        cur.execute("""
+            SELECT course_id FROM public.enrolled_in WHERE user_id = %s::uuid AND status != 'dropped'
+        """, (user_id,))
+        freed_courses = [str(r[0]) for r in cur.fetchall()]
+
         # Remove from role tables first (user may be student or instructor)
         cur.execute("DELETE FROM public.student WHERE user_id = %s::uuid", (user_id,))
         cur.execute("DELETE FROM public.instructor WHERE user_id = %s::uuid", (user_id,))
         cur.execute("DELETE FROM public.users WHERE user_id = %s::uuid", (user_id,))
 
+        # Delete from Supabase Auth (in the background) so the same email can sign up again
+        if SUPABASE_URL and SUPABASE_SERVICE_KEY:
+            jobs.enqueue("delete_auth_user", {"user_id": user_id}, cur=cur,
+                         dedup_key=f"delete_auth_user:{user_id}")
+
+        # Their seats go to the waitlists in the background, one course at a time
+        for course_id in freed_courses:
+            jobs.enqueue("promote_waitlist", {"course_id": course_id}, cur=cur)
+
         conn.commit()
+        cache.invalidate(cur, f"user:{user_id}", "table:teaches", "table:enrolled_in",
+                         *(f"course:{c}" for c in freed_courses))
         cur.close()
         conn.close()
 
-        # Delete from Supabase Auth so the same email can sign up again
-        if SUPABASE_URL and SUPABASE_SERVICE_KEY:
-            auth_delete_url = f"{SUPABASE_URL}/auth/v1/admin/users/{user_id}"
-            headers = {
-                "apikey": SUPABASE_SERVICE_KEY,
-                "Authorization": f"Bearer {SUPABASE_SERVICE_KEY}",
-            }
-            auth_response = requests.delete(auth_delete_url, headers=headers)
-            # 200 or 404 (already gone) are both OK
-            if auth_response.status_code not in (200, 204, 404):
-                # Log but don't fail - DB user is already removed
-                pass
-
         return jsonify({"success": True, "message": "User deleted"})
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/api/admin/assign", methods=["POST"])
+@api.route("/api/admin/assign", methods=["POST"])
 def assign_instructor():
     """Assign instructor to course (admin only)"""
     try:
@@ -692,6 +995,7 @@ def assign_instructor():
         """, (instructor_id, course_id))
 
         conn.commit()
+        cache.invalidate(cur, "table:teaches", f"course:{course_id}")
         cur.close()
         conn.close()
 
@@ -701,13 +1005,13 @@ def assign_instructor():
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/api/admin/courses", methods=["GET"])
+@api.route("/api/admin/courses", methods=["GET"])
 def admin_courses():
     """Get all courses (admin view)"""
     return courses()  # Reuse the courses endpoint
 
 
-@app.route("/api/admin/courses", methods=["POST"])
+@api.route("/api/admin/courses", methods=["POST"])
 def create_course():
     """Create a new course (admin only). Requires university_name and university_ranking; creates university if needed."""
     try:
@@ -732,20 +1036,9 @@ def create_course():
 
         conn = get_connection()
         cur = conn.cursor()
-        # Get or create university
-        cur.execute("SELECT university_id, ranking FROM public.university WHERE name = %s", (university_name,))
-        un_row = cur.fetchone()
-        if un_row:
-            university_id = un_row[0]
-            if university_ranking is not None:
-                cur.execute("UPDATE public.university SET ranking = %s WHERE university_id = %s", (university_ranking, university_id))
-        else:
-            cur.execute("""
-                INSERT INTO public.university (name, ranking)
-                VALUES (%s, %s)
-                RETURNING university_id
-            """, (university_name, university_ranking if university_ranking is not None else None))
-            university_id = cur.fetchone()[0]
+        # Get or create university (name is unique)
+        cur.execute(UPSERT_UNIVERSITY_SQL, (university_name, university_ranking))
+        university_id = cur.fetchone()[0]
 
         cur.execute("""
             INSERT INTO public.course (title, duration, level, description, fees, university_id)
@@ -755,6 +1048,7 @@ def create_course():
 
         row = cur.fetchone()
         conn.commit()
+        cache.invalidate(cur, "table:course")
         cur.close()
         conn.close()
 
@@ -774,7 +1068,7 @@ def create_course():
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/api/admin/courses/<course_id>", methods=["DELETE"])
+@api.route("/api/admin/courses/<course_id>", methods=["DELETE"])
 def delete_course(course_id):
     """Delete a course (admin only). Cascades to teaches, enrolled_in, modules, etc."""
     try:
@@ -791,6 +1085,7 @@ def delete_course(course_id):
             conn.close()
             return jsonify({"error": "Course not found"}), 404
         conn.commit()
+        cache.invalidate(cur, "table:course", f"course:{course_id}")
         cur.close()
         conn.close()
         return jsonify({"success": True, "message": "Course deleted"})
@@ -798,7 +1093,7 @@ def delete_course(course_id):
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/api/admin/courses/<course_id>/instructors", methods=["GET"])
+@api.route("/api/admin/courses/<course_id>/instructors", methods=["GET"])
 def get_course_instructors(course_id):
     """Get instructors assigned to a course (admin only)"""
     try:
@@ -825,7 +1120,7 @@ def get_course_instructors(course_id):
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/api/admin/courses/<course_id>/instructors/<instructor_id>", methods=["DELETE"])
+@api.route("/api/admin/courses/<course_id>/instructors/<instructor_id>", methods=["DELETE"])
 def remove_course_instructor(course_id, instructor_id):
     """Remove an instructor from a course (admin only)"""
     try:
@@ -846,6 +1141,7 @@ def remove_course_instructor(course_id, instructor_id):
             conn.close()
             return jsonify({"error": "Assignment not found"}), 404
         conn.commit()
+        cache.invalidate(cur, "table:teaches", f"course:{course_id}")
         cur.close()
         conn.close()
         return jsonify({"success": True, "message": "Instructor removed from course"})
@@ -853,7 +1149,7 @@ def remove_course_instructor(course_id, instructor_id):
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/api/admin/courses/<course_id>", methods=["PUT"])
+@api.route("/api/admin/courses/<course_id>", methods=["PUT"])
 def update_course(course_id):
     """Update a course (admin only). Can update university name/ranking."""
     try:
@@ -898,19 +1194,8 @@ def update_course(course_id):
             if university_name == "":
                 new_university_id = None
             else:
-                cur.execute("SELECT university_id FROM public.university WHERE name = %s", (university_name,))
-                un_row = cur.fetchone()
-                if un_row:
-                    new_university_id = un_row[0]
-                    if university_ranking is not None:
-                        cur.execute("UPDATE public.university SET ranking = %s WHERE university_id = %s", (university_ranking, new_university_id))
-                else:
-                    cur.execute("""
-                        INSERT INTO public.university (name, ranking)
-                        VALUES (%s, %s)
-                        RETURNING university_id
-                    """, (university_name, university_ranking))
-                    new_university_id = cur.fetchone()[0]
+                cur.execute(UPSERT_UNIVERSITY_SQL, (university_name, university_ranking))
+                new_university_id = cur.fetchone()[0]
             cur.execute("UPDATE public.course SET title = %s, duration = %s, level = %s, description = %s, fees = %s, university_id = %s WHERE course_id = %s::uuid",
                         (new_title, new_duration or "", new_level or "beginner", new_description or "", new_fees, new_university_id, course_id))
         else:
@@ -921,6 +1206,7 @@ def update_course(course_id):
             """, (new_title, new_duration or "", new_level or "beginner", new_description or "", new_fees, course_id))
 
         conn.commit()
+        cache.invalidate(cur, "table:course", f"course:{course_id}")
         cur.close()
         conn.close()
 
@@ -940,7 +1226,7 @@ def update_course(course_id):
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/api/admin/instructors", methods=["GET"])
+@api.route("/api/admin/instructors", methods=["GET"])
 def get_instructors():
     """Get all instructors with details (admin only)"""
     try:
@@ -974,11 +1260,117 @@ def get_instructors():
         return jsonify({"error": str(e)}), 500
 
 
+@api.route("/api/admin/slow-queries", methods=["GET", "DELETE"])
+def admin_slow_queries():
+    """Recent slow SQL statements recorded by this worker process (admin only). DELETE clears the log."""
+    try:
+        admin_user_id = request.args.get("admin_user_id")
+        ok, err = require_admin(admin_user_id)
+        if not ok:
+            return err
+
+        if request.method == "DELETE":
+            slow_queries.clear()
+            return jsonify({"success": True, "message": "Slow query log cleared"})
+
+        limit = request.args.get("limit", type=int)
+        return jsonify({
+            "success": True,
+            "worker_pid": os.getpid(),
+            "threshold_ms": slow_queries.SLOW_QUERY_MS,
+            "explain_sample_rate": slow_queries.SLOW_QUERY_EXPLAIN_SAMPLE,
+            "queries": slow_queries.recent(limit)
+        })
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@api.route("/api/admin/jobs", methods=["GET"])
+def admin_jobs():
+    """Background job queue depth and the most recent dead jobs (admin only)"""
+    try:
+        admin_user_id = request.args.get("admin_user_id")
+        ok, err = require_admin(admin_user_id)
+        if not ok:
+            return err
+        conn = get_connection()
+        depth = jobs.queue_depth(conn)
+        cur = conn.cursor()
+        cur.execute("""
+            SELECT job_id, kind, payload, attempts, last_error, created_at
+            FROM public.job
+            WHERE status = 'dead'
+            ORDER BY job_id DESC
+            LIMIT 50
+        """)
+        dead = [{
+            "job_id": r[0],
+            "kind": r[1],
+            "payload": r[2],
+            "attempts": r[3],
+            "last_error": r[4],
+            "created_at": r[5].isoformat() if r[5] else None
+        } for r in cur.fetchall()]
+        cur.close()
+        conn.close()
+        return jsonify({"depth": depth, "dead": dead})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@api.route("/api/admin/jobs/<int:job_id>/retry", methods=["POST"])
+def retry_job(job_id):
+    """Requeue a dead background job with a fresh set of attempts (admin only)"""
+    try:
+        data = request.get_json(silent=True) or {}
+        admin_user_id = data.get("admin_user_id")
+        ok, err = require_admin(admin_user_id)
+        if not ok:
+            return err
+        conn = get_connection()
+        retried = jobs.retry_dead(conn, job_id)
+        conn.close()
+        if not retried:
+            return jsonify({"error": "Dead job not found"}), 404
+        return jsonify({"success": True, "message": "Job requeued"})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@api.route("/api/admin/profiles", methods=["GET"])
+def admin_profiles():
+    """List stored request profiles (admin only). Profile a request by sending X-Profile: <admin user_id>."""
+    try:
+        admin_user_id = request.args.get("admin_user_id")
+        ok, err = require_admin(admin_user_id)
+        if not ok:
+            return err
+        return jsonify({"success": True, "profiles": profiling.list_runs()})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@api.route("/api/admin/profiles/<profile_id>/<kind>", methods=["GET"])
+def admin_profile_report(profile_id, kind):
+    """Download a stored profile report (admin only). kind is 'folded' (flamegraph stacks) or 'allocations'."""
+    try:
+        admin_user_id = request.args.get("admin_user_id")
+        ok, err = require_admin(admin_user_id)
+        if not ok:
+            return err
+        path = profiling.report_path(profile_id, kind)
+        if not path:
+            return jsonify({"error": "Profile not found"}), 404
+        return send_file(path, mimetype="text/plain")
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
 # =============================
 # INSTRUCTOR ROUTES
 # =============================
 
-@app.route("/api/instructor/profile", methods=["GET"])
+@api.route("/api/instructor/profile", methods=["GET"])
 def get_instructor_profile():
     """Get instructor personal information"""
     try:
@@ -1017,7 +1409,7 @@ def get_instructor_profile():
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/api/instructor/profile", methods=["PUT"])
+@api.route("/api/instructor/profile", methods=["PUT"])
 def update_instructor_profile():
     """Update instructor personal information (except name, email, password)"""
     try:
@@ -1063,7 +1455,7 @@ def update_instructor_profile():
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/api/instructor/courses", methods=["GET"])
+@api.route("/api/instructor/courses", methods=["GET"])
 def get_instructor_courses():
     """Get all courses taught by an instructor"""
     try:
@@ -1106,7 +1498,40 @@ def get_instructor_courses():
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/api/instructor/courses/<course_id>/students", methods=["GET"])
+# The course roster (wire.py), its JSON built by Postgres when
+# JSON_RENDERING=db, with each student's assignment totals (from
+# idx_submission_student) in the same statement. The totals are LEFT JOINed so
+# Postgres drops them when no assignment field is asked for.
+COURSE_STUDENTS_LIST = wire.ListQuery("students", {
+    "user_id": "u.user_id::text",
+    "name": "u.name",
+    "email": "u.email",
+    "status": "e.status",
+    "grade": "e.grade",
+    "enroll_date": "e.enroll_date::text",
+    "completion_date": "e.completion_date::text",
+    "assignment_total_obtained": "t.obtained",
+    "assignment_total_possible": "t.possible",
+    "assignment_percent": """CASE WHEN t.possible = 0 THEN 0
+                                  WHEN p.tenths - floor(p.tenths) = 0.5
+                                  THEN (floor(p.tenths) + floor(p.tenths)::bigint %% 2) / 10
+                                  ELSE round(p.tenths) / 10 END""",
+}, source="""FROM public.enrolled_in e
+    JOIN public.users u ON u.user_id = e.user_id
+    LEFT JOIN LATERAL (
+        SELECT COALESCE(SUM(s.marks_obtained), 0) AS obtained, COALESCE(SUM(a.max_marks), 0) AS possible
+        FROM public.assignment_submission s
+        JOIN public.assignment a ON a.assignment_id = s.assignment_id
+        WHERE s.student_id = e.user_id AND a.course_id = e.course_id
+    ) t ON true
+    -- The percentage in tenths, computed in floating point like Python's
+    -- round(obtained / possible * 100, 1), which rounds halves to even
+    LEFT JOIN LATERAL (SELECT t.obtained::float8 / NULLIF(t.possible, 0) * 100 * 10 AS tenths) p ON true
+    WHERE e.course_id = %s AND e.status != 'dropped'""", order_by="u.name")
+
+
+@api.route("/api/instructor/courses/<course_id>/students", methods=["GET"])
+@cache.cached(ttl=30, tags=["course:{course_id}", "table:users"])
 def get_course_students(course_id):
     """Get all students enrolled in a course (instructor only)"""
     try:
@@ -1118,60 +1543,22 @@ def get_course_students(course_id):
         conn = get_connection()
         cur = conn.cursor()
 
-        cur.execute("""
-            SELECT COUNT(*) FROM public.teaches
-            WHERE instructor_id = %s AND course_id = %s
-        """, (instructor_id, course_id))
+        prepared.execute(cur, TEACHES_COURSE, (instructor_id, course_id))
 
         if cur.fetchone()[0] == 0:
             return jsonify({"error": "You don't teach this course"}), 403
 
-        cur.execute("""
-            SELECT u.user_id, u.name, u.email, e.status, e.grade, 
-                   e.enroll_date, e.completion_date
-            FROM public.enrolled_in e
-            JOIN public.users u ON u.user_id = e.user_id
-            WHERE e.course_id = %s AND e.status != 'dropped'
-            ORDER BY u.name
-        """, (course_id,))
-
-        students = cur.fetchall()
-
-        students_list = []
-        for student in students:
-            cur.execute("""
-                SELECT COALESCE(SUM(s.marks_obtained), 0), COALESCE(SUM(a.max_marks), 0)
-                FROM public.assignment_submission s
-                JOIN public.assignment a ON a.assignment_id = s.assignment_id
-                WHERE s.student_id = %s AND a.course_id = %s
-            """, (student[0], course_id))
-            tot = cur.fetchone()
-            obtained = tot[0] or 0
-            possible = tot[1] or 0
-            percent = round(obtained / possible * 100, 1) if possible > 0 else 0
-            students_list.append({
-                "user_id": str(student[0]),
-                "name": student[1],
-                "email": student[2],
-                "status": student[3],
-                "grade": student[4],
-                "enroll_date": str(student[5]) if student[5] else None,
-                "completion_date": str(student[6]) if student[6] else None,
-                "assignment_total_obtained": obtained,
-                "assignment_total_possible": possible,
-                "assignment_percent": percent
-            })
-
+        # One statement with each student's totals, whichever way it is rendered
+        response = wire.respond(cur, COURSE_STUDENTS_LIST, (course_id,), db_json=JSON_RENDERING == "db")
         cur.close()
         conn.close()
-
-        return jsonify({"success": True, "students": students_list})
+        return response
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/api/instructor/grade", methods=["POST"])
+@api.route("/api/instructor/grade", methods=["POST"])
 def grade_student():
     """Grade a student (instructor only)"""
     try:
@@ -1198,10 +1585,7 @@ def grade_student():
         cur = conn.cursor()
 
         # Verify instructor teaches this course
-        cur.execute("""
-            SELECT COUNT(*) FROM public.teaches
-            WHERE instructor_id = %s AND course_id = %s
-        """, (instructor_id, course_id))
+        prepared.execute(cur, TEACHES_COURSE, (instructor_id, course_id))
 
         if cur.fetchone()[0] == 0:
             return jsonify({"error": "You don't teach this course"}), 403
@@ -1232,8 +1616,14 @@ def grade_student():
             SET grade = %s, status = %s, completion_date = CURRENT_DATE
             WHERE user_id = %s AND course_id = %s
         """, (grade_normalized, status, student_id, course_id))
+        events.publish(cur, "final_grade", {
+            "course_id": course_id,
+            "grade": grade_normalized,
+            "status": status
+        }, course_id=course_id, user_id=student_id)
 
         conn.commit()
+        cache.invalidate(cur, f"user:{student_id}", f"course:{course_id}", "table:enrolled_in")
         cur.close()
         conn.close()
 
@@ -1243,7 +1633,7 @@ def grade_student():
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/api/instructor/remove-student", methods=["POST"])
+@api.route("/api/instructor/remove-student", methods=["POST"])
 def remove_student_from_course():
     """Remove a student from course (instructor only)"""
     try:
@@ -1259,10 +1649,7 @@ def remove_student_from_course():
         cur = conn.cursor()
 
         # Verify instructor teaches this course
-        cur.execute("""
-            SELECT COUNT(*) FROM public.teaches
-            WHERE instructor_id = %s AND course_id = %s
-        """, (instructor_id, course_id))
+        prepared.execute(cur, TEACHES_COURSE, (instructor_id, course_id))
 
         if cur.fetchone()[0] == 0:
             return jsonify({"error": "You don't teach this course"}), 403
@@ -1283,24 +1670,29 @@ def remove_student_from_course():
             conn.close()
             return jsonify({"error": "Student already has a final grade and cannot be removed from the course"}), 400
 
-        # Update status to dropped
+        # Update status to dropped; the freed seat goes to the head of the
+        # waitlist in the same transaction (queue lock first, then the seat)
+        cur.execute("SELECT public.lock_course_waitlist(%s::uuid)", (course_id,))
         cur.execute("""
             UPDATE public.enrolled_in
             SET status = 'dropped'
             WHERE user_id = %s AND course_id = %s
         """, (student_id, course_id))
+        promoted = promote_waitlisted(cur, course_id)
 
         conn.commit()
+        cache.invalidate(cur, f"user:{student_id}", f"course:{course_id}", *(f"user:{u}" for u in promoted),
+                         "table:enrolled_in")
         cur.close()
         conn.close()
 
-        return jsonify({"success": True, "message": "Student removed from course"})
+        return jsonify({"success": True, "message": "Student removed from course", "promoted": promoted})
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/api/instructor/courses/<course_id>/modules", methods=["GET"])
+@api.route("/api/instructor/courses/<course_id>/modules", methods=["GET"])
 def get_course_modules(course_id):
     """Get all modules for a course"""
     try:
@@ -1312,10 +1704,7 @@ def get_course_modules(course_id):
         cur = conn.cursor()
 
         # Verify instructor teaches this course
-        cur.execute("""
-            SELECT COUNT(*) FROM public.teaches
-            WHERE instructor_id = %s AND course_id = %s
-        """, (instructor_id, course_id))
+        prepared.execute(cur, TEACHES_COURSE, (instructor_id, course_id))
 
         if cur.fetchone()[0] == 0:
             return jsonify({"error": "You don't teach this course"}), 403
@@ -1345,7 +1734,7 @@ def get_course_modules(course_id):
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/api/instructor/courses/<course_id>/announcements", methods=["GET"])
+@api.route("/api/instructor/courses/<course_id>/announcements", methods=["GET"])
 def get_instructor_announcements(course_id):
     """Get all announcements for a course (instructor)"""
     try:
@@ -1355,10 +1744,7 @@ def get_instructor_announcements(course_id):
 
         conn = get_connection()
         cur = conn.cursor()
-        cur.execute("""
-            SELECT COUNT(*) FROM public.teaches
-            WHERE instructor_id = %s AND course_id = %s
-        """, (instructor_id, course_id))
+        prepared.execute(cur, TEACHES_COURSE, (instructor_id, course_id))
         if cur.fetchone()[0] == 0:
             cur.close()
             conn.close()
@@ -1389,7 +1775,7 @@ def get_instructor_announcements(course_id):
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/api/instructor/announcement", methods=["POST"])
+@api.route("/api/instructor/announcement", methods=["POST"])
 def create_announcement():
     """Create announcement for a course (instructor only)"""
     try:
@@ -1404,10 +1790,7 @@ def create_announcement():
 
         conn = get_connection()
         cur = conn.cursor()
-        cur.execute("""
-            SELECT COUNT(*) FROM public.teaches
-            WHERE instructor_id = %s AND course_id = %s
-        """, (instructor_id, course_id))
+        prepared.execute(cur, TEACHES_COURSE, (instructor_id, course_id))
         if cur.fetchone()[0] == 0:
             cur.close()
             conn.close()
@@ -1419,6 +1802,12 @@ def create_announcement():
             RETURNING announcement_id, title, content, created_at
         """, (course_id, instructor_id, title, content))
         row = cur.fetchone()
+        events.publish(cur, "announcement_created", {
+            "announcement_id": str(row[0]),
+            "course_id": course_id,
+            "title": row[1],
+            "created_at": str(row[3]) if row[3] else None
+        }, course_id=course_id)
         conn.commit()
         cur.close()
         conn.close()
@@ -1437,7 +1826,7 @@ def create_announcement():
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/api/instructor/announcement/<announcement_id>", methods=["DELETE"])
+@api.route("/api/instructor/announcement/<announcement_id>", methods=["DELETE"])
 def delete_announcement(announcement_id):
     """Delete an announcement (instructor only; must teach the course and own the announcement)."""
     try:
@@ -1467,10 +1856,7 @@ def delete_announcement(announcement_id):
             return jsonify({"error": "You can only delete your own announcements"}), 403
 
         # Ensure the instructor still teaches the course
-        cur.execute("""
-            SELECT COUNT(*) FROM public.teaches
-            WHERE instructor_id = %s AND course_id = %s
-        """, (instructor_id, course_id))
+        prepared.execute(cur, TEACHES_COURSE, (instructor_id, course_id))
         if cur.fetchone()[0] == 0:
             cur.close()
             conn.close()
@@ -1494,7 +1880,7 @@ def delete_announcement(announcement_id):
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/api/instructor/module", methods=["POST"])
+@api.route("/api/instructor/module", methods=["POST"])
 def create_module():
     """Create a new module for a course (instructor only)"""
     try:
@@ -1512,10 +1898,7 @@ def create_module():
         cur = conn.cursor()
 
         # Verify instructor teaches this course
-        cur.execute("""
-            SELECT COUNT(*) FROM public.teaches
-            WHERE instructor_id = %s AND course_id = %s
-        """, (instructor_id, course_id))
+        prepared.execute(cur, TEACHES_COURSE, (instructor_id, course_id))
 
         if cur.fetchone()[0] == 0:
             return jsonify({"error": "You don't teach this course"}), 403
@@ -1549,7 +1932,7 @@ def create_module():
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/api/instructor/module-content", methods=["POST"])
+@api.route("/api/instructor/module-content", methods=["POST"])
 def add_module_content():
     """Add content to a module (instructor only)"""
     try:
@@ -1568,10 +1951,7 @@ def add_module_content():
         cur = conn.cursor()
 
         # Verify instructor teaches this course
-        cur.execute("""
-            SELECT COUNT(*) FROM public.teaches
-            WHERE instructor_id = %s AND course_id = %s
-        """, (instructor_id, course_id))
+        prepared.execute(cur, TEACHES_COURSE, (instructor_id, course_id))
 
         if cur.fetchone()[0] == 0:
             return jsonify({"error": "You don't teach this course"}), 403
@@ -1611,7 +1991,7 @@ def add_module_content():
 # ASSIGNMENT ROUTES
 # =============================
 
-@app.route("/api/instructor/assignment", methods=["POST"])
+@api.route("/api/instructor/assignment", methods=["POST"])
 def create_assignment():
     """Create assignment for a course (instructor only). Each assignment 20 marks, total 100."""
     try:
@@ -1631,10 +2011,7 @@ def create_assignment():
         conn = get_connection()
         cur = conn.cursor()
 
-        cur.execute("""
-            SELECT COUNT(*) FROM public.teaches
-            WHERE instructor_id = %s AND course_id = %s
-        """, (instructor_id, course_id))
+        prepared.execute(cur, TEACHES_COURSE, (instructor_id, course_id))
         if cur.fetchone()[0] == 0:
             cur.close()
             conn.close()
@@ -1649,6 +2026,7 @@ def create_assignment():
 
         assignment_id = cur.fetchone()[0]
         conn.commit()
+        cache.invalidate(cur, "table:assignment")
         cur.close()
         conn.close()
 
@@ -1662,7 +2040,7 @@ def create_assignment():
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/api/instructor/courses/<course_id>/assignments", methods=["GET"])
+@api.route("/api/instructor/courses/<course_id>/assignments", methods=["GET"])
 def get_instructor_assignments(course_id):
     """Get assignments for a course (instructor)"""
     try:
@@ -1673,10 +2051,7 @@ def get_instructor_assignments(course_id):
         conn = get_connection()
         cur = conn.cursor()
 
-        cur.execute("""
-            SELECT COUNT(*) FROM public.teaches
-            WHERE instructor_id = %s AND course_id = %s
-        """, (instructor_id, course_id))
+        prepared.execute(cur, TEACHES_COURSE, (instructor_id, course_id))
         if cur.fetchone()[0] == 0:
             cur.close()
             conn.close()
@@ -1714,7 +2089,7 @@ def get_instructor_assignments(course_id):
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/api/student/courses/<course_id>/assignments", methods=["GET"])
+@api.route("/api/student/courses/<course_id>/assignments", methods=["GET"])
 def get_student_assignments(course_id):
     """Get assignments for a course (student - enrolled only)"""
     try:
@@ -1774,7 +2149,7 @@ def get_student_assignments(course_id):
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/api/student/assignment/submit", methods=["POST"])
+@api.route("/api/student/assignment/submit", methods=["POST"])
 def submit_assignment():
     """Submit assignment solution (student)"""
     try:
@@ -1817,6 +2192,7 @@ def submit_assignment():
         """, (assignment_id, student_id, submission_url))
 
         conn.commit()
+        cache.invalidate(cur, f"course:{assign[0]}")
         cur.close()
         conn.close()
 
@@ -1826,7 +2202,7 @@ def submit_assignment():
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/api/instructor/assignments/<assignment_id>/submissions", methods=["GET"])
+@api.route("/api/instructor/assignments/<assignment_id>/submissions", methods=["GET"])
 def get_assignment_submissions(assignment_id):
     """Get all submissions for an assignment (instructor)"""
     try:
@@ -1846,10 +2222,6 @@ def get_assignment_submissions(assignment_id):
             conn.close()
             return jsonify({"error": "Assignment not found or you don't own it"}), 403
 
-        cur.execute("SELECT course_id FROM public.assignment WHERE assignment_id = %s", (assignment_id,))
-        course_id_row = cur.fetchone()
-        course_id = str(course_id_row[0]) if course_id_row else None
-
         cur.execute("""
             SELECT s.submission_id, s.student_id, u.name, u.email, s.submission_url,
                    s.submitted_at, s.marks_obtained, s.feedback, a.max_marks
@@ -1859,35 +2231,27 @@ def get_assignment_submissions(assignment_id):
             WHERE s.assignment_id = %s
             ORDER BY s.submitted_at DESC
         """, (assignment_id,))
-
         rows = cur.fetchall()
 
-        submissions = []
-        if course_id:
-            student_ids = list(set(row[1] for row in rows))
-            course_totals = {}
-            for sid in student_ids:
-                cur.execute("""
-                    SELECT COALESCE(SUM(s2.marks_obtained), 0), COALESCE(SUM(a2.max_marks), 0)
-                    FROM public.assignment_submission s2
-                    JOIN public.assignment a2 ON a2.assignment_id = s2.assignment_id
-                    WHERE s2.student_id = %s AND a2.course_id = %s
-                """, (sid, course_id))
-                tot = cur.fetchone()
-                obtained = tot[0] or 0
-                possible = tot[1] or 0
-                percent = round(obtained / possible * 100, 1) if possible > 0 else 0
-                course_totals[str(sid)] = {"obtained": obtained, "possible": possible, "percent": percent}
-
+        # Each submitter's totals over the course's assignments, in one grouped query
+        cur.execute("""
+            SELECT s2.student_id, COALESCE(SUM(s2.marks_obtained), 0), COALESCE(SUM(a2.max_marks), 0)
+            FROM public.assignment_submission s2
+            JOIN public.assignment a2 ON a2.assignment_id = s2.assignment_id
+            WHERE a2.course_id = (SELECT course_id FROM public.assignment WHERE assignment_id = %s)
+              AND s2.student_id = ANY(%s::uuid[])
+            GROUP BY s2.student_id
+        """, (assignment_id, list({str(row[1]) for row in rows})))
+        course_totals = {str(sid): (obtained, possible) for sid, obtained, possible in cur.fetchall()}
         cur.close()
         conn.close()
 
+        submissions = []
         for row in rows:
-            sid = str(row[1])
-            ct = course_totals.get(sid, {"obtained": 0, "possible": 0, "percent": 0})
+            obtained, possible = course_totals.get(str(row[1]), (0, 0))
             submissions.append({
                 "submission_id": str(row[0]),
-                "student_id": sid,
+                "student_id": str(row[1]),
                 "student_name": row[2],
                 "student_email": row[3],
                 "submission_url": row[4],
@@ -1895,9 +2259,9 @@ def get_assignment_submissions(assignment_id):
                 "marks_obtained": row[6],
                 "feedback": row[7],
                 "max_marks": row[8],
-                "course_total_obtained": ct["obtained"],
-                "course_total_possible": ct["possible"],
-                "course_percent": ct["percent"]
+                "course_total_obtained": obtained,
+                "course_total_possible": possible,
+                "course_percent": round(obtained / possible * 100, 1) if possible > 0 else 0
             })
 
         return jsonify({"success": True, "submissions": submissions})
@@ -1906,7 +2270,117 @@ def get_assignment_submissions(assignment_id):
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/api/instructor/submission/grade", methods=["POST"])
+# Ungraded submissions of the assignments an instructor owns in the courses they
+# teach, in keyset order (sort key, submitted_at, submission_id). The sort key
+# is the assignment's due date (undated last) for order=due and constant for
+# order=submitted. Assignments before the cursor's sort key are skipped; the
+# rest each contribute at most one page from the partial index
+# idx_submission_ungraded, seeking past the cursor on the cursor's own key.
+NEEDS_GRADING_SQL = """
+    SELECT s.submission_id, s.assignment_id, a.title, a.course_id, c.title, a.due_date, a.max_marks,
+           s.student_id, u.name, s.submission_url, s.submitted_at
+    FROM public.teaches t
+    JOIN public.assignment a ON a.course_id = t.course_id AND a.instructor_id = t.instructor_id
+    CROSS JOIN LATERAL (
+        SELECT CASE WHEN %(by_due)s THEN COALESCE(a.due_date, 'infinity') ELSE '-infinity' END::timestamp AS sort_key
+    ) k
+    CROSS JOIN LATERAL (
+        SELECT submission_id, assignment_id, student_id, submission_url, submitted_at
+        FROM public.assignment_submission
+        WHERE assignment_id = a.assignment_id AND marks_obtained IS NULL
+          AND (submitted_at, submission_id) > (
+              CASE WHEN k.sort_key > %(after_key)s::timestamp THEN '-infinity' ELSE %(after_at)s::timestamp END,
+              CASE WHEN k.sort_key > %(after_key)s::timestamp
+                   THEN '00000000-0000-0000-0000-000000000000' ELSE %(after_id)s::uuid END
+          )
+        ORDER BY submitted_at, submission_id
+        LIMIT %(limit)s
+    ) s
+    JOIN public.course c ON c.course_id = a.course_id
+    JOIN public.users u ON u.user_id = s.student_id
+    WHERE t.instructor_id = %(instructor_id)s AND k.sort_key >= %(after_key)s::timestamp
+    ORDER BY k.sort_key, s.submitted_at, s.submission_id
+    LIMIT %(limit)s
+"""
+NEEDS_GRADING_ORDERS = ("submitted", "due")
+
+
+def _timestamp_param(value):
+    """A timestamp from a cursor, as text for Postgres (also accepts +/-infinity)."""
+    if value not in ("infinity", "-infinity"):
+        datetime.fromisoformat(value)
+    return value
+
+
+@api.route("/api/instructor/needs-grading", methods=["GET"])
+def get_needs_grading():
+    """Ungraded submissions across the instructor's courses, oldest submission
+    (order=submitted) or earliest due date (order=due) first. Pass the returned
+    next_cursor as `after` to get the following page."""
+    try:
+        instructor_id = request.args.get("instructor_id")
+        if not instructor_id:
+            return jsonify({"error": "instructor_id is required"}), 400
+        order = request.args.get("order", "submitted")
+        if order not in NEEDS_GRADING_ORDERS:
+            return jsonify({"error": "order must be one of: submitted, due"}), 400
+        limit = min(max(request.args.get("limit", PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+
+        after_key, after_at, after_id = "-infinity", "-infinity", "00000000-0000-0000-0000-000000000000"
+        after = request.args.get("after")
+        if after:
+            try:
+                after_key, after_at, after_id = after.split("_")
+                _timestamp_param(after_key)
+                _timestamp_param(after_at)
+                uuid.UUID(after_id)
+            except ValueError:
+                return jsonify({"error": "Invalid cursor"}), 400
+
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute(NEEDS_GRADING_SQL, {
+            "by_due": order == "due",
+            "after_key": after_key,
+            "after_at": after_at,
+            "after_id": after_id,
+            "limit": limit,
+            "instructor_id": instructor_id
+        })
+        rows = cur.fetchall()
+        cur.close()
+        conn.close()
+
+        submissions = []
+        for row in rows:
+            submissions.append({
+                "submission_id": str(row[0]),
+                "assignment_id": str(row[1]),
+                "assignment_title": row[2],
+                "course_id": str(row[3]),
+                "course_title": row[4],
+                "due_date": str(row[5]) if row[5] else None,
+                "max_marks": row[6],
+                "student_id": str(row[7]),
+                "student_name": row[8],
+                "submission_url": row[9],
+                "submitted_at": str(row[10]) if row[10] else None
+            })
+        next_cursor = None
+        if len(rows) == limit and rows[-1][10]:
+            last = rows[-1]
+            if order == "due":
+                sort_key = last[5].isoformat() if last[5] else "infinity"
+            else:
+                sort_key = "-infinity"
+            next_cursor = f"{sort_key}_{last[10].isoformat()}_{last[0]}"
+        return jsonify({"success": True, "submissions": submissions, "next_cursor": next_cursor})
+
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@api.route("/api/instructor/submission/grade", methods=["POST"])
 def grade_submission():
     """Grade an assignment submission (instructor)"""
     try:
@@ -1933,11 +2407,11 @@ def grade_submission():
             return jsonify({"error": "Submission not found or you cannot grade it"}), 403
 
         cur.execute("""
-            SELECT max_marks FROM public.assignment a
+            SELECT a.max_marks, a.course_id FROM public.assignment a
             JOIN public.assignment_submission s ON s.assignment_id = a.assignment_id
             WHERE s.submission_id = %s
         """, (submission_id,))
-        max_marks = cur.fetchone()[0]
+        max_marks, course_id = cur.fetchone()
         if marks_obtained < 0 or marks_obtained > max_marks:
             cur.close()
             conn.close()
@@ -1947,9 +2421,18 @@ def grade_submission():
             UPDATE public.assignment_submission
             SET marks_obtained = %s, feedback = %s
             WHERE submission_id = %s
+            RETURNING student_id, assignment_id
         """, (marks_obtained, feedback, submission_id))
+        student_id, assignment_id = cur.fetchone()
+        events.publish(cur, "submission_graded", {
+            "submission_id": submission_id,
+            "assignment_id": str(assignment_id),
+            "marks_obtained": marks_obtained,
+            "max_marks": max_marks
+        }, user_id=student_id)
 
         conn.commit()
+        cache.invalidate(cur, f"course:{course_id}")
         cur.close()
         conn.close()
 
@@ -1963,7 +2446,7 @@ def grade_submission():
 # STUDENT COURSE CONTENT ROUTES
 # =============================
 
-@app.route("/api/student/courses/<course_id>/modules", methods=["GET"])
+@api.route("/api/student/courses/<course_id>/modules", methods=["GET"])
 def get_student_course_modules(course_id):
     """Get modules and content for a course (student only)"""
     try:
@@ -1974,60 +2457,22 @@ def get_student_course_modules(course_id):
         conn = get_connection()
         cur = conn.cursor()
 
-        # Verify student is enrolled in this course
-        cur.execute("""
-            SELECT COUNT(*) FROM public.enrolled_in
-            WHERE user_id = %s AND course_id = %s AND status != 'dropped'
-        """, (user_id, course_id))
-
-        if cur.fetchone()[0] == 0:
-            return jsonify({"error": "You are not enrolled in this course"}), 403
-
-        # Get modules with their content
-        cur.execute("""
-            SELECT m.module_number, m.name, m.duration,
-                   mc.content_id, mc.title, mc.type, mc.url
-            FROM public.module m
-            LEFT JOIN public.module_content mc ON mc.course_id = m.course_id 
-                AND mc.module_number = m.module_number
-            WHERE m.course_id = %s
-            ORDER BY m.module_number, mc.content_id
-        """, (course_id,))
-
-        rows = cur.fetchall()
+        # Enrollment check plus the course's compiled module tree (see course_content.py)
+        enrolled, modules = course_content.student_modules(cur, user_id, course_id)
+        conn.commit()
         cur.close()
         conn.close()
 
-        # Organize modules and content
-        modules_dict = {}
-        for row in rows:
-            module_num = row[0]
-            if module_num not in modules_dict:
-                modules_dict[module_num] = {
-                    "module_number": module_num,
-                    "name": row[1],
-                    "duration": row[2],
-                    "content": []
-                }
-            
-            # Add content if exists
-            if row[3]:  # content_id
-                modules_dict[module_num]["content"].append({
-                    "content_id": str(row[3]),
-                    "title": row[4],
-                    "type": row[5],
-                    "url": row[6]
-                })
-
-        modules_list = list(modules_dict.values())
+        if not enrolled:
+            return jsonify({"error": "You are not enrolled in this course"}), 403
 
-        return jsonify({"success": True, "modules": modules_list})
+        return Response('{"success":true,"modules":' + modules + '}', mimetype="application/json")
 
     except Exception as e:
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/api/student/courses/<course_id>/announcements", methods=["GET"])
+@api.route("/api/student/courses/<course_id>/announcements", methods=["GET"])
 def get_student_announcements(course_id):
     """Get announcements for a course (student - enrolled only)"""
     try:
@@ -2069,11 +2514,114 @@ def get_student_announcements(course_id):
         return jsonify({"error": str(e)}), 500
 
 
+# Announcements from all of a student's active enrollments, newest first. Each
+# enrollment contributes at most one page from idx_announcement_course_feed,
+# starting below the keyset cursor, and the pieces are merged, so one
+# statement serves a page whatever the number of courses.
+ANNOUNCEMENT_FEED_SQL = """
+    SELECT a.announcement_id, a.course_id, c.title, a.title, a.content, a.created_at,
+           COALESCE(a.created_at > COALESCE(s.announcements_seen_at, '-infinity'), false)
+    FROM public.student s
+    JOIN public.enrolled_in e ON e.user_id = s.user_id AND e.status != 'dropped'
+    CROSS JOIN LATERAL (
+        SELECT announcement_id, course_id, title, content, created_at
+        FROM public.announcement
+        WHERE course_id = e.course_id
+          AND (created_at, announcement_id) < (%s::timestamp, %s::uuid)
+        ORDER BY created_at DESC, announcement_id DESC
+        LIMIT %s
+    ) a
+    JOIN public.course c ON c.course_id = a.course_id
+    WHERE s.user_id = %s
+    ORDER BY a.created_at DESC, a.announcement_id DESC
+    LIMIT %s
+"""
+
+
+@api.route("/api/student/announcements", methods=["GET"])
+def get_student_announcement_feed():
+    """Announcements from all of the student's courses, newest first.
+    Pass the returned next_cursor as `before` to get the following page."""
+    try:
+        user_id = request.args.get("user_id")
+        if not user_id:
+            return jsonify({"error": "user_id is required"}), 400
+        limit = min(max(request.args.get("limit", PAGE_SIZE, type=int), 1), MAX_PAGE_SIZE)
+
+        before_at, before_id = "infinity", "ffffffff-ffff-ffff-ffff-ffffffffffff"
+        before = request.args.get("before")
+        if before:
+            try:
+                before_at, before_id = before.split("_")
+                datetime.fromisoformat(before_at)
+                uuid.UUID(before_id)
+            except ValueError:
+                return jsonify({"error": "Invalid cursor"}), 400
+
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute(ANNOUNCEMENT_FEED_SQL, (before_at, before_id, limit, user_id, limit))
+        rows = cur.fetchall()
+        cur.close()
+        conn.close()
+
+        announcements = []
+        for row in rows:
+            announcements.append({
+                "announcement_id": str(row[0]),
+                "course_id": str(row[1]),
+                "course_title": row[2],
+                "title": row[3],
+                "content": row[4],
+                "created_at": str(row[5]) if row[5] else None,
+                "unread": row[6]
+            })
+        next_cursor = None
+        if len(rows) == limit and rows[-1][5]:
+            next_cursor = f"{rows[-1][5].isoformat()}_{rows[-1][0]}"
+        return jsonify({"success": True, "announcements": announcements, "next_cursor": next_cursor})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
+@api.route("/api/student/announcements/seen", methods=["POST"])
+def mark_announcements_seen():
+    """Mark the student's feed read up to `seen_at` (default: now); never moves backwards"""
+    try:
+        data = request.get_json()
+        user_id = data.get("user_id")
+        if not user_id:
+            return jsonify({"error": "user_id is required"}), 400
+
+        conn = get_connection()
+        cur = conn.cursor()
+        cur.execute("""
+            UPDATE public.student
+            SET announcements_seen_at = GREATEST(
+                COALESCE(announcements_seen_at, '-infinity'),
+                COALESCE(%s::timestamp, LOCALTIMESTAMP)
+            )
+            WHERE user_id = %s
+        """, (data.get("seen_at"), user_id))
+        updated = cur.rowcount
+        conn.commit()
+        cur.close()
+        conn.close()
+        if updated == 0:
+            return jsonify({"error": "Student not found"}), 404
+        return jsonify({"success": True, "message": "Announcements marked as read"})
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+
+
 # =============================
 # ANALYST ROUTES
 # =============================
 
-@app.route("/api/analyst/overview", methods=["GET"])
+@api.route("/api/analyst/overview", methods=["GET"])
+@cache.cached(ttl=ANALYST_CACHE_TTL, tags=["table:course", "table:enrolled_in", "table:assignment"])
+@singleflight.coalesce
+@reads_from_replica
 def analyst_overview():
     """Get platform overview stats for analyst"""
     try:
@@ -2121,7 +2669,10 @@ def analyst_overview():
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/api/analyst/courses", methods=["GET"])
+@api.route("/api/analyst/courses", methods=["GET"])
+@cache.cached(ttl=ANALYST_CACHE_TTL, tags=["table:course", "table:enrolled_in", "table:assignment"])
+@singleflight.coalesce
+@reads_from_replica
 def analyst_courses():
     """Get all courses with enrollment and completion stats"""
     try:
@@ -2164,7 +2715,10 @@ def analyst_courses():
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/api/analyst/insights", methods=["GET"])
+@api.route("/api/analyst/insights", methods=["GET"])
+@cache.cached(ttl=ANALYST_CACHE_TTL, tags=["table:course", "table:enrolled_in"])
+@singleflight.coalesce
+@reads_from_replica
 def analyst_insights():
     """Get analytical insights"""
     try:
@@ -2286,7 +2840,10 @@ def analyst_insights():
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/api/analyst/course/<course_id>/analytics", methods=["GET"])
+@api.route("/api/analyst/course/<course_id>/analytics", methods=["GET"])
+@cache.cached(ttl=ANALYST_CACHE_TTL, tags=["table:course", "table:enrolled_in", "course:{course_id}"])
+@singleflight.coalesce
+@reads_from_replica
 def analyst_course_analytics(course_id):
     """Get analytics for a single course: grade distribution, enrollment stats (analyst only)."""
     try:
@@ -2352,7 +2909,7 @@ def analyst_course_analytics(course_id):
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/api/student/courses/<course_id>/analytics", methods=["GET"])
+@api.route("/api/student/courses/<course_id>/analytics", methods=["GET"])
 def student_course_analytics(course_id):
     """Get course analytics for an enrolled student, only if analyst has published insights for the course."""
     try:
@@ -2447,7 +3004,7 @@ def student_course_analytics(course_id):
         return jsonify({"error": str(e)}), 500
 
 
-@app.route("/api/analyst/course/<course_id>/insights-setting", methods=["GET", "POST"])
+@api.route("/api/analyst/course/<course_id>/insights-setting", methods=["GET", "POST"])
 def analyst_course_insights_setting(course_id):
     """Get or update whether course insights should be published to students."""
     try:
@@ -2498,11 +3055,19 @@ def analyst_course_insights_setting(course_id):
 # HEALTH CHECK
 # =============================
 
-@app.route("/api/health", methods=["GET"])
+@api.route("/api/health", methods=["GET"])
 def health():
     """Health check endpoint"""
     return jsonify({"status": "ok", "message": "API is running"})
 
 
+@api.route("/api/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Prometheus metrics: route latency, queries per request, pool and Supabase stats"""
+    body, content_type = metrics.render()
+    return Response(body, content_type=content_type)
+
+
 if __name__ == "__main__":
-    app.run(debug=True, port=5000)
+    # Development server only; see wsgi.py / gunicorn.conf.py for production
+    create_app().run(debug=True, port=5000)
@@ -0,0 +1,241 @@
+"""
+ASGI entry point (async serving mode).
+
+/api/login and /api/signup spend almost all of their time waiting on Supabase
+Auth over HTTP. Here they run as native async handlers: Supabase calls share
+one aiohttp session and profile queries go through an asyncpg pool, so a
+login waiting on the network does not hold a worker. Every other route is
+forwarded to the regular Flask app unchanged.
+
+Run with:
+    uvicorn asgi:app --host 0.0.0.0 --port 5000 --workers 2
+"""
+import json
+import math
+import os
+import time
+import uuid
+from contextlib import asynccontextmanager
+
+import aiohttp
+import asyncpg
+from a2wsgi import WSGIMiddleware
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse
+from starlette.routing import Mount, Route
+
+import accounts
+import admission
+import jobs
+import metrics
+from app import create_app, SUPABASE_URL, SUPABASE_ANON_KEY, SUPABASE_SERVICE_KEY
+from db import WORKER_THREADS, get_connection_params, init_pool, close_pool, web_pool_size
+
+# Connections per worker process; each in-flight login holds one only for the
+# duration of its single profile query.
+ASYNC_DB_POOL_SIZE = int(os.getenv("ASYNC_DB_POOL_SIZE", "10"))
+ASYNC_HTTP_MAX_CONNECTIONS = int(os.getenv("ASYNC_HTTP_MAX_CONNECTIONS", "200"))
+SUPABASE_TIMEOUT = float(os.getenv("SUPABASE_TIMEOUT", "10"))
+
+http_session = None
+db_pool = None
+
+
+async def _create_db_pool():
+    params = get_connection_params()
+    return await asyncpg.create_pool(
+        host=params["host"],
+        port=int(params["port"]),
+        user=params["user"],
+        password=params["password"],
+        database=params["database"],
+        ssl="require" if params["sslmode"] == "require" else False,
+        min_size=1,
+        max_size=ASYNC_DB_POOL_SIZE,
+        # The Supabase pooler runs PgBouncer in transaction mode, which does not
+        # support server-side prepared statements.
+        statement_cache_size=0,
+    )
+
+
+@asynccontextmanager
+async def lifespan(_app):
+    global http_session, db_pool
+    http_session = aiohttp.ClientSession(
+        timeout=aiohttp.ClientTimeout(total=SUPABASE_TIMEOUT),
+        connector=aiohttp.TCPConnector(limit=ASYNC_HTTP_MAX_CONNECTIONS),
+    )
+    db_pool = await _create_db_pool()
+    # psycopg2 pool for the Flask routes, sized for the WSGI thread pool below
+    init_pool(*web_pool_size())
+    try:
+        yield
+    finally:
+        await http_session.close()
+        await db_pool.close()
+        close_pool()
+
+
+async def _supabase(operation, method, url, headers, payload=None):
+    """Call Supabase Auth; returns (status_code, parsed JSON body or {})."""
+    start = time.perf_counter()
+    status = "error"
+    try:
+        async with http_session.request(method, url, headers=headers, json=payload) as resp:
+            status = str(resp.status)
+            text = await resp.text()
+            return resp.status, (json.loads(text) if text else {})
+    finally:
+        metrics.observe_supabase(operation, status, time.perf_counter() - start)
+
+
+def _timed(route):
+    """Record request latency for an async handler under the same metrics as Flask routes."""
+    def decorator(handler):
+        async def wrapper(request):
+            start = time.perf_counter()
+            response = await handler(request)
+            metrics.observe_request(request.method, route, str(response.status_code), time.perf_counter() - start)
+            return response
+        return wrapper
+    return decorator
+
+
+def _rate_limited(email):
+    """The 429 response for a login or signup over its caller's auth rate
+    (as admission.py applies to the Flask routes), else None."""
+    if not email:
+        return None
+    wait = admission.rate_limit_wait("auth", f"email:{email}")
+    if not wait:
+        return None
+    metrics.REQUESTS_SHED.labels("auth", "rate_limited").inc()
+    return JSONResponse({"error": "Too many requests, slow down"}, 429,
+                        headers={"Retry-After": str(max(1, math.ceil(wait)))})
+
+
+def _json_reply(reply):
+    """A JSONResponse from one of accounts.py's (body, status[, headers]) replies."""
+    body, status, *headers = reply
+    return JSONResponse(body, status, headers=headers[0] if headers else None)
+
+
+# =============================
+# AUTHENTICATION
+# =============================
+
+@_timed("/api/login")
+async def login(request):
+    """Login endpoint - verifies password via Supabase Auth, returns user data"""
+    try:
+        data = await request.json()
+        email = data.get("email")
+        password = data.get("password", "")
+        limited = _rate_limited(email)
+        if limited:
+            return limited
+
+        if not email or not password:
+            return JSONResponse({"error": "Email and password are required"}, 400)
+
+        if not (SUPABASE_URL and SUPABASE_ANON_KEY):
+            return JSONResponse({"error": "Authentication not configured. Set SUPABASE_URL and SUPABASE_ANON_KEY."}, 500)
+
+        status, auth_data = await _supabase(
+            "token", "POST",
+            f"{SUPABASE_URL}/auth/v1/token?grant_type=password",
+            {"apikey": SUPABASE_ANON_KEY, "Content-Type": "application/json"},
+            {"email": email, "password": password},
+        )
+        if status != 200:
+            return JSONResponse({"error": "Invalid email or password"}, 401)
+        auth_user_id = auth_data.get("user", {}).get("id")
+
+        async with db_pool.acquire() as conn:
+            user = await conn.fetchrow("""
+                SELECT user_id, name, email, role, COALESCE(approved, false)
+                FROM public.users
+                WHERE user_id = $1
+            """, auth_user_id)
+
+        if not user:
+            return JSONResponse({"error": "User profile not found"}, 401)
+
+        if not user[4]:
+            return JSONResponse({"error": "Your account is pending admin approval. Please wait for approval."}, 403)
+
+        return JSONResponse({
+            "success": True,
+            "user": {
+                "user_id": str(user[0]),
+                "name": user[1],
+                "email": user[2],
+                "role": user[3]
+            }
+        })
+
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, 500)
+
+
+@_timed("/api/signup")
+async def signup(request):
+    """Sign up endpoint - creates new user via Supabase Auth (steps in accounts.py)"""
+    try:
+        data = await request.json()
+        limited = _rate_limited(data.get("email"))
+        if limited:
+            return limited
+        fields, error = accounts.parse_signup(data)
+        if error:
+            return _json_reply(error)
+
+        if SUPABASE_URL and SUPABASE_SERVICE_KEY:
+            auth_url, headers, payload = accounts.auth_request(SUPABASE_URL, SUPABASE_SERVICE_KEY, fields)
+            status, auth_user = await _supabase("create_user", "POST", auth_url, headers, payload)
+            if status not in [200, 201]:
+                error_msg = accounts.auth_error(auth_user)
+                # Email already registered in Auth but not in our DB -> queue removal of the orphan
+                if accounts.already_registered(error_msg):
+                    async with db_pool.acquire() as conn:
+                        async with conn.transaction():
+                            row = await conn.fetchrow(accounts.EMAIL_TAKEN_SQL_ASYNCPG, fields["email"])
+                            if not row:
+                                kind, job, dedup_key = accounts.orphan_job(fields["email"])
+                                await conn.execute(jobs.ENQUEUE_SQL_ASYNCPG,
+                                                   *jobs.enqueue_args(kind, job, dedup_key=dedup_key))
+                    if not row:
+                        return _json_reply(accounts.RELEASING)
+                return _json_reply(accounts.signup_failed(error_msg))
+            user_id = auth_user.get("id")
+            first_admin_approved = True
+        else:
+            # Fallback: Create user directly in database (for testing without Supabase Auth)
+            user_id = uuid.uuid4()
+            first_admin_approved = False
+
+        params = accounts.profile_params(fields, user_id, first_admin_approved)
+        async with db_pool.acquire() as conn:
+            approved = await conn.fetchval(accounts.PROFILE_SQL_ASYNCPG, *accounts.profile_args(params))
+
+        return _json_reply(accounts.signup_created(fields, user_id, approved))
+
+    except Exception as e:
+        return JSONResponse({"error": str(e)}, 500)
+
+
+app = Starlette(
+    routes=[
+        Route("/api/login", login, methods=["POST"]),
+        Route("/api/signup", signup, methods=["POST"]),
+        # Everything else is served by the Flask app on a pool of WORKER_THREADS
+        # threads, the thread count admission.py and the psycopg2 pool assume
+        Mount("/", app=WSGIMiddleware(create_app(), workers=WORKER_THREADS)),
+    ],
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["*"], allow_headers=["*"]),
+    ],
+    lifespan=lifespan,
+)
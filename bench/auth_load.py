@@ -0,0 +1,93 @@
+"""
+Concurrent login load test.
+
+Fires --requests logins with --concurrency in flight at once against each
+--url and prints throughput, latency percentiles and status codes, so the
+sync (Flask/WSGI) and async (asgi.py) serving modes can be compared side by
+side against the same stubbed Supabase (see bench/stub_supabase.py):
+
+    python -m bench.auth_load --url http://localhost:5000 --url http://localhost:8000 \
+        --concurrency 500 --requests 5000
+
+Logins use bench-user-<n>@example.com with the stub password; `python -m
+bench.seed` creates matching profile rows. Against an unseeded database the
+API answers 401 "User profile not found", which still exercises the full
+Supabase + database path.
+"""
+import argparse
+import asyncio
+import statistics
+import time
+from collections import Counter
+
+import aiohttp
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+async def run_target(url, total, concurrency, users, password):
+    latencies = []
+    statuses = Counter()
+    semaphore = asyncio.Semaphore(concurrency)
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    timeout = aiohttp.ClientTimeout(total=120)
+
+    async with aiohttp.ClientSession(base_url=url, connector=connector, timeout=timeout) as client:
+        async def one(i):
+            payload = {"email": f"bench-user-{i % users}@example.com", "password": password}
+            async with semaphore:
+                start = time.perf_counter()
+                try:
+                    async with client.post("/api/login", json=payload) as resp:
+                        await resp.read()
+                        statuses[resp.status] += 1
+                except aiohttp.ClientError as e:
+                    statuses[type(e).__name__] += 1
+                latencies.append((time.perf_counter() - start) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(total)))
+        elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    return {
+        "url": url,
+        "requests": total,
+        "concurrency": concurrency,
+        "seconds": round(elapsed, 2),
+        "throughput_rps": round(total / elapsed, 1),
+        "mean_ms": round(statistics.mean(latencies), 1),
+        "p50_ms": round(percentile(latencies, 50), 1),
+        "p95_ms": round(percentile(latencies, 95), 1),
+        "p99_ms": round(percentile(latencies, 99), 1),
+        "statuses": dict(statuses),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", action="append", required=True, help="API base URL (repeatable)")
+    parser.add_argument("--requests", type=int, default=2000)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--users", type=int, default=1000, help="number of distinct bench users to cycle through")
+    parser.add_argument("--password", default="password")
+    args = parser.parse_args()
+
+    results = [asyncio.run(run_target(url, args.requests, args.concurrency, args.users, args.password))
+               for url in args.url]
+
+    print(f"{'target':<32} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}  statuses")
+    for r in results:
+        print(f"{r['url']:<32} {r['throughput_rps']:>8} {r['p50_ms']:>9} {r['p95_ms']:>9} {r['p99_ms']:>9}  {r['statuses']}")
+    if len(results) > 1 and results[0]["throughput_rps"]:
+        for r in results[1:]:
+            print(f"{r['url']}: {r['throughput_rps'] / results[0]['throughput_rps']:.1f}x throughput of {results[0]['url']}")
+
+
+if __name__ == "__main__":
+    main()
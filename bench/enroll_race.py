@@ -0,0 +1,326 @@
+"""
+Enrollment race: many students enrolling in one capped course at once.
+
+Creates a throwaway course with --capacity seats, has --students seeded
+students try to enroll in it from --concurrency threads (one connection
+each) and checks that the course was not oversold:
+
+    python -m bench.enroll_race --capacity 500 --students 2000 --concurrency 64
+
+Strategies (--strategy, repeatable; default all):
+
+  stripes      app.ENROLL_SQL: claim a seat from the course's striped seat
+               counters (migrations/add_seat_reservations.sql)
+  course-lock  lock the course row, count, insert: correct, but serial
+  naive        count, then insert: oversells under concurrency
+
+Prints enrollments/s, the enrolled count against the capacity and, for
+stripes, whether the stripe counters match the enrollments. Then drops a
+few enrollments and refills them to check seats are given back.
+
+With stripes, the students left out then join the course's waitlist
+(migrations/add_course_waitlist.sql) concurrently, a few leave from the
+middle, and --drops enrollments are dropped one at a time the way
+/api/instructor/remove-student does. Checks the queue keeps its order and
+counts positions from 1 at its head, and that each drop promotes the student
+at its head, and prints joins/s and the drop + promotion latency.
+
+Exits non-zero if a correct strategy oversold or the waitlist check fails.
+The course is deleted afterwards.
+"""
+import argparse
+import random
+import sys
+import threading
+import time
+import uuid
+
+from app import ENROLL_SQL, WAITLIST_SQL, promote_waitlisted
+from bench.auth_load import percentile
+from db import get_connection
+
+
+def enroll_stripes(cur, user_id, course_id):
+    cur.execute(ENROLL_SQL, {"course_id": course_id, "user_id": user_id})
+    return cur.rowcount == 1
+
+
+def enroll_course_lock(cur, user_id, course_id):
+    cur.execute("SELECT total_vacancies FROM public.course WHERE course_id = %s FOR UPDATE", (course_id,))
+    capacity = cur.fetchone()[0]
+    cur.execute("""
+        SELECT COUNT(*) FROM public.enrolled_in WHERE course_id = %s AND status != 'dropped'
+    """, (course_id,))
+    if cur.fetchone()[0] >= capacity:
+        return False
+    cur.execute("""
+        INSERT INTO public.enrolled_in(user_id, course_id, status) VALUES (%s, %s, 'ongoing')
+        ON CONFLICT (user_id, course_id) DO NOTHING
+    """, (user_id, course_id))
+    return cur.rowcount == 1
+
+
+def enroll_naive(cur, user_id, course_id):
+    cur.execute("SELECT total_vacancies FROM public.course WHERE course_id = %s", (course_id,))
+    capacity = cur.fetchone()[0]
+    cur.execute("""
+        SELECT COUNT(*) FROM public.enrolled_in WHERE course_id = %s AND status != 'dropped'
+    """, (course_id,))
+    if cur.fetchone()[0] >= capacity:
+        return False
+    cur.execute("""
+        INSERT INTO public.enrolled_in(user_id, course_id, status) VALUES (%s, %s, 'ongoing')
+        ON CONFLICT (user_id, course_id) DO NOTHING
+    """, (user_id, course_id))
+    return cur.rowcount == 1
+
+
+STRATEGIES = {
+    "stripes": enroll_stripes,
+    "course-lock": enroll_course_lock,
+    "naive": enroll_naive,
+}
+
+
+def create_course(capacity):
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("""
+        INSERT INTO public.course (title, level, total_vacancies)
+        VALUES (%s, 'Beginner', %s) RETURNING course_id
+    """, (f"enroll-race-{uuid.uuid4().hex[:8]}", capacity))
+    course_id = str(cur.fetchone()[0])
+    conn.commit()
+    conn.close()
+    return course_id
+
+
+def delete_course(course_id):
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("DELETE FROM public.course WHERE course_id = %s", (course_id,))
+    conn.commit()
+    conn.close()
+
+
+def course_counts(course_id):
+    """(active enrollments, seats taken by the stripe counters or None)"""
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT (SELECT COUNT(*) FROM public.enrolled_in WHERE course_id = %s AND status != 'dropped'),
+               (SELECT taken FROM public.course_seats WHERE course_id = %s)
+    """, (course_id, course_id))
+    enrolled, taken = cur.fetchone()
+    conn.close()
+    return enrolled, taken
+
+
+def race(enroll, course_id, students, concurrency):
+    """Enroll every student from `concurrency` threads; returns (enrolled, errors, seconds, latencies)."""
+    queue = list(students)
+    lock = threading.Lock()
+    results = {"enrolled": 0, "errors": 0}
+    latencies = []
+    start_gate = threading.Barrier(concurrency + 1)
+
+    def worker():
+        conn = get_connection()
+        cur = conn.cursor()
+        start_gate.wait()
+        while True:
+            with lock:
+                if not queue:
+                    break
+                user_id = queue.pop()
+            started = time.perf_counter()
+            try:
+                ok = enroll(cur, user_id, course_id)
+                conn.commit()
+            except Exception:
+                conn.rollback()
+                ok = None
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                latencies.append(elapsed)
+                if ok:
+                    results["enrolled"] += 1
+                elif ok is None:
+                    results["errors"] += 1
+        cur.close()
+        conn.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    start_gate.wait()
+    started = time.perf_counter()
+    for t in threads:
+        t.join()
+    latencies.sort()
+    return results["enrolled"], results["errors"], time.perf_counter() - started, latencies
+
+
+def check_release(course_id, students, drop):
+    """Drop `drop` enrollments and refill them; True if exactly `drop` new students got in."""
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("""
+        UPDATE public.enrolled_in SET status = 'dropped'
+        WHERE (user_id, course_id) IN (
+            SELECT user_id, course_id FROM public.enrolled_in
+            WHERE course_id = %s AND status != 'dropped' LIMIT %s)
+    """, (course_id, drop))
+    conn.commit()
+    refilled = 0
+    for user_id in students:
+        if enroll_stripes(cur, user_id, course_id):
+            refilled += 1
+        conn.commit()
+    conn.close()
+    return refilled == drop
+
+
+def join_waitlist(cur, user_id, course_id):
+    cur.execute("SELECT public.join_course_waitlist(%s::uuid, %s::uuid)", (course_id, user_id))
+    return cur.fetchone()[0] is not None
+
+
+def waitlist_positions(cur, course_id):
+    """Problems with the queue's order: tickets must be distinct, and the
+    positions students see (WAITLIST_SQL) run from 1 at the head to n at the tail."""
+    cur.execute("""
+        SELECT COUNT(*), COUNT(DISTINCT ticket),
+               (ARRAY_AGG(user_id ORDER BY ticket))[1], (ARRAY_AGG(user_id ORDER BY ticket DESC))[1]
+        FROM public.course_waitlist WHERE course_id = %s
+    """, (course_id,))
+    count, distinct, head, tail = cur.fetchone()
+    if not count:
+        return []
+    problems = [] if count == distinct else [f"waitlist of {count} has {distinct} distinct tickets"]
+    for user_id, expected in ((head, 1), (tail, count)):
+        cur.execute(WAITLIST_SQL + " AND w.course_id = %s::uuid", (user_id, course_id))
+        position, waiting = cur.fetchone()[2:4]
+        if (position, waiting) != (expected, count):
+            problems.append(f"position {position} of {waiting} shown where {expected} of {count} was due")
+    return problems
+
+
+def check_waitlist(course_id, concurrency, drops):
+    """Queue everyone not enrolled, then drop enrollments one at a time.
+    Returns (problems, joins/s, drop latencies in ms)."""
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("""
+        SELECT s.user_id FROM public.student s
+        WHERE NOT EXISTS (SELECT 1 FROM public.enrolled_in e WHERE e.user_id = s.user_id AND e.course_id = %s)
+        ORDER BY random() LIMIT 2000
+    """, (course_id,))
+    waiting = [str(r[0]) for r in cur.fetchall()]
+    conn.commit()
+
+    joined, errors, seconds, _ = race(join_waitlist, course_id, waiting, concurrency)
+    problems = [f"{errors} joins failed"] if errors else []
+    if joined != len(waiting):
+        problems.append(f"{joined} of {len(waiting)} students queued")
+
+    # A few leave from the middle of the queue
+    cur.execute("""
+        SELECT user_id FROM public.course_waitlist WHERE course_id = %s
+        ORDER BY ticket OFFSET %s LIMIT 10
+    """, (course_id, drops + 10))
+    for (user_id,) in cur.fetchall():
+        cur.execute("SELECT public.lock_course_waitlist(%s::uuid)", (course_id,))
+        cur.execute("DELETE FROM public.course_waitlist WHERE user_id = %s AND course_id = %s", (user_id, course_id))
+        conn.commit()
+    problems += waitlist_positions(cur, course_id)
+
+    cur.execute("""
+        SELECT user_id FROM public.course_waitlist WHERE course_id = %s ORDER BY ticket LIMIT %s
+    """, (course_id, drops))
+    expected = [str(r[0]) for r in cur.fetchall()]
+    cur.execute("""
+        SELECT user_id FROM public.enrolled_in WHERE course_id = %s AND status != 'dropped' LIMIT %s
+    """, (course_id, drops))
+    leaving = [str(r[0]) for r in cur.fetchall()]
+    conn.commit()
+
+    latencies, promoted = [], []
+    for user_id in leaving:
+        started = time.perf_counter()
+        cur.execute("SELECT public.lock_course_waitlist(%s::uuid)", (course_id,))
+        cur.execute("""
+            UPDATE public.enrolled_in SET status = 'dropped' WHERE user_id = %s AND course_id = %s
+        """, (user_id, course_id))
+        promoted += promote_waitlisted(cur, course_id)
+        conn.commit()
+        latencies.append((time.perf_counter() - started) * 1000)
+    if promoted != expected:
+        problems.append(f"promoted {len(promoted)} students, "
+                        f"{sum(a == b for a, b in zip(promoted, expected))} in queue order of {len(expected)}")
+    problems += waitlist_positions(cur, course_id)
+    cur.execute("DELETE FROM public.app_event WHERE course_id = %s", (course_id,))
+    conn.commit()
+    conn.close()
+    latencies.sort()
+    return problems, joined / seconds, latencies
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--strategy", action="append", choices=list(STRATEGIES))
+    parser.add_argument("--capacity", type=int, default=500)
+    parser.add_argument("--students", type=int, default=2000, help="students racing for the seats")
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--drops", type=int, default=50, help="enrollments dropped to promote from the waitlist")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    conn = get_connection()
+    cur = conn.cursor()
+    cur.execute("SELECT user_id FROM public.student ORDER BY user_id LIMIT %s", (args.students + 20,))
+    students = [str(r[0]) for r in cur.fetchall()]
+    conn.close()
+    if len(students) < args.students + 20:
+        sys.exit(f"need {args.students + 20} seeded students, found {len(students)}")
+    random.Random(args.seed).shuffle(students)
+    racers, spares = students[:args.students], students[args.students:]
+
+    failed = False
+    print(f"{'strategy':<12} {'enroll/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'enrolled':>9} {'capacity':>9} "
+          f"{'errors':>7}  result")
+    for name in args.strategy or list(STRATEGIES):
+        course_id = create_course(args.capacity)
+        try:
+            enrolled, errors, seconds, latencies = race(STRATEGIES[name], course_id, racers, args.concurrency)
+            active, taken = course_counts(course_id)
+            problems = []
+            if active > args.capacity:
+                problems.append(f"oversold by {active - args.capacity}")
+            if active < min(args.capacity, len(racers)):
+                problems.append(f"{min(args.capacity, len(racers)) - active} seats left unsold")
+            if name == "stripes":
+                if taken != active:
+                    problems.append(f"stripes count {taken} taken")
+                elif active == args.capacity and not check_release(course_id, spares, 10):
+                    problems.append("dropped seats not given back")
+            print(f"{name:<12} {enrolled / seconds:>9.0f} {percentile(latencies, 50):>8.1f} "
+                  f"{percentile(latencies, 99):>8.1f} {active:>9} {args.capacity:>9} {errors:>7}  "
+                  f"{'; '.join(problems) or 'ok'}")
+            if problems and name != "naive":
+                failed = True
+            if name == "stripes" and not problems and active == args.capacity:
+                problems, joins, latencies = check_waitlist(course_id, args.concurrency, args.drops)
+                active, taken = course_counts(course_id)
+                if active != args.capacity or taken != active:
+                    problems.append(f"{active} enrolled, stripes count {taken} taken after promotion")
+                print(f"{'waitlist':<12} {joins:>9.0f} joins/s; drop + promote p50 {percentile(latencies, 50):.1f} ms, "
+                      f"p99 {percentile(latencies, 99):.1f} ms  {'; '.join(problems) or 'ok'}")
+                failed = failed or bool(problems)
+        finally:
+            delete_course(course_id)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+"""
+Database-side JSON rendering (JSON_RENDERING=db) against Python rendering.
+
+Calls the routes whose payload Postgres can build in-process, in both modes,
+with the response cache off, checks that both return the same data and
+prints the mean latency of each:
+
+    python -m bench.json_render --requests 50
+
+Exits non-zero if the payloads differ.
+"""
+import argparse
+import json
+import math
+import random
+import sys
+import time
+
+import app
+import cache
+import query_budget
+from bench.run import load_ids
+
+# Route -> request builder, as in bench/run.py
+CASES = {
+    "/api/courses": lambda r, ids: ("/api/courses", None),
+    "/api/courses/my-courses": lambda r, ids: ("/api/courses/my-courses",
+                                               {"user_id": r.choice(ids["students"])}),
+    "/api/instructor/courses/<course_id>/students":
+        lambda r, ids: (lambda t: (f"/api/instructor/courses/{t[1]}/students", {"instructor_id": t[0]}))(
+            r.choice(ids["teaching"])),
+}
+
+
+def same(a, b):
+    """Equal JSON values; numbers compare by value (4 == 4.0)."""
+    if isinstance(a, dict) and isinstance(b, dict):
+        return a.keys() == b.keys() and all(same(a[k], b[k]) for k in a)
+    if isinstance(a, list) and isinstance(b, list):
+        return len(a) == len(b) and all(same(x, y) for x, y in zip(a, b))
+    if isinstance(a, (int, float)) and isinstance(b, (int, float)) \
+            and not isinstance(a, bool) and not isinstance(b, bool):
+        return math.isclose(a, b, rel_tol=1e-9)
+    return a == b
+
+
+def fetch(client, mode, path, params):
+    app.JSON_RENDERING = mode
+    start = time.perf_counter()
+    response = client.get(path, query_string=params)
+    return time.perf_counter() - start, response
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=50, help="requests per route and mode")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    ids = load_ids()
+    cache.CACHE = "off"
+    query_budget.QUERY_BUDGET_MODE = "off"
+    client = app.create_app().test_client()
+
+    mismatches = 0
+    print(f"{'route':<48}{'python ms':>11}{'db ms':>9}{'bytes':>10}")
+    for route, builder in CASES.items():
+        totals = {"python": 0.0, "db": 0.0}
+        size = 0
+        for _ in range(args.requests):
+            path, params = builder(rng, ids)
+            results = {}
+            # Alternate which mode goes first so neither always warms the cache
+            for mode in rng.sample(["python", "db"], 2):
+                seconds, response = fetch(client, mode, path, params)
+                totals[mode] += seconds
+                results[mode] = response
+            if not same(json.loads(results["python"].data), json.loads(results["db"].data)):
+                mismatches += 1
+                print(f"  payloads differ for {path} {params or ''}")
+            size += len(results["db"].data)
+        print(f"{route:<48}{totals['python'] / args.requests * 1000:>11.2f}"
+              f"{totals['db'] / args.requests * 1000:>9.2f}{size // args.requests:>10}")
+
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,275 @@
+"""
+Query-plan regression checks.
+
+Calls every database-backed route in-process against a seeded local database
+(see bench/seed.py; medium scale or larger gives the planner realistic
+statistics), captures each SQL statement it runs, EXPLAINs it and checks:
+
+- no sequential scan on a table with more than --large-table-rows rows,
+  unless the route is listed in ALLOWED_SEQ_SCANS;
+- every index in EXPECTED_INDEXES for the route appears in its plans;
+- the top-level row estimate stays under --max-plan-rows, unless raised in
+  ROW_CEILINGS;
+- no request runs more statements than its route's budget
+  (query_budget.ROUTE_BUDGETS), which catches N+1 loops;
+- when tables are partitioned (migrations/partition_large_tables.sql),
+  each route in EXPECTED_PRUNING reads the table through at least one
+  statement that touches a single partition (its per-course/per-assignment
+  query).
+
+Exits with status 1 on any violation, so it can gate a deploy:
+
+    python -m bench.seed --scale medium
+    python -m bench.plans --verbose
+"""
+import argparse
+import json
+import random
+import sys
+from collections import Counter, defaultdict
+
+import psycopg2.errors
+import psycopg2.extensions
+
+import db
+import prepared
+import query_budget
+from app import create_app
+from bench.run import WORKLOAD, load_ids
+from slow_queries import normalize_sql
+
+# Routes not covered by the benchmark workload (read-only requests only)
+EXTRA_CASES = [
+    ("/api/admin/users", lambda r, ids: ("GET", "/api/admin/users",
+                                         {"admin_user_id": ids["admins"][0]}, None)),
+    ("/api/admin/courses", lambda r, ids: ("GET", "/api/admin/courses",
+                                           {"admin_user_id": ids["admins"][0]}, None)),
+    ("/api/admin/courses/<course_id>/instructors",
+     lambda r, ids: ("GET", f"/api/admin/courses/{r.choice(ids['courses'])}/instructors",
+                     {"admin_user_id": ids["admins"][0]}, None)),
+    ("/api/admin/instructors", lambda r, ids: ("GET", "/api/admin/instructors",
+                                               {"admin_user_id": ids["admins"][0]}, None)),
+    ("/api/instructor/profile", lambda r, ids: ("GET", "/api/instructor/profile",
+                                                {"user_id": r.choice(ids["teaching"])[0]}, None)),
+    ("/api/instructor/courses/<course_id>/modules",
+     lambda r, ids: (lambda t: ("GET", f"/api/instructor/courses/{t[1]}/modules", {"instructor_id": t[0]}, None))(
+         r.choice(ids["teaching"]))),
+    ("/api/instructor/courses/<course_id>/announcements",
+     lambda r, ids: (lambda t: ("GET", f"/api/instructor/courses/{t[1]}/announcements", {"instructor_id": t[0]}, None))(
+         r.choice(ids["teaching"]))),
+    ("/api/student/courses/<course_id>/analytics",
+     lambda r, ids: (lambda e: ("GET", f"/api/student/courses/{e[1]}/analytics", {"user_id": e[0]}, None))(
+         r.choice(ids["enrollments"]))),
+    ("/api/courses/waitlist", lambda r, ids: ("GET", "/api/courses/waitlist",
+                                              {"user_id": r.choice(ids["students"])}, None)),
+    ("/api/analyst/course/<course_id>/insights-setting",
+     lambda r, ids: ("GET", f"/api/analyst/course/{r.choice(ids['courses'])}/insights-setting", None, None)),
+]
+
+# Route -> tables it may scan sequentially (whole-table aggregates and listings)
+ALLOWED_SEQ_SCANS = {
+    "/api/courses": {"course", "enrolled_in"},
+    "/api/admin/users": {"users"},
+    "/api/admin/courses": {"course", "enrolled_in"},
+    "/api/admin/instructors": {"instructor", "users"},
+    "/api/analyst/overview": {"users", "student", "course", "enrolled_in", "assignment_submission"},
+    "/api/analyst/courses": {"course", "enrolled_in", "assignment"},
+    "/api/analyst/insights": {"users", "student", "course", "enrolled_in", "assignment_submission"},
+    # Popular courses have thousands of students; hashing the whole table beats per-row lookups
+    "/api/instructor/courses/<course_id>/students": {"users"},
+    "/api/analyst/course/<course_id>/analytics": {"student"},
+}
+
+# Route -> indexes its plans must use
+EXPECTED_INDEXES = {
+    "/api/student/profile": {"student_pkey"},
+    "/api/student/courses/<course_id>/announcements": {"idx_announcement_course_feed"},
+    "/api/student/announcements": {"idx_announcement_course_feed"},
+    "/api/student/courses/<course_id>/modules": {"course_content_pkey"},
+    "/api/student/courses/<course_id>/assignments": {"idx_assignment_course_created"},
+    "/api/instructor/courses/<course_id>/assignments": {"idx_assignment_course_created"},
+    "/api/instructor/courses/<course_id>/students": {"idx_submission_student"},
+    "/api/instructor/assignments/<assignment_id>/submissions": {"idx_submission_assignment_submitted"},
+    "/api/instructor/needs-grading": {"idx_submission_ungraded"},
+}
+
+# Route -> partitioned tables its main statement must prune to one partition
+EXPECTED_PRUNING = {
+    "/api/student/courses/<course_id>/modules": {"enrolled_in"},
+    "/api/student/courses/<course_id>/assignments": {"enrolled_in"},
+    "/api/student/courses/<course_id>/announcements": {"enrolled_in"},
+    "/api/student/courses/<course_id>/analytics": {"enrolled_in"},
+    "/api/instructor/courses/<course_id>/students": {"enrolled_in"},
+    "/api/instructor/assignments/<assignment_id>/submissions": {"assignment_submission"},
+    "/api/analyst/course/<course_id>/analytics": {"enrolled_in"},
+}
+
+# Route -> top-level row estimate ceiling overriding --max-plan-rows (None: unbounded)
+ROW_CEILINGS = {
+    "/api/courses": None,
+    "/api/admin/users": None,
+    "/api/admin/courses": None,
+    "/api/analyst/courses": None,
+}
+
+EXPLAINABLE = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")
+
+
+def capture_statements(client, method, path, params, body):
+    """Run one request and return the (query, params) it executed."""
+    captured = []
+
+    def hook(cursor, query, query_params, seconds):
+        captured.append((query, query_params))
+
+    db.add_query_hook(hook)
+    try:
+        client.open(path, method=method, query_string=params, json=body)
+    finally:
+        db._query_hooks.remove(hook)
+    return captured
+
+
+def explain(cur, query, params):
+    """The JSON plan of a statement, or None for statements that cannot be explained."""
+    # Registered statements run as EXECUTE, which only works where they are prepared
+    query = prepared.plain_sql(query)
+    if not query.lstrip().upper().startswith(EXPLAINABLE):
+        return None
+    cur.execute("EXPLAIN (FORMAT JSON) " + query, params)
+    return cur.fetchone()[0][0]["Plan"]
+
+
+def walk(plan):
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from walk(child)
+
+
+def table_sizes(cur):
+    cur.execute("""
+        SELECT c.relname, c.reltuples::bigint
+        FROM pg_class c JOIN pg_namespace n ON n.oid = c.relnamespace
+        WHERE n.nspname = 'public' AND c.relkind IN ('r', 'p')
+    """)
+    return dict(cur.fetchall())
+
+
+def partition_parents(cur):
+    """Partition (or partition index) name -> partitioned table (or index) name."""
+    cur.execute("""
+        SELECT c.relname, p.relname
+        FROM pg_inherits i
+        JOIN pg_class c ON c.oid = i.inhrelid
+        JOIN pg_class p ON p.oid = i.inhparent
+        WHERE p.relkind IN ('p', 'I')
+    """)
+    return dict(cur.fetchall())
+
+
+def check_plan(route, plan, sizes, parents, large_table_rows, max_plan_rows):
+    """Violations of a single statement's plan."""
+    problems = []
+    allowed = ALLOWED_SEQ_SCANS.get(route, set())
+    for node in walk(plan):
+        relation = node.get("Relation Name")
+        table = parents.get(relation, relation)
+        if node["Node Type"] == "Seq Scan" and table not in allowed \
+                and sizes.get(relation, 0) > large_table_rows:
+            problems.append(f"Seq Scan on {relation} ({sizes[relation]} rows)")
+    ceiling = ROW_CEILINGS.get(route, max_plan_rows)
+    if ceiling is not None and plan["Plan Rows"] > ceiling:
+        problems.append(f"estimated {plan['Plan Rows']} rows > {ceiling}")
+    return problems
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--samples", type=int, default=3, help="requests per route, with different ids")
+    parser.add_argument("--large-table-rows", type=int, default=10000)
+    parser.add_argument("--max-plan-rows", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--verbose", action="store_true", help="print the plans of failing statements")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    ids = load_ids()
+    # Budgets are checked below, with the fingerprints, instead of logged per request
+    query_budget.QUERY_BUDGET_MODE = "off"
+    client = create_app().test_client()
+    conn = db.get_connection()
+    conn.autocommit = True
+    # A plain cursor so the EXPLAINs are not captured by the query hooks
+    cur = conn.cursor(cursor_factory=psycopg2.extensions.cursor)
+    sizes = table_sizes(cur)
+    parents = partition_parents(cur)
+
+    cases = [(route, builder) for route, _, builder in WORKLOAD] + EXTRA_CASES
+    failures = defaultdict(dict)
+    used_indexes = defaultdict(set)
+    # route -> partitioned table -> fewest partitions any one statement read
+    fewest_partitions = defaultdict(dict)
+    statements = 0
+    for route, builder in cases:
+        for _ in range(args.samples):
+            captured = capture_statements(client, *builder(rng, ids))
+            budget = query_budget.budget_for(route)
+            if len(captured) > budget:
+                repeated = query_budget.repeated_statements(Counter(query for query, _ in captured))
+                failures[route]["(request)"] = (
+                    [query_budget.format_overrun(route, len(captured), budget, repeated).replace("\n", "\n     ")],
+                    None)
+            for query, params in captured:
+                try:
+                    plan = explain(cur, query, params)
+                except psycopg2.errors.UndefinedTable:
+                    # Created lazily inside the route's (uncommitted) transaction
+                    continue
+                except psycopg2.Error as e:
+                    failures[route][normalize_sql(query)] = ([f"EXPLAIN failed: {e}".strip()], None)
+                    continue
+                if plan is None:
+                    continue
+                statements += 1
+                used_indexes[route].update(parents.get(n["Index Name"], n["Index Name"])
+                                           for n in walk(plan) if "Index Name" in n)
+                partitions = defaultdict(set)
+                for node in walk(plan):
+                    if node.get("Relation Name") in parents:
+                        partitions[parents[node["Relation Name"]]].add(node["Relation Name"])
+                for table, read in partitions.items():
+                    fewest_partitions[route][table] = min(len(read), fewest_partitions[route].get(table, len(read)))
+                problems = check_plan(route, plan, sizes, parents, args.large_table_rows, args.max_plan_rows)
+                if problems:
+                    failures[route][normalize_sql(query)] = (problems, plan)
+
+    for route, expected in EXPECTED_INDEXES.items():
+        missing = expected - used_indexes[route]
+        if missing:
+            failures[route]["(all statements)"] = ([f"expected index not used: {', '.join(sorted(missing))}"], None)
+
+    for route, tables in EXPECTED_PRUNING.items():
+        for table in tables:
+            read = fewest_partitions[route].get(table)
+            if read is not None and read > 1:
+                failures[route][f"(statements on {table})"] = (
+                    [f"no partition pruning: every statement read {read} partitions"], None)
+
+    checked = sum(1 for route, _ in cases)
+    print(f"checked {statements} statements from {checked} routes")
+    for route, by_sql in failures.items():
+        print(f"\nFAIL {route}")
+        for sql, (problems, plan) in by_sql.items():
+            print(f"  {sql[:160]}")
+            for problem in problems:
+                print(f"    - {problem}")
+            if args.verbose and plan is not None:
+                print("      " + json.dumps(plan, indent=2).replace("\n", "\n      "))
+    conn.close()
+    if failures:
+        sys.exit(1)
+    print("all plans OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,93 @@
+"""
+Planning time saved by the prepared hot statements (prepared.py).
+
+Runs each statement registered in app.py --iterations times with ids from
+the seeded database, once as a plain query and once through
+prepared.execute() on the same connection, and prints the mean round trip
+of each along with the server's planning time from EXPLAIN ANALYZE (for the
+prepared statement, of EXECUTE after the plan cache has warmed up):
+
+    python -m bench.prepared --iterations 2000
+
+Run it against a local database (see bench/README.md), where the round trip
+is mostly server work.
+"""
+import argparse
+import random
+import time
+
+import app
+import prepared
+from bench.run import load_ids
+from db import get_connection
+
+# Statement -> parameter builder
+PARAMS = {
+    app.USER_ROLE: lambda r, ids: (r.choice(ids["students"]),),
+    app.USER_PROFILE: lambda r, ids: (r.choice(ids["students"]),),
+    app.TEACHES_COURSE: lambda r, ids: r.choice(ids["teaching"]),
+    app.COURSE_CATALOG: lambda r, ids: (),
+}
+
+# Executions before the plan cache may switch to a generic plan
+WARMUP = 10
+
+
+def timed(run, iterations, make_params):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        run(make_params())
+    return (time.perf_counter() - start) / iterations * 1000
+
+
+def planning_ms(cur, query, params, samples):
+    total = 0.0
+    for _ in range(samples):
+        cur.execute("EXPLAIN (ANALYZE, TIMING OFF, FORMAT JSON) " + query, params() or None)
+        total += cur.fetchone()[0][0]["Planning Time"]
+    return total / samples
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000, help="executions per statement and mode")
+    parser.add_argument("--explain-samples", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    ids = load_ids()
+    sql = prepared.registered()
+    conn = get_connection()
+    conn.autocommit = True
+    cur = conn.cursor()
+
+    print(f"{'statement':<22}{'plain ms':>10}{'prepared ms':>13}{'plan ms':>10}{'prep plan ms':>14}")
+    for name, builder in PARAMS.items():
+        make_params = lambda: builder(rng, ids)  # noqa: E731
+        for _ in range(WARMUP):
+            prepared.execute(cur, name, make_params())
+            cur.fetchall()
+
+        def plain(params):
+            cur.execute(sql[name], params or None)
+            cur.fetchall()
+
+        def prepped(params):
+            prepared.execute(cur, name, params)
+            cur.fetchall()
+
+        plain_ms = timed(plain, args.iterations, make_params)
+        prepared_ms = timed(prepped, args.iterations, make_params)
+        plan_plain = planning_ms(cur, sql[name], make_params, args.explain_samples)
+        placeholders = ", ".join(["%s"] * sql[name].count("%s"))
+        execute_sql = f"EXECUTE {name} ({placeholders})" if placeholders else f"EXECUTE {name}"
+        plan_prepared = planning_ms(cur, execute_sql, make_params, args.explain_samples)
+        print(f"{name:<22}{plain_ms:>10.3f}{prepared_ms:>13.3f}{plan_plain:>10.3f}{plan_prepared:>14.3f}")
+
+    cur.close()
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+"""
+Mixed-workload benchmark against a running API.
+
+Drives the real routes with a weighted mix of student, instructor, analyst
+and auth traffic (WORKLOAD below) using ids sampled from the seeded database,
+then reports per-endpoint throughput, p50/p95/p99 latency and SQL statements
+per request (read from /api/metrics). Results are written as JSON so runs can
+be compared:
+
+    python -m bench.run --url http://localhost:5000 --duration 60 --concurrency 32
+    python -m bench.run --url http://localhost:5000 --baseline bench/results/<earlier>.json
+
+See bench/README.md for the full setup (seed, Supabase stub, server).
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import re
+import subprocess
+import time
+from collections import defaultdict
+from datetime import datetime
+
+import aiohttp
+
+from bench.auth_load import percentile
+from db import get_connection
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+
+def load_ids(sample=2000):
+    """Sample ids from the seeded database for building requests."""
+    conn = get_connection()
+    cur = conn.cursor()
+    queries = {
+        "emails": "SELECT email FROM public.users ORDER BY random() LIMIT %s",
+        "admins": "SELECT user_id FROM public.users WHERE role = 'administrator' LIMIT %s",
+        "students": "SELECT user_id FROM public.student ORDER BY random() LIMIT %s",
+        "courses": "SELECT course_id FROM public.course ORDER BY random() LIMIT %s",
+        "enrollments": """SELECT user_id, course_id FROM public.enrolled_in
+                          WHERE status != 'dropped' ORDER BY random() LIMIT %s""",
+        "teaching": "SELECT instructor_id, course_id FROM public.teaches ORDER BY random() LIMIT %s",
+        "assignments": """SELECT assignment_id, instructor_id FROM public.assignment
+                          WHERE instructor_id IS NOT NULL ORDER BY random() LIMIT %s""",
+        "submittable": """SELECT e.user_id, a.assignment_id FROM public.enrolled_in e
+                          JOIN public.assignment a ON a.course_id = e.course_id
+                          WHERE e.status != 'dropped' ORDER BY random() LIMIT %s""",
+        "submissions": """SELECT s.submission_id, a.instructor_id FROM public.assignment_submission s
+                          JOIN public.assignment a ON a.assignment_id = s.assignment_id
+                          WHERE a.instructor_id IS NOT NULL ORDER BY random() LIMIT %s""",
+    }
+    ids = {}
+    for key, sql in queries.items():
+        cur.execute(sql, (sample,))
+        rows = [tuple(str(v) for v in row) for row in cur.fetchall()]
+        ids[key] = [r[0] for r in rows] if rows and len(rows[0]) == 1 else rows
+    cur.close()
+    conn.close()
+    return ids
+
+
+# (route template, weight, request builder). Builders return (method, path, query params, JSON body).
+WORKLOAD = [
+    ("/api/login", 5, lambda r, ids: ("POST", "/api/login", None,
+                                      {"email": r.choice(ids["emails"]), "password": "password"})),
+    ("/api/courses", 15, lambda r, ids: ("GET", "/api/courses", None, None)),
+    ("/api/courses/my-courses", 10, lambda r, ids: ("GET", "/api/courses/my-courses",
+                                                    {"user_id": r.choice(ids["students"])}, None)),
+    ("/api/dashboard", 5, lambda r, ids: ("GET", "/api/dashboard",
+                                          {"user_id": r.choice(ids["students"]), "role": "student"}, None)),
+    ("/api/student/courses/<course_id>/modules", 10,
+     lambda r, ids: (lambda e: ("GET", f"/api/student/courses/{e[1]}/modules", {"user_id": e[0]}, None))(
+         r.choice(ids["enrollments"]))),
+    ("/api/student/courses/<course_id>/assignments", 10,
+     lambda r, ids: (lambda e: ("GET", f"/api/student/courses/{e[1]}/assignments", {"user_id": e[0]}, None))(
+         r.choice(ids["enrollments"]))),
+    ("/api/student/courses/<course_id>/announcements", 8,
+     lambda r, ids: (lambda e: ("GET", f"/api/student/courses/{e[1]}/announcements", {"user_id": e[0]}, None))(
+         r.choice(ids["enrollments"]))),
+    ("/api/student/announcements", 6, lambda r, ids: ("GET", "/api/student/announcements",
+                                                     {"user_id": r.choice(ids["students"])}, None)),
+    ("/api/student/profile", 3, lambda r, ids: ("GET", "/api/student/profile",
+                                                {"user_id": r.choice(ids["students"])}, None)),
+    ("/api/instructor/courses", 5, lambda r, ids: ("GET", "/api/instructor/courses",
+                                                   {"instructor_id": r.choice(ids["teaching"])[0]}, None)),
+    ("/api/instructor/courses/<course_id>/students", 4,
+     lambda r, ids: (lambda t: ("GET", f"/api/instructor/courses/{t[1]}/students", {"instructor_id": t[0]}, None))(
+         r.choice(ids["teaching"]))),
+    ("/api/instructor/needs-grading", 3, lambda r, ids: ("GET", "/api/instructor/needs-grading",
+                                                        {"instructor_id": r.choice(ids["teaching"])[0]}, None)),
+    ("/api/instructor/courses/<course_id>/assignments", 3,
+     lambda r, ids: (lambda t: ("GET", f"/api/instructor/courses/{t[1]}/assignments", {"instructor_id": t[0]}, None))(
+         r.choice(ids["teaching"]))),
+    ("/api/instructor/assignments/<assignment_id>/submissions", 3,
+     lambda r, ids: (lambda a: ("GET", f"/api/instructor/assignments/{a[0]}/submissions", {"instructor_id": a[1]}, None))(
+         r.choice(ids["assignments"]))),
+    ("/api/analyst/overview", 2, lambda r, ids: ("GET", "/api/analyst/overview", None, None)),
+    ("/api/analyst/courses", 2, lambda r, ids: ("GET", "/api/analyst/courses", None, None)),
+    ("/api/analyst/insights", 1, lambda r, ids: ("GET", "/api/analyst/insights", None, None)),
+    ("/api/analyst/course/<course_id>/analytics", 1,
+     lambda r, ids: ("GET", f"/api/analyst/course/{r.choice(ids['courses'])}/analytics", None, None)),
+    ("/api/courses/enroll", 3, lambda r, ids: ("POST", "/api/courses/enroll", None,
+                                               {"user_id": r.choice(ids["students"]), "course_id": r.choice(ids["courses"])})),
+    ("/api/student/assignment/submit", 3,
+     lambda r, ids: (lambda s: ("POST", "/api/student/assignment/submit", None,
+                                {"student_id": s[0], "assignment_id": s[1],
+                                 "submission_url": f"https://example.com/bench/{r.random()}"}))(
+         r.choice(ids["submittable"]))),
+    ("/api/instructor/submission/grade", 2,
+     lambda r, ids: (lambda s: ("POST", "/api/instructor/submission/grade", None,
+                                {"instructor_id": s[1], "submission_id": s[0],
+                                 "marks_obtained": r.randint(0, 20), "feedback": "bench"}))(
+         r.choice(ids["submissions"]))),
+]
+
+_METRIC_LINE = re.compile(r'^db_queries_per_request_(sum|count)\{route="([^"]*)"\} ([0-9.eE+-]+)$')
+
+
+async def scrape_queries(session):
+    """Cumulative (sum, count) of db_queries_per_request by route from /api/metrics."""
+    totals = defaultdict(lambda: [0.0, 0.0])
+    try:
+        async with session.get("/api/metrics") as resp:
+            text = await resp.text()
+    except aiohttp.ClientError:
+        return totals
+    for line in text.splitlines():
+        match = _METRIC_LINE.match(line)
+        if match:
+            kind, route, value = match.groups()
+            totals[route][0 if kind == "sum" else 1] += float(value)
+    return totals
+
+
+async def run(url, duration, warmup, concurrency, ids, seed, only=None):
+    rng = random.Random(seed)
+    workload = [w for w in WORKLOAD if not only or w[0] in only]
+    routes = [w[0] for w in workload]
+    weights = [w[1] for w in workload]
+    builders = {w[0]: w[2] for w in workload}
+    latencies = defaultdict(list)
+    statuses = defaultdict(lambda: defaultdict(int))
+    recording = False
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(base_url=url, connector=connector,
+                                     timeout=aiohttp.ClientTimeout(total=120)) as session:
+        async def user(deadline):
+            while time.perf_counter() < deadline:
+                route = rng.choices(routes, weights=weights)[0]
+                method, path, params, body = builders[route](rng, ids)
+                start = time.perf_counter()
+                try:
+                    async with session.request(method, path, params=params, json=body) as resp:
+                        await resp.read()
+                        status = resp.status
+                except aiohttp.ClientError as e:
+                    status = type(e).__name__
+                if recording:
+                    latencies[route].append((time.perf_counter() - start) * 1000)
+                    statuses[route][str(status)] += 1
+
+        if warmup:
+            await asyncio.gather(*(user(time.perf_counter() + warmup) for _ in range(concurrency)))
+        before = await scrape_queries(session)
+        recording = True
+        started = time.perf_counter()
+        await asyncio.gather(*(user(started + duration) for _ in range(concurrency)))
+        elapsed = time.perf_counter() - started
+        recording = False
+        after = await scrape_queries(session)
+
+    endpoints = {}
+    for route in routes:
+        values = sorted(latencies[route])
+        if not values:
+            continue
+        q_sum = after[route][0] - before[route][0]
+        q_count = after[route][1] - before[route][1]
+        endpoints[route] = {
+            "requests": len(values),
+            "throughput_rps": round(len(values) / elapsed, 2),
+            "p50_ms": round(percentile(values, 50), 2),
+            "p95_ms": round(percentile(values, 95), 2),
+            "p99_ms": round(percentile(values, 99), 2),
+            "mean_ms": round(sum(values) / len(values), 2),
+            "queries_per_request": round(q_sum / q_count, 2) if q_count else None,
+            "statuses": dict(statuses[route]),
+        }
+    all_values = sorted(v for route in latencies for v in latencies[route])
+    total = {
+        "requests": len(all_values),
+        "throughput_rps": round(len(all_values) / elapsed, 2),
+        "p50_ms": round(percentile(all_values, 50), 2),
+        "p95_ms": round(percentile(all_values, 95), 2),
+        "p99_ms": round(percentile(all_values, 99), 2),
+    }
+    return endpoints, total, elapsed
+
+
+def _git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_report(result, baseline=None):
+    base = (baseline or {}).get("endpoints", {})
+    print(f"{'endpoint':<58} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'q/req':>6}  vs baseline p95")
+    for route, r in result["endpoints"].items():
+        delta = ""
+        if route in base and base[route]["p95_ms"]:
+            delta = f"{(r['p95_ms'] - base[route]['p95_ms']) / base[route]['p95_ms'] * 100:+.0f}%"
+        q = "" if r["queries_per_request"] is None else r["queries_per_request"]
+        print(f"{route:<58} {r['throughput_rps']:>8} {r['p50_ms']:>8} {r['p95_ms']:>8} {r['p99_ms']:>8} {q:>6}  {delta}")
+    t = result["total"]
+    print(f"{'TOTAL':<58} {t['throughput_rps']:>8} {t['p50_ms']:>8} {t['p95_ms']:>8} {t['p99_ms']:>8}")
+    if baseline:
+        b = baseline["total"]["throughput_rps"]
+        print(f"throughput vs baseline ({baseline['meta'].get('git_revision')}): "
+              f"{(t['throughput_rps'] - b) / b * 100:+.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:5000")
+    parser.add_argument("--duration", type=float, default=30, help="measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="unmeasured seconds before measuring")
+    parser.add_argument("--concurrency", type=int, default=32, help="concurrent virtual users")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--route", action="append", help="only this route template (repeatable)")
+    parser.add_argument("--label", default="", help="free-form label stored with the results")
+    parser.add_argument("--out", help="results file (default bench/results/<timestamp>.json)")
+    parser.add_argument("--baseline", help="earlier results file to compare against")
+    args = parser.parse_args()
+
+    ids = load_ids()
+    endpoints, total, elapsed = asyncio.run(
+        run(args.url, args.duration, args.warmup, args.concurrency, ids, args.seed, args.route))
+    result = {
+        "meta": {
+            "url": args.url,
+            "label": args.label,
+            "git_revision": _git_revision(),
+            "started_at": datetime.now().isoformat(timespec="seconds"),
+            "duration_s": round(elapsed, 2),
+            "concurrency": args.concurrency,
+            "seed": args.seed,
+            "routes": args.route,
+        },
+        "endpoints": endpoints,
+        "total": total,
+    }
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    print_report(result, baseline)
+
+    out = args.out or os.path.join(RESULTS_DIR, datetime.now().strftime("%Y%m%d-%H%M%S") + ".json")
+    os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+    with open(out, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"results written to {out}")
+
+
+if __name__ == "__main__":
+    main()
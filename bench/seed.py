@@ -0,0 +1,304 @@
+"""
+Synthetic data generator for benchmarks.
+
+Recreates the project schema (schema.sql plus the base migrations) in the
+database configured by DB_* and bulk-loads deterministic synthetic data
+with COPY. Refuses to touch anything but a local database.
+
+    python -m bench.seed --scale small
+    python -m bench.seed --students 50000 --courses 800 --enrollments-per-student 6
+    python -m bench.seed --scale medium --migration migrations/<extra>.sql
+
+User n is bench-user-<n>@example.com with the Supabase stub's id for that
+email (bench.stub_supabase.stub_user_id), so logins work against the stub.
+User 0 is an approved administrator, followed by analysts, instructors and
+students.
+"""
+import argparse
+import csv
+import io
+import os
+import random
+import sys
+import time
+import uuid
+from datetime import date, datetime, timedelta
+
+from bench.stub_supabase import stub_user_id
+from db import get_connection, get_connection_params
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+SCALES = {
+    "tiny": dict(students=500, instructors=20, analysts=2, universities=10, courses=40,
+                 enrollments_per_student=3, modules_per_course=4, contents_per_module=2,
+                 assignments_per_course=3, announcements_per_course=3),
+    "small": dict(students=5000, instructors=100, analysts=5, universities=40, courses=300,
+                  enrollments_per_student=4, modules_per_course=6, contents_per_module=3,
+                  assignments_per_course=5, announcements_per_course=6),
+    "medium": dict(students=50000, instructors=600, analysts=10, universities=150, courses=2000,
+                   enrollments_per_student=5, modules_per_course=8, contents_per_module=3,
+                   assignments_per_course=6, announcements_per_course=10),
+    "large": dict(students=300000, instructors=3000, analysts=20, universities=400, courses=10000,
+                  enrollments_per_student=6, modules_per_course=10, contents_per_module=4,
+                  assignments_per_course=8, announcements_per_course=15),
+}
+
+# Applied after schema.sql, in order; the same files the README asks users to run
+BASE_MIGRATIONS = [
+    "migrations/add_approved_column.sql",
+    "migrations/add_announcements_table.sql",
+    "migrations/add_assignment_tables.sql",
+    "migrations/add_performance_indexes.sql",
+    "migrations/add_announcement_feed.sql",
+    "migrations/add_grading_inbox.sql",
+    "migrations/add_seat_reservations.sql",
+    "migrations/add_course_waitlist.sql",
+    "migrations/add_idempotency_keys.sql",
+    "migrations/add_course_content_versions.sql",
+    "migrations/add_flight_results.sql",
+    "migrations/add_job_queue.sql",
+    "migrations/add_app_events.sql",
+]
+
+# Minimal stand-in for the Supabase auth schema that schema.sql references
+AUTH_STUB_SQL = """
+CREATE SCHEMA auth;
+CREATE TABLE auth.users (id uuid PRIMARY KEY, email text, raw_user_meta_data jsonb);
+CREATE FUNCTION auth.uid() RETURNS uuid LANGUAGE sql STABLE AS 'SELECT NULL::uuid';
+"""
+
+LEVELS = ["beginner", "intermediate", "advanced"]
+COUNTRIES = ["India", "USA", "UK", "Germany", "Canada", "Brazil", "Nigeria", "Japan", "Australia", "France"]
+BRANCHES = ["CSE", "ECE", "EEE", "ME", "CE", "IT"]
+GRADES = ["EX", "A", "B", "C", "D", "P", "F"]
+CONTENT_TYPES = ["video", "pdf", "link", "quiz"]
+WORDS = ("data systems learning design theory practice modern applied advanced introduction "
+         "networks security cloud analysis algorithms programming web mobile research methods").split()
+
+
+def _uuid(rng):
+    return uuid.UUID(int=rng.getrandbits(128), version=4)
+
+
+def _text(rng, words):
+    return " ".join(rng.choice(WORDS) for _ in range(words))
+
+
+def _copy(cur, table, columns, rows, chunk=50000):
+    """COPY rows (an iterable of tuples; None becomes NULL) into table."""
+    sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv, NULL '\\N')"
+    count = 0
+    while True:
+        buf = io.StringIO()
+        writer = csv.writer(buf)
+        n = 0
+        for row in rows:
+            writer.writerow(["\\N" if v is None else v for v in row])
+            n += 1
+            if n == chunk:
+                break
+        if n == 0:
+            break
+        buf.seek(0)
+        cur.copy_expert(sql, buf)
+        count += n
+        if n < chunk:
+            break
+    return count
+
+
+def reset_schema(cur, migrations):
+    cur.execute("DROP SCHEMA IF EXISTS public CASCADE; DROP SCHEMA IF EXISTS auth CASCADE; CREATE SCHEMA public;")
+    cur.execute(AUTH_STUB_SQL)
+    with open(os.path.join(ROOT, "schema.sql")) as f:
+        schema = f.read()
+    cur.execute("SELECT 1 FROM pg_available_extensions WHERE name = 'pgcrypto'")
+    if not cur.fetchone():
+        # gen_random_uuid() is built in since PostgreSQL 13; pgcrypto is only needed before that
+        schema = schema.replace('create extension if not exists "pgcrypto";', "")
+    cur.execute(schema)
+    for path in migrations:
+        with open(os.path.join(ROOT, path)) as f:
+            cur.execute(f.read())
+
+
+def generate(cur, cfg, seed):
+    rng = random.Random(seed)
+    counts = {}
+    today = date.today()
+    now = datetime.now().replace(microsecond=0)
+
+    n_admins = 1
+    n_users = n_admins + cfg["analysts"] + cfg["instructors"] + cfg["students"]
+    roles = (["administrator"] * n_admins + ["data_analyst"] * cfg["analysts"]
+             + ["instructor"] * cfg["instructors"] + ["student"] * cfg["students"])
+    user_ids = [uuid.UUID(stub_user_id(f"bench-user-{i}@example.com")) for i in range(n_users)]
+    instructor_ids = [u for u, r in zip(user_ids, roles) if r == "instructor"]
+    student_ids = [u for u, r in zip(user_ids, roles) if r == "student"]
+
+    counts["auth.users"] = _copy(cur, "auth.users", ["id", "email", "raw_user_meta_data"],
+                                 ((user_ids[i], f"bench-user-{i}@example.com", "{}") for i in range(n_users)))
+    counts["users"] = _copy(cur, "public.users", ["user_id", "name", "email", "role", "approved", "created_at"],
+                            ((user_ids[i], f"Bench User {i}", f"bench-user-{i}@example.com", roles[i], True,
+                              now - timedelta(days=rng.randint(0, 720))) for i in range(n_users)))
+    counts["instructor"] = _copy(cur, "public.instructor", ["user_id", "branch", "specialization", "hire_year", "phone_number"],
+                                 ((u, rng.choice(BRANCHES), _text(rng, 2), rng.randint(1995, 2025), None)
+                                  for u in instructor_ids))
+    counts["student"] = _copy(cur, "public.student", ["user_id", "branch", "country", "dob", "phone_number"],
+                              ((u, rng.choice(BRANCHES), rng.choice(COUNTRIES),
+                                date(rng.randint(1985, 2007), rng.randint(1, 12), rng.randint(1, 28)), None)
+                               for u in student_ids))
+
+    university_ids = [_uuid(rng) for _ in range(cfg["universities"])]
+    counts["university"] = _copy(cur, "public.university", ["university_id", "name", "country", "ranking", "website"],
+                                 ((u, f"Bench University {i}", rng.choice(COUNTRIES), i + 1, None)
+                                  for i, u in enumerate(university_ids)))
+
+    course_ids = [_uuid(rng) for _ in range(cfg["courses"])]
+    counts["course"] = _copy(cur, "public.course",
+                             ["course_id", "title", "fees", "duration", "level", "description",
+                              "total_vacancies", "program", "university_id"],
+                             ((c, f"{_text(rng, 3).title()} {i}", rng.choice([None, 0, 499, 999, 1999, 4999]),
+                               f"{rng.randint(4, 16)} weeks", rng.choice(LEVELS), _text(rng, 60),
+                               rng.choice([None, 100, 500, 5000]), rng.choice(["BTech", "MTech", "Certificate"]),
+                               rng.choice(university_ids)) for i, c in enumerate(course_ids)))
+
+    # 1-3 instructors per course
+    course_instructors = {c: rng.sample(instructor_ids, min(len(instructor_ids), rng.randint(1, 3))) for c in course_ids}
+    counts["teaches"] = _copy(cur, "public.teaches", ["instructor_id", "course_id"],
+                              ((i, c) for c, instructors in course_instructors.items() for i in instructors))
+
+    # Skewed popularity: a few courses get most enrollments
+    weights = [1 / (rank + 1) ** 0.8 for rank in range(len(course_ids))]
+    enrollments = []
+    for s in student_ids:
+        picked = set(rng.choices(course_ids, weights=weights, k=cfg["enrollments_per_student"]))
+        for c in picked:
+            status = rng.choices(["ongoing", "completed", "dropped"], weights=[70, 20, 10])[0]
+            enrolled = today - timedelta(days=rng.randint(0, 365))
+            grade = rng.choice(GRADES) if status == "completed" else None
+            completion = enrolled + timedelta(days=rng.randint(30, 120)) if status == "completed" else None
+            enrollments.append((s, c, enrolled, status, grade, completion))
+    counts["enrolled_in"] = _copy(cur, "public.enrolled_in",
+                                  ["user_id", "course_id", "enroll_date", "status", "grade", "completion_date"],
+                                  iter(enrollments))
+
+    counts["module"] = _copy(cur, "public.module", ["course_id", "module_number", "duration", "name"],
+                             ((c, m, f"{rng.randint(1, 3)} weeks", _text(rng, 3).title())
+                              for c in course_ids for m in range(1, cfg["modules_per_course"] + 1)))
+    counts["module_content"] = _copy(cur, "public.module_content",
+                                     ["content_id", "course_id", "module_number", "title", "type", "url"],
+                                     ((_uuid(rng), c, m, _text(rng, 4).title(), rng.choice(CONTENT_TYPES),
+                                       f"https://example.com/content/{k}")
+                                      for c in course_ids for m in range(1, cfg["modules_per_course"] + 1)
+                                      for k in range(cfg["contents_per_module"])))
+    counts["announcement"] = _copy(cur, "public.announcement",
+                                   ["announcement_id", "course_id", "instructor_id", "title", "content", "created_at"],
+                                   ((_uuid(rng), c, rng.choice(course_instructors[c]), _text(rng, 5).title(),
+                                     _text(rng, 40), now - timedelta(hours=rng.randint(0, 24 * 180)))
+                                    for c in course_ids for _ in range(cfg["announcements_per_course"])))
+
+    assignments = []
+    for c in course_ids:
+        for k in range(cfg["assignments_per_course"]):
+            created = now - timedelta(days=rng.randint(10, 200))
+            assignments.append((_uuid(rng), c, rng.randint(1, cfg["modules_per_course"]),
+                                rng.choice(course_instructors[c]), f"Assignment {k + 1}", _text(rng, 20),
+                                f"https://example.com/assignments/{k}", created + timedelta(days=14), 20, created))
+    counts["assignment"] = _copy(cur, "public.assignment",
+                                 ["assignment_id", "course_id", "module_number", "instructor_id", "title",
+                                  "description", "assignment_url", "due_date", "max_marks", "created_at"],
+                                 iter(assignments))
+
+    assignments_by_course = {}
+    for a in assignments:
+        assignments_by_course.setdefault(a[1], []).append(a)
+
+    def submissions():
+        for s, c, _, status, _, _ in enrollments:
+            if status == "dropped":
+                continue
+            for a in assignments_by_course.get(c, []):
+                if rng.random() < 0.7:
+                    graded = rng.random() < 0.6
+                    yield (_uuid(rng), a[0], s, f"https://example.com/submissions/{a[0]}",
+                           a[9] + timedelta(days=rng.randint(0, 20)),
+                           rng.randint(0, 20) if graded else None, "Good work" if graded else None)
+    counts["assignment_submission"] = _copy(cur, "public.assignment_submission",
+                                            ["submission_id", "assignment_id", "student_id", "submission_url",
+                                             "submitted_at", "marks_obtained", "feedback"],
+                                            submissions())
+    return counts
+
+
+def refresh_counters(cur):
+    """Recompute the trigger-maintained counters, since triggers are off during COPY."""
+    cur.execute("""
+        UPDATE public.student s SET
+            total_courses_enrolled = x.enrolled, total_courses_completed = x.completed
+        FROM (SELECT user_id,
+                     COUNT(*) FILTER (WHERE status != 'dropped') AS enrolled,
+                     COUNT(*) FILTER (WHERE status = 'completed') AS completed
+              FROM public.enrolled_in GROUP BY user_id) x
+        WHERE x.user_id = s.user_id
+    """)
+    cur.execute("""
+        INSERT INTO public.course_content (course_id)
+        SELECT course_id FROM public.course
+        ON CONFLICT (course_id) DO NOTHING
+    """)
+    cur.execute("""
+        SELECT public.set_course_capacity(course_id, total_vacancies)
+        FROM public.course WHERE total_vacancies IS NOT NULL
+    """)
+    cur.execute("""
+        UPDATE public.instructor i SET total_courses = x.n
+        FROM (SELECT instructor_id, COUNT(*) AS n FROM public.teaches GROUP BY instructor_id) x
+        WHERE x.instructor_id = i.user_id
+    """)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--scale", choices=SCALES, default="small")
+    for key, value in SCALES["small"].items():
+        parser.add_argument(f"--{key.replace('_', '-')}", type=int, help=f"override (small: {value})")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--migration", action="append", default=[],
+                        help="extra migration to apply after the base ones (repeatable)")
+    args = parser.parse_args()
+
+    if get_connection_params()["host"] not in ("localhost", "127.0.0.1"):
+        sys.exit("Refusing to seed a non-local database (DB_HOST must be localhost or 127.0.0.1).")
+
+    cfg = dict(SCALES[args.scale])
+    for key in cfg:
+        if getattr(args, key) is not None:
+            cfg[key] = getattr(args, key)
+
+    started = time.perf_counter()
+    conn = get_connection()
+    cur = conn.cursor()
+    reset_schema(cur, BASE_MIGRATIONS)
+    # Skip FK checks and per-row counter triggers during the bulk load
+    cur.execute("SET session_replication_role = replica")
+    counts = generate(cur, cfg, args.seed)
+    cur.execute("SET session_replication_role = DEFAULT")
+    refresh_counters(cur)
+    for path in args.migration:
+        with open(os.path.join(ROOT, path)) as f:
+            cur.execute(f.read())
+    conn.commit()
+    conn.autocommit = True
+    cur.execute("VACUUM ANALYZE")
+    cur.close()
+    conn.close()
+
+    for table, n in counts.items():
+        print(f"{table:<24} {n:>10}")
+    print(f"seeded scale={args.scale} in {time.perf_counter() - started:.1f}s")
+
+
+if __name__ == "__main__":
+    main()
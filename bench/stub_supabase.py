@@ -0,0 +1,74 @@
+"""
+Local stand-in for the Supabase Auth endpoints the API calls.
+
+Every request sleeps for STUB_SUPABASE_LATENCY_MS (default 150) to mimic the
+round trip to Supabase, then answers from an in-memory user registry. User ids
+are derived from the email with stub_user_id(), so a seeded database and the
+stub agree on who is who without sharing state.
+
+Run with:
+    uvicorn bench.stub_supabase:app --port 9999
+and start the API with SUPABASE_URL=http://localhost:9999 and any non-empty
+SUPABASE_ANON_KEY / SUPABASE_SERVICE_KEY.
+"""
+import asyncio
+import os
+import uuid
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+LATENCY = float(os.getenv("STUB_SUPABASE_LATENCY_MS", "150")) / 1000
+# Password accepted for every seeded user
+STUB_PASSWORD = os.getenv("STUB_SUPABASE_PASSWORD", "password")
+
+_created = {}  # email -> user id, for users created through /admin/users
+
+
+def stub_user_id(email):
+    """Deterministic auth user id for an email address."""
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"mailto:{email.lower()}"))
+
+
+async def token(request):
+    await asyncio.sleep(LATENCY)
+    data = await request.json()
+    email = data.get("email") or ""
+    if not email or data.get("password") != STUB_PASSWORD:
+        return JSONResponse({"error": "invalid_grant", "error_description": "Invalid login credentials"}, 400)
+    return JSONResponse({
+        "access_token": "stub-token",
+        "token_type": "bearer",
+        "user": {"id": stub_user_id(email), "email": email},
+    })
+
+
+async def admin_users(request):
+    await asyncio.sleep(LATENCY)
+    if request.method == "GET":
+        return JSONResponse({"users": [{"id": uid, "email": email} for email, uid in _created.items()]})
+
+    data = await request.json()
+    email = (data.get("email") or "").lower()
+    if email in _created:
+        return JSONResponse({"msg": "A user with this email address has already been registered"}, 422)
+    _created[email] = stub_user_id(email)
+    return JSONResponse({"id": _created[email], "email": email}, 200)
+
+
+async def admin_user(request):
+    await asyncio.sleep(LATENCY)
+    user_id = request.path_params["user_id"]
+    for email, uid in list(_created.items()):
+        if uid == user_id:
+            del _created[email]
+            return Response(status_code=200)
+    return JSONResponse({"msg": "User not found"}, 404)
+
+
+app = Starlette(routes=[
+    Route("/auth/v1/token", token, methods=["POST"]),
+    Route("/auth/v1/admin/users", admin_users, methods=["GET", "POST"]),
+    Route("/auth/v1/admin/users/{user_id}", admin_user, methods=["DELETE"]),
+])
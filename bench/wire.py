@@ -0,0 +1,102 @@
+"""
+Payload size and latency of the list formats in wire.py.
+
+Calls each list route in every format, with the response cache off, checks
+that each returns the same data as the full JSON payload and prints the mean
+response size and latency per format:
+
+    python -m bench.wire --requests 20
+
+The "fields" formats ask for the fieldset of the route in LISTS. Run it with
+JSON_RENDERING=db as well to see the JSON formats built by Postgres. Exits
+non-zero if a payload differs (MessagePack is skipped when msgpack is not
+installed).
+"""
+import argparse
+import json
+import random
+import sys
+import time
+
+import app
+import cache
+import query_budget
+import wire
+from bench.json_render import CASES, same
+from bench.run import load_ids
+
+# Route -> (its list, the sparse fieldset the "fields" formats ask for)
+LISTS = {
+    "/api/courses": (app.CATALOG_LIST, ["course_id", "title", "level", "fees"]),
+    "/api/courses/my-courses": (app.MY_COURSES_LIST, ["course_id", "title", "status", "grade"]),
+    "/api/instructor/courses/<course_id>/students": (app.COURSE_STUDENTS_LIST, ["user_id", "name", "status", "grade"]),
+}
+
+# Format -> (extra query parameters for the route's fieldset, Accept header)
+FORMATS = {
+    "json": (lambda fields: {}, "application/json"),
+    "compact": (lambda fields: {"format": "compact"}, "application/json"),
+    "msgpack": (lambda fields: {}, wire.MSGPACK),
+    "fields": (lambda fields: {"fields": ",".join(fields)}, "application/json"),
+    "fields+compact": (lambda fields: {"fields": ",".join(fields), "format": "compact"}, "application/json"),
+    "fields+msgpack": (lambda fields: {"fields": ",".join(fields)}, wire.MSGPACK),
+}
+
+
+def decode(response):
+    if response.mimetype == wire.MSGPACK:
+        return wire.msgpack.unpackb(response.data)
+    return json.loads(response.data)
+
+
+def expected(full, query, fields, compact):
+    """The full payload trimmed to `fields` (None for all) and, if `compact`, in columns."""
+    columns = fields or list(query.fields)
+    rows = [{name: row[name] for name in columns} for row in full[query.key]]
+    if compact:
+        return {"success": True, "columns": columns, query.key: [[row[name] for name in columns] for row in rows]}
+    return {"success": True, query.key: rows}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=20, help="requests per route and format")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    ids = load_ids()
+    cache.CACHE = "off"
+    query_budget.QUERY_BUDGET_MODE = "off"
+    client = app.create_app().test_client()
+    formats = [name for name in FORMATS if wire.msgpack is not None or "msgpack" not in name]
+
+    mismatches = 0
+    print(f"{'route / format':<48}{'ms':>9}{'bytes':>10}")
+    for route, builder in CASES.items():
+        query, fields = LISTS[route]
+        totals = {name: [0.0, 0] for name in formats}
+        for _ in range(args.requests):
+            path, params = builder(rng, ids)
+            full = json.loads(client.get(path, query_string=params).data)
+            for name in rng.sample(formats, len(formats)):
+                extra, accept = FORMATS[name]
+                start = time.perf_counter()
+                response = client.get(path, query_string={**(params or {}), **extra(fields)},
+                                      headers={"Accept": accept})
+                totals[name][0] += time.perf_counter() - start
+                totals[name][1] += len(response.data)
+                want = expected(full, query, fields if "fields" in name else None, "compact" in name)
+                if response.status_code != 200 or not same(decode(response), want):
+                    mismatches += 1
+                    print(f"  {name} payload differs for {path} {params or ''}")
+        print(route)
+        for name in formats:
+            seconds, size = totals[name]
+            print(f"  {name:<46}{seconds / args.requests * 1000:>9.2f}{size // args.requests:>10}")
+
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,332 @@
+"""
+Response cache for read routes.
+
+    @api.route("/api/courses/my-courses", methods=["GET"])
+    @cache.cached(ttl=60, tags=["user:{user_id}", "table:course"])
+    def my_courses():
+
+A cached GET route's 200 responses are kept per route, path and query string
+for `ttl` seconds: in an LRU in each process, bounded by CACHE_MAX_BYTES, and,
+with CACHE_REDIS_URL set, in Redis as well, so all workers share them. Tags
+name what a response was built from: "table:<name>" for whole tables and
+"course:<id>" / "user:<id>" for one entity, filled in from the route's path
+and query parameters. A write calls invalidate() with the tags it changed once
+it has committed, and every response carrying one of them is stale from then
+on, in every process.
+
+Invalidation is by version: each tag has a counter, invalidate() bumps it and
+an entry records the counters it was built under, so an entry is only served
+while they still match. The counters live in Redis when there is one (read
+with one MGET per lookup); otherwise each process keeps its own and the
+others hear about a bump through Postgres NOTIFY on CHANNEL. That listener
+needs a session of its own: behind the Supabase pooler, point DB_PORT at the
+session-mode port (5432). Give Redis an eviction policy that spares keys
+without a TTL (volatile-lru), so the counters are never evicted.
+
+When an entry is missing, one request per process computes it while the
+others wait for it (and, with Redis, one request across all processes, up to
+CACHE_LOCK_SECONDS). CACHE=off disables the cache.
+"""
+import hashlib
+import json
+import logging
+import os
+import select
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from functools import wraps
+
+import psycopg2
+from flask import Response, current_app, request
+
+import metrics
+import wire
+from db import get_connection_params, primary_reads
+
+CACHE = os.getenv("CACHE", "on")
+CACHE_MAX_BYTES = int(os.getenv("CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+CACHE_DEFAULT_TTL = float(os.getenv("CACHE_DEFAULT_TTL", "60"))
+# Optional shared tier, e.g. redis://localhost:6379/0 (needs the redis package)
+CACHE_REDIS_URL = os.getenv("CACHE_REDIS_URL")
+# How long a request waits for another process computing the same entry
+CACHE_LOCK_SECONDS = float(os.getenv("CACHE_LOCK_SECONDS", "5"))
+
+CHANNEL = "cache_invalidation"
+# Tags per notification, well under the 8000 byte NOTIFY payload cap
+NOTIFY_BATCH = 100
+# Per-process locks that misses on the same key queue on
+LOCK_STRIPES = 64
+
+log = logging.getLogger("cache")
+
+# Identifies this process's own notifications
+_source = None
+
+
+# =============================
+# LOCAL TIER
+# =============================
+
+class LocalCache:
+    """key -> (expires_at, versions, status, mimetype, body), least recently
+    used dropped first once the bodies add up to more than max_bytes."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= time.monotonic():
+                self._remove(key)
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        size = len(entry[4])
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = entry
+            self.bytes += size
+            while self.bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+        metrics.CACHE_LOCAL_BYTES.set(self.bytes)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.bytes = 0
+        metrics.CACHE_LOCAL_BYTES.set(0)
+
+    def _remove(self, key):
+        self.bytes -= len(self._entries.pop(key)[4])
+
+
+_local = LocalCache(CACHE_MAX_BYTES)
+_key_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+
+# =============================
+# TAG VERSIONS
+# =============================
+
+_versions = {}
+_versions_lock = threading.Lock()
+_listener_pid = None
+_redis = None
+
+
+def _shared():
+    """The Redis client of the shared tier, or None without one."""
+    global _redis
+    if CACHE_REDIS_URL and _redis is None:
+        import redis
+        _redis = redis.Redis.from_url(CACHE_REDIS_URL, socket_timeout=1)
+    return _redis
+
+
+def _bump_local(tags):
+    with _versions_lock:
+        for tag in tags:
+            _versions[tag] = _versions.get(tag, 0) + 1
+
+
+def _current_versions(tags):
+    shared = _shared()
+    if shared is not None:
+        return tuple(int(v or 0) for v in shared.mget([f"cache:v:{tag}" for tag in tags]))
+    _ensure_listener()
+    with _versions_lock:
+        return tuple(_versions.get(tag, 0) for tag in tags)
+
+
+def _listen():
+    """Apply other processes' invalidations to this one's versions."""
+    while True:
+        try:
+            conn = psycopg2.connect(**get_connection_params())
+            conn.autocommit = True
+            conn.cursor().execute("LISTEN " + CHANNEL)
+            # Bumps sent while we were not listening are lost
+            _local.clear()
+            while True:
+                if select.select([conn], [], [], 60) == ([], [], []):
+                    continue
+                conn.poll()
+                while conn.notifies:
+                    message = json.loads(conn.notifies.pop(0).payload)
+                    if message["source"] != _source:
+                        _bump_local(message["tags"])
+        except Exception:
+            log.exception("cache invalidation listener failed, reconnecting")
+            time.sleep(1)
+
+
+def _ensure_listener():
+    # Started on first use in each process, so after gunicorn forks
+    global _listener_pid, _source
+    pid = os.getpid()
+    if _listener_pid == pid:
+        return
+    with _versions_lock:
+        if _listener_pid == pid:
+            return
+        _listener_pid = pid
+        _source = uuid.uuid4().hex
+        _local.clear()
+        threading.Thread(target=_listen, name="cache-invalidation", daemon=True).start()
+
+
+def invalidate(cur, *tags):
+    """Make every cached response tagged with any of `tags` stale. Call once
+    the write has committed (earlier, a concurrent read could cache the old
+    rows again), with a cursor on the same connection: without Redis the
+    other processes are told with NOTIFY, which commits on that connection."""
+    if CACHE == "off" or not tags:
+        return
+    tags = sorted(set(tags))
+    for tag in tags:
+        metrics.CACHE_INVALIDATIONS.labels(tag.split(":", 1)[0]).inc()
+    shared = _shared()
+    if shared is not None:
+        pipe = shared.pipeline(transaction=False)
+        for tag in tags:
+            pipe.incr(f"cache:v:{tag}")
+        pipe.execute()
+        return
+    _ensure_listener()
+    _bump_local(tags)
+    for i in range(0, len(tags), NOTIFY_BATCH):
+        payload = json.dumps({"source": _source, "tags": tags[i:i + NOTIFY_BATCH]})
+        cur.execute("SELECT pg_notify(%s, %s)", (CHANNEL, payload))
+    cur.connection.commit()
+
+
+# =============================
+# SHARED TIER
+# =============================
+
+def _encode(entry):
+    expires_at, versions, status, mimetype, body = entry
+    header = json.dumps([time.time() + expires_at - time.monotonic(), versions, status, mimetype])
+    return header.encode() + b"\n" + body
+
+
+def _decode(data):
+    header, body = data.split(b"\n", 1)
+    expires_at, versions, status, mimetype = json.loads(header)
+    return (time.monotonic() + expires_at - time.time(), tuple(versions), status, mimetype, body)
+
+
+def _shared_get(key, versions):
+    data = _shared().get("cache:e:" + key)
+    if data is None:
+        return None
+    entry = _decode(data)
+    return entry if entry[1] == versions else None
+
+
+# =============================
+# DECORATOR
+# =============================
+
+def _response(entry, result):
+    response = Response(entry[4], status=entry[2], mimetype=entry[3])
+    response.headers["X-Cache"] = result
+    return response
+
+
+def _compute(view, args, kwargs, key, versions, ttl):
+    # On the primary: a replica still behind the write that bumped `versions`
+    # would store its older data under them for the whole ttl.
+    with primary_reads():
+        response = current_app.make_response(view(*args, **kwargs))
+    if response.status_code == 200 and not response.is_streamed:
+        entry = (time.monotonic() + ttl, versions, 200, response.mimetype, response.get_data())
+        _local.put(key, entry)
+        if _shared() is not None:
+            _shared().set("cache:e:" + key, _encode(entry), px=int(ttl * 1000))
+    response.headers["X-Cache"] = "miss"
+    return response
+
+
+def request_key(view_args):
+    """Identifies a GET request by route, path and query parameters and the
+    encoding it accepts (JSON or MessagePack, see wire.py)."""
+    return hashlib.sha256(json.dumps([
+        metrics.current_route(), sorted(view_args.items()), sorted(request.args.items(multi=True)),
+        wire.response_encoding()
+    ]).encode()).hexdigest()
+
+
+def cached(ttl=None, tags=()):
+    """Cache a GET route's 200 responses for `ttl` seconds (CACHE_DEFAULT_TTL
+    by default). `tags` may use the route's path and query parameters, as in
+    "course:{course_id}"; a request missing one is not cached. Put it right
+    below @api.route."""
+    ttl = CACHE_DEFAULT_TTL if ttl is None else ttl
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            if CACHE == "off" or request.method != "GET":
+                return view(*args, **kwargs)
+            params = {**request.args.to_dict(), **kwargs}
+            try:
+                entry_tags = [tag.format(**params) for tag in tags]
+            except KeyError:
+                return view(*args, **kwargs)
+            route = metrics.current_route()
+            key = request_key(kwargs)
+            versions = _current_versions(entry_tags)
+
+            entry = _local.get(key)
+            if entry is not None and entry[1] == versions:
+                metrics.CACHE_REQUESTS.labels(route, "hit_local").inc()
+                return _response(entry, "hit")
+
+            with _key_locks[hash(key) % LOCK_STRIPES]:
+                # Another thread may have filled it while we waited
+                entry = _local.get(key)
+                if entry is not None and entry[1] == versions:
+                    metrics.CACHE_REQUESTS.labels(route, "hit_local").inc()
+                    return _response(entry, "hit")
+                shared = _shared()
+                if shared is None:
+                    metrics.CACHE_REQUESTS.labels(route, "miss").inc()
+                    return _compute(view, args, kwargs, key, versions, ttl)
+
+                token = uuid.uuid4().hex
+                lock_key = "cache:l:" + key
+                deadline = time.monotonic() + CACHE_LOCK_SECONDS
+                while True:
+                    entry = _shared_get(key, versions)
+                    if entry is not None:
+                        _local.put(key, entry)
+                        metrics.CACHE_REQUESTS.labels(route, "hit_shared").inc()
+                        return _response(entry, "hit")
+                    if shared.set(lock_key, token, nx=True, px=int(CACHE_LOCK_SECONDS * 1000)):
+                        break
+                    if time.monotonic() >= deadline:
+                        token = None  # give up waiting and compute it ourselves
+                        break
+                    time.sleep(0.025)
+                metrics.CACHE_REQUESTS.labels(route, "miss").inc()
+                try:
+                    return _compute(view, args, kwargs, key, versions, ttl)
+                finally:
+                    if token is not None and shared.get(lock_key) == token.encode():
+                        shared.delete(lock_key)
+        return wrapper
+    return decorator
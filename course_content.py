@@ -0,0 +1,119 @@
+"""
+Compiled course module trees for the student module view.
+
+A course's modules and content change only through instructor writes, so the
+tree students are served is compiled once per course content version
+(public.course_content.version, bumped by trigger on every module or
+module_content change; see migrations/add_course_content_versions.sql) and
+kept as serialized JSON: in this process's LRU, and in course_content for
+the other processes. A request reads the course's version together with its
+enrollment check and, when the LRU holds that version, needs nothing else.
+A changed course is simply a new version; nothing has to be invalidated.
+"""
+import json
+import os
+import threading
+from collections import OrderedDict
+
+# Courses whose compiled tree each process keeps
+COURSE_TREE_CACHE_SIZE = int(os.getenv("COURSE_TREE_CACHE_SIZE", "1000"))
+
+# Enrollment, the course's content version and, only when the caller's copy
+# is not that version, the stored compiled tree if it is current
+ACCESS_SQL = """
+    SELECT EXISTS (
+               SELECT 1 FROM public.enrolled_in
+               WHERE user_id = %(user_id)s AND course_id = %(course_id)s AND status != 'dropped'
+           ),
+           COALESCE(cc.version, 0),
+           CASE WHEN cc.version IS DISTINCT FROM %(cached_version)s AND cc.modules_version = cc.version
+                THEN cc.modules::text END
+    FROM (SELECT 1) one
+    LEFT JOIN public.course_content cc ON cc.course_id = %(course_id)s
+"""
+
+MODULES_SQL = """
+    SELECT m.module_number, m.name, m.duration,
+           mc.content_id, mc.title, mc.type, mc.url
+    FROM public.module m
+    LEFT JOIN public.module_content mc ON mc.course_id = m.course_id
+        AND mc.module_number = m.module_number
+    WHERE m.course_id = %s
+    ORDER BY m.module_number, mc.content_id
+"""
+
+
+class TreeCache:
+    """course_id -> (version, modules JSON), least recently used dropped first."""
+
+    def __init__(self, size):
+        self.size = size
+        self._trees = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, course_id):
+        with self._lock:
+            entry = self._trees.get(course_id)
+            if entry is not None:
+                self._trees.move_to_end(course_id)
+            return entry
+
+    def put(self, course_id, version, modules):
+        with self._lock:
+            current = self._trees.get(course_id)
+            if current is not None and current[0] > version:
+                return  # a concurrent request already cached a newer version
+            self._trees[course_id] = (version, modules)
+            self._trees.move_to_end(course_id)
+            if len(self._trees) > self.size:
+                self._trees.popitem(last=False)
+
+
+_cache = TreeCache(COURSE_TREE_CACHE_SIZE)
+
+
+def compile_modules(rows):
+    """Group MODULES_SQL rows into the module list students are served."""
+    modules_dict = {}
+    for row in rows:
+        module_num = row[0]
+        if module_num not in modules_dict:
+            modules_dict[module_num] = {
+                "module_number": module_num,
+                "name": row[1],
+                "duration": row[2],
+                "content": []
+            }
+        if row[3]:  # content_id
+            modules_dict[module_num]["content"].append({
+                "content_id": str(row[3]),
+                "title": row[4],
+                "type": row[5],
+                "url": row[6]
+            })
+    return list(modules_dict.values())
+
+
+def student_modules(cur, user_id, course_id):
+    """(enrolled, modules JSON) for a student's view of a course; the JSON is
+    None when the student is not enrolled. May store a newly compiled tree
+    with `cur`, so commit afterwards."""
+    cached = _cache.get(course_id)
+    cur.execute(ACCESS_SQL, {"user_id": user_id, "course_id": course_id,
+                             "cached_version": cached[0] if cached else None})
+    enrolled, version, stored = cur.fetchone()
+    if not enrolled:
+        return False, None
+    if cached is not None and cached[0] == version:
+        return True, cached[1]
+
+    if stored is None:
+        cur.execute(MODULES_SQL, (course_id,))
+        stored = json.dumps(compile_modules(cur.fetchall()), separators=(",", ":"))
+        # Rows read after the version, so the tree is at least that version
+        cur.execute("""
+            UPDATE public.course_content SET modules = %s::jsonb, modules_version = %s
+            WHERE course_id = %s AND version = %s
+        """, (stored, version, course_id, version))
+    _cache.put(course_id, version, stored)
+    return True, stored
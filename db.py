@@ -1,34 +1,348 @@
 import psycopg2
+import psycopg2.pool
+import functools
+import itertools
 import os
+import threading
+import time
+from contextlib import contextmanager
 from dotenv import load_dotenv
 
 load_dotenv()
 
-def get_connection():
+
+# =============================
+# QUERY HOOKS
+# =============================
+# Every cursor handed out by get_connection() reports each execute() to the
+# registered hooks as hook(cursor, query, params, seconds). Metrics and the
+# other per-query instrumentation register themselves here.
+
+_query_hooks = []
+
+
+def add_query_hook(hook):
+    """Register hook(cursor, query, params, seconds), called after every execute()."""
+    if hook not in _query_hooks:
+        _query_hooks.append(hook)
+
+
+class InstrumentedCursor(psycopg2.extensions.cursor):
+    def execute(self, query, vars=None):
+        if not _query_hooks:
+            return super().execute(query, vars)
+        start = time.perf_counter()
+        try:
+            return super().execute(query, vars)
+        finally:
+            seconds = time.perf_counter() - start
+            for hook in _query_hooks:
+                hook(self, query, vars, seconds)
+
+
+def get_connection_params():
     """
-    Establishes connection to PostgreSQL database.
-    Automatically handles SSL for cloud databases (like Supabase) 
+    Returns the PostgreSQL connection settings read from the environment.
+    Automatically handles SSL for cloud databases (like Supabase)
     and disables SSL for local databases.
     """
     # Check if using cloud database (Supabase, AWS RDS, etc.)
     # Local databases typically use 'localhost' or '127.0.0.1'
     host = os.getenv("DB_HOST", "localhost")
     is_local = host in ["localhost", "127.0.0.1"]
-    
+
     connection_params = {
         "host": host,
         "database": os.getenv("DB_NAME"),
         "user": os.getenv("DB_USER"),
         "password": os.getenv("DB_PASSWORD"),
         "port": os.getenv("DB_PORT", "5432"),
+        "cursor_factory": InstrumentedCursor,
     }
-    
+
     # Only require SSL for cloud databases
     if not is_local:
         connection_params["sslmode"] = "require"
     else:
         connection_params["sslmode"] = "disable"
-    
-    return psycopg2.connect(**connection_params)
+
+    return connection_params
+
+
+def get_connection():
+    """
+    Establishes connection to PostgreSQL database.
+    Uses the process connection pool when one has been initialised;
+    closing a pooled connection returns it to the pool.
+    """
+    if _pool is not None:
+        conn, pool = None, _pool
+        replica = _pick_replica() if _replica_reads_enabled() else None
+        if replica is not None:
+            try:
+                conn, pool = replica.pool.getconn(), replica.pool
+                conn.set_session(readonly=True)
+            except psycopg2.pool.PoolError:
+                # Every replica connection is in use: busy, not down
+                conn, pool = None, _pool
+            except psycopg2.Error as e:
+                replica.mark_down(e)
+                if conn is not None:
+                    # Checked out but unusable: close it rather than leak it
+                    replica.pool.putconn(conn, close=True)
+                conn, pool = None, _pool
+        if conn is None:
+            conn = _pool.getconn()
+        conn._owner_pool = pool
+        _checked_out().append(conn)
+        return conn
+    return psycopg2.connect(**get_connection_params())
+
+
+# =============================
+# CONNECTION POOL
+# =============================
+# Production servers create one pool per worker process after fork (see
+# gunicorn.conf.py). Without a pool, get_connection() opens a fresh connection
+# per call, which is what `python app.py` does.
+
+# Request threads per worker process, whichever server runs the Flask app:
+# gunicorn's gthread workers (gunicorn.conf.py) or the WSGI thread pool in
+# asgi.py. Admission limits (admission.py) follow it. A fixed default, since
+# worker processes already scale with cores (see gunicorn.conf.py).
+WORKER_THREADS = int(os.getenv("WORKER_THREADS", os.getenv("GUNICORN_THREADS", "4")))
+# Pooled connections one request can hold at once: its own, the claim an
+# Idempotency-Key keeps open (idempotency.py) and a single-flight leader's
+# advisory lock (singleflight.py). The pool never waits for a connection (it
+# raises PoolError), so a server's pool needs WORKER_THREADS *
+# CONNECTIONS_PER_THREAD of them; see web_pool_size(). Only WORKER_THREADS
+# stay open when idle.
+CONNECTIONS_PER_THREAD = 3
+
+_pool = None
+_local = threading.local()
+
+
+class PooledConnection(psycopg2.extensions.connection):
+    """Connection whose close() hands it back to the pool it came from."""
+    _owner_pool = None
+
+    def close(self):
+        pool, self._owner_pool = self._owner_pool, None
+        conns = _checked_out()
+        if self in conns:
+            conns.remove(self)
+        if pool is not None and not pool.closed:
+            # putconn rolls back any open transaction, and calls close() again
+            # (now a real close) if the pool does not want to keep it.
+            pool.putconn(self)
+        else:
+            super().close()
+
+
+def init_pool(minconn=None, maxconn=None):
+    """Create this process's connection pool. Call once per process, after fork."""
+    global _pool
+    maxconn = maxconn or int(os.getenv("DB_POOL_MAX", "10"))
+    # psycopg2 only keeps `minconn` idle connections; extras are closed on return
+    minconn = min(minconn or int(os.getenv("DB_POOL_MIN", str(maxconn))), maxconn)
+    close_pool()
+    _pool = psycopg2.pool.ThreadedConnectionPool(
+        minconn, maxconn, connection_factory=PooledConnection, **get_connection_params()
+    )
+    _init_replicas(minconn, maxconn)
+    return _pool
+
+
+def web_pool_size():
+    """(minconn, maxconn) for a process serving the Flask app on WORKER_THREADS threads."""
+    return WORKER_THREADS, WORKER_THREADS * CONNECTIONS_PER_THREAD
+
+
+def _checked_out():
+    if not hasattr(_local, "conns"):
+        _local.conns = []
+    return _local.conns
+
+
+def release_connections():
+    """Return every pooled connection this thread still holds.
+    Called at the end of each request so early returns that skip
+    conn.close() cannot leak connections out of the pool."""
+    conns = _checked_out()
+    while conns:
+        conns[-1].close()
+
+
+def pool_stats():
+    """Connection counts for this process's pool, or None without a pool."""
+    if _pool is None or _pool.closed:
+        return None
+    return {"in_use": len(_pool._used), "idle": len(_pool._pool), "max": _pool.maxconn}
+
+
+def close_pool():
+    """Close every connection in this process's pool, if one exists."""
+    global _pool
+    pool, _pool = _pool, None
+    if pool is not None and not pool.closed:
+        pool.closeall()
+    _close_replicas()
+
+
+# =============================
+# READ REPLICAS
+# =============================
+# DB_REPLICA_URLS lists replica DSNs, comma separated. Inside replica_reads()
+# (or a view wrapped with reads_from_replica) pooled connections come from the
+# healthy replicas in turn; all other code, and every read while no replica is
+# healthy, uses the primary. A background thread per process re-checks each
+# replica every DB_REPLICA_CHECK_SECONDS and takes it out of rotation while it
+# is unreachable or replaying more than DB_REPLICA_MAX_LAG_SECONDS behind.
+# primary_reads() overrides replica_reads(): the response cache (cache.py)
+# computes its misses under it, so what it stores is never older than the
+# write that invalidated the previous entry.
+
+REPLICA_MAX_LAG_SECONDS = float(os.getenv("DB_REPLICA_MAX_LAG_SECONDS", "5"))
+REPLICA_CHECK_SECONDS = float(os.getenv("DB_REPLICA_CHECK_SECONDS", "5"))
+
+_replicas = []
+_replica_turn = itertools.count()
+_replica_checker = None
+
+# Replay lag in seconds: 0 once everything received has been replayed, and on
+# a server that is not a standby at all
+REPLICA_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        WHEN pg_last_wal_receive_lsn() <= pg_last_wal_replay_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+
+class Replica:
+    def __init__(self, dsn, minconn, maxconn):
+        self.dsn = dsn
+        params = psycopg2.extensions.parse_dsn(dsn)
+        self.name = f"{params.get('host', 'localhost')}:{params.get('port', '5432')}"
+        self.pool = psycopg2.pool.ThreadedConnectionPool(
+            0, maxconn, dsn, connection_factory=PooledConnection, cursor_factory=InstrumentedCursor
+        )
+        # Connect lazily, since the replica may be down right now, but keep up
+        # to minconn idle connections once they exist
+        self.pool.minconn = minconn
+        self.healthy = False
+        self.lag_seconds = None
+        self.error = None
+
+    def check(self):
+        """Measure replay lag on a fresh connection and update the health flag."""
+        try:
+            conn = psycopg2.connect(self.dsn, connect_timeout=3, options="-c statement_timeout=3000")
+            try:
+                cur = conn.cursor()
+                cur.execute(REPLICA_LAG_SQL)
+                self.lag_seconds = float(cur.fetchone()[0])
+            finally:
+                conn.close()
+        except psycopg2.Error as e:
+            self.mark_down(e)
+            return
+        self.healthy = self.lag_seconds <= REPLICA_MAX_LAG_SECONDS
+        self.error = None if self.healthy else f"replay lag {self.lag_seconds:.1f}s"
+
+    def mark_down(self, error):
+        self.healthy = False
+        self.error = str(error).strip()
+
+
+class _ReplicaChecker(threading.Thread):
+    def __init__(self):
+        super().__init__(daemon=True)
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(REPLICA_CHECK_SECONDS):
+            for replica in list(_replicas):
+                replica.check()
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def _init_replicas(minconn, maxconn):
+    global _replica_checker
+    dsns = [dsn.strip() for dsn in os.getenv("DB_REPLICA_URLS", "").split(",") if dsn.strip()]
+    if not dsns:
+        return
+    for dsn in dsns:
+        replica = Replica(dsn, minconn, maxconn)
+        replica.check()
+        _replicas.append(replica)
+    _replica_checker = _ReplicaChecker()
+    _replica_checker.start()
+
+
+def _close_replicas():
+    global _replica_checker
+    if _replica_checker is not None:
+        _replica_checker.stop()
+        _replica_checker = None
+    while _replicas:
+        replica = _replicas.pop()
+        if not replica.pool.closed:
+            replica.pool.closeall()
+
+
+def _pick_replica():
+    healthy = [replica for replica in _replicas if replica.healthy]
+    if not healthy:
+        return None
+    return healthy[next(_replica_turn) % len(healthy)]
+
+
+@contextmanager
+def replica_reads():
+    """Serve get_connection() from a read replica, when one is healthy, inside this block."""
+    previous = getattr(_local, "replica_reads", False)
+    _local.replica_reads = True
+    try:
+        yield
+    finally:
+        _local.replica_reads = previous
+
+
+@contextmanager
+def primary_reads():
+    """Serve get_connection() from the primary inside this block, even within
+    replica_reads(): for reads that must see every committed write."""
+    previous = getattr(_local, "primary_reads", False)
+    _local.primary_reads = True
+    try:
+        yield
+    finally:
+        _local.primary_reads = previous
+
+
+def _replica_reads_enabled():
+    return getattr(_local, "replica_reads", False) and not getattr(_local, "primary_reads", False)
+
+
+def reads_from_replica(view):
+    """Route a read-only view's queries to a replica. Only for views that never
+    write and whose callers accept data up to DB_REPLICA_MAX_LAG_SECONDS old,
+    i.e. not pages read back right after the caller's own writes."""
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        with replica_reads():
+            return view(*args, **kwargs)
+    return wrapper
 
 
+def replica_stats():
+    """Health and replay lag of each configured replica in this process."""
+    return [
+        {"replica": r.name, "healthy": r.healthy, "lag_seconds": r.lag_seconds, "error": r.error}
+        for r in _replicas
+    ]
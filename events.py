@@ -0,0 +1,35 @@
+"""
+Dashboard events: written to public.app_event (migrations/add_app_events.sql)
+and announced with NOTIFY, so sse.py can push them to connected clients.
+
+Call publish() with the cursor of the write it describes: the event is
+stored and the notification sent only if that transaction commits.
+
+Event ids are the stream's resume cursor, but a sequence value taken by one
+transaction may commit after a higher one. sse.py therefore holds an event
+back while a lower id is still missing and the transactions that could hold
+it are running. For that, publish() has its transaction take an id before
+the event takes its event id, so any such transaction shows up in the
+snapshot that first sees the gap.
+"""
+import json
+
+CHANNEL = "app_events"
+
+# The notification carries the routing fields only (NOTIFY payloads are capped
+# at 8000 bytes); listeners read the data from the table.
+PUBLISH_SQL = """
+    WITH tx AS (
+        SELECT pg_current_xact_id()
+    ), e AS (
+        INSERT INTO public.app_event (kind, course_id, user_id, data)
+        SELECT %s::text, %s::uuid, %s::uuid, %s::jsonb FROM tx
+        RETURNING event_id, kind, course_id, user_id
+    )
+    SELECT pg_notify('""" + CHANNEL + """', row_to_json(e)::text) FROM e
+"""
+
+
+def publish(cur, kind, data, course_id=None, user_id=None):
+    """Record an event for everyone in `course_id`, or for `user_id` alone."""
+    cur.execute(PUBLISH_SQL, (kind, course_id, user_id, json.dumps(data, default=str)))
@@ -1,6 +1,8 @@
 import axios from 'axios';
 
 const API_BASE_URL = process.env.REACT_APP_API_URL || 'http://localhost:5000/api';
+// Event stream server (sse.py); defaults to the API host behind a proxy routing /api/events
+const EVENTS_URL = process.env.REACT_APP_EVENTS_URL || API_BASE_URL;
 
 const api = axios.create({
   baseURL: API_BASE_URL,
@@ -50,6 +52,23 @@ export const coursesAPI = {
     const response = await api.get('/courses/my-courses', { params });
     return response.data;
   },
+
+  getWaitlist: async (user_id) => {
+    const response = await api.get('/courses/waitlist', {
+      params: { user_id },
+    });
+    return response.data;
+  },
+
+  joinWaitlist: async (user_id, course_id) => {
+    const response = await api.post('/courses/waitlist', { user_id, course_id });
+    return response.data;
+  },
+
+  leaveWaitlist: async (user_id, course_id) => {
+    const response = await api.post('/courses/waitlist/leave', { user_id, course_id });
+    return response.data;
+  },
 };
 
 // Student API
@@ -246,6 +265,15 @@ export const instructorAPI = {
     return response.data;
   },
 
+  // Ungraded submissions across all courses; order is 'submitted' or 'due',
+  // after is the next_cursor of the previous page
+  getNeedsGrading: async (instructor_id, order = 'submitted', after = null) => {
+    const response = await api.get('/instructor/needs-grading', {
+      params: { instructor_id, order, ...(after ? { after } : {}) },
+    });
+    return response.data;
+  },
+
   gradeSubmission: async (instructor_id, submission_id, marks_obtained, feedback = '') => {
     const response = await api.post('/instructor/submission/grade', {
       instructor_id,
@@ -351,4 +379,17 @@ export const analystAPI = {
   },
 };
 
+// Push events: calls onEvent(kind, data) for new announcements and grades.
+// A 'reset' event means events were missed; reload the dashboard data.
+// Returns a function that closes the stream.
+export const eventsAPI = {
+  subscribe: (user_id, onEvent) => {
+    const source = new EventSource(`${EVENTS_URL}/events?user_id=${encodeURIComponent(user_id)}`);
+    ['announcement_created', 'submission_graded', 'final_grade', 'waitlist_promoted', 'reset'].forEach((kind) => {
+      source.addEventListener(kind, (e) => onEvent(kind, JSON.parse(e.data)));
+    });
+    return () => source.close();
+  },
+};
+
 export default api;
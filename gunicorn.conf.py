@@ -0,0 +1,68 @@
+"""
+Gunicorn configuration for the production API.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+Every setting can be overridden with the GUNICORN_* environment variables
+below. Signals to the master process (GUNICORN_PIDFILE records its pid):
+    HUP          graceful restart: new workers start, old ones finish in-flight
+                 requests. With preload_app the code is not re-imported.
+    USR2, QUIT   zero-downtime code upgrade: USR2 starts a new master with the
+                 new code, then QUIT the old master once the new one is healthy
+    TTIN / TTOU  add / remove a worker
+"""
+import multiprocessing
+import os
+import tempfile
+
+import db
+
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+pidfile = os.getenv("GUNICORN_PIDFILE")
+
+# Requests spend most of their time waiting on Postgres and Supabase, so each
+# worker process runs a few threads; processes scale with cores.
+workers = int(os.getenv("GUNICORN_WORKERS", multiprocessing.cpu_count() * 2 + 1))
+worker_class = "gthread"
+# WORKER_THREADS (or GUNICORN_THREADS), shared with asgi.py and admission.py.
+# A fixed number per process, not one derived from the CPU count: every thread
+# gets up to db.CONNECTIONS_PER_THREAD pooled connections in every worker, so
+# scaling threads with cores as well would grow Postgres connections with the
+# square of the core count. Raise it for hosts whose requests mostly wait on
+# Supabase Auth rather than Postgres.
+threads = db.WORKER_THREADS
+
+# Import the app once in the master and fork workers from it (faster start,
+# shared memory pages). Nothing may open a DB connection at import time.
+preload_app = True
+
+# Recycle each worker after this many requests (jittered so workers do not
+# restart together) to cap memory growth.
+max_requests = int(os.getenv("GUNICORN_MAX_REQUESTS", "2000"))
+max_requests_jitter = int(os.getenv("GUNICORN_MAX_REQUESTS_JITTER", str(max_requests // 10)))
+
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "60"))
+graceful_timeout = int(os.getenv("GUNICORN_GRACEFUL_TIMEOUT", "30"))
+keepalive = int(os.getenv("GUNICORN_KEEPALIVE", "5"))
+
+accesslog = os.getenv("GUNICORN_ACCESSLOG", "-")
+errorlog = "-"
+
+# Workers write metrics to files here so /api/metrics reports all of them.
+# Must be set before the app (and prometheus_client) is imported.
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", tempfile.mkdtemp(prefix="mooc-metrics-"))
+
+
+def post_fork(server, worker):
+    # Connections must not be shared across processes: each worker opens its
+    # own pool, sized for all of its threads (db.web_pool_size)
+    db.init_pool(*db.web_pool_size())
+
+
+def worker_exit(server, worker):
+    db.close_pool()
+
+
+def child_exit(server, worker):
+    from prometheus_client import multiprocess
+    multiprocess.mark_process_dead(worker.pid)
@@ -0,0 +1,163 @@
+"""
+Idempotency keys for retried writes.
+
+Clients may send an Idempotency-Key header (up to 255 characters, e.g. a
+UUID per user action) on the routes in IDEMPOTENT_ROUTES. The first request
+with a key runs normally and its response is stored in public.idempotency_key
+(migrations/add_idempotency_keys.sql); a retry with the same key gets that
+response back, with Idempotent-Replayed: true, without running the route
+again.
+
+The first request claims its key by inserting the row and keeps that
+transaction open (on a second pooled connection) until its response is
+stored, so a duplicate arriving meanwhile blocks on the row and wakes as soon
+as it commits, up to IDEMPOTENCY_WAIT_SECONDS, after which it gets 409 with
+Retry-After. A 5xx response, or a worker dying mid-request, rolls the claim
+back, so the retry runs the write again.
+
+Keys are scoped to the route and the caller (see admission.caller_id), and
+reusing a key with a different body is refused with 422. Stored responses
+are kept for IDEMPOTENCY_TTL_HOURS and pruned by worker.py.
+"""
+import hashlib
+import math
+import os
+
+import psycopg2.errors
+from flask import Response, g, jsonify, request
+
+import metrics
+from admission import caller_id
+from db import get_connection
+
+IDEMPOTENCY_TTL_HOURS = float(os.getenv("IDEMPOTENCY_TTL_HOURS", "24"))
+# How long a duplicate waits for the request holding its key
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "5"))
+MAX_KEY_LENGTH = 255
+HEADER = "Idempotency-Key"
+
+IDEMPOTENT_ROUTES = {
+    "/api/courses/enroll",
+    "/api/courses/waitlist",
+    "/api/student/assignment/submit",
+    "/api/instructor/submission/grade",
+    "/api/instructor/grade",
+}
+
+# Takes the key unless it has an unexpired stored response. Waits while
+# another request holds it (its insert is not committed yet).
+CLAIM_SQL = """
+    INSERT INTO public.idempotency_key (key_hash, request_hash, expires_at)
+    VALUES (%s, %s, now() + %s * interval '1 hour')
+    ON CONFLICT (key_hash) DO UPDATE
+        SET request_hash = EXCLUDED.request_hash, status_code = NULL, response = NULL,
+            expires_at = EXCLUDED.expires_at
+        WHERE public.idempotency_key.expires_at < now()
+    RETURNING 1
+"""
+
+
+def _digest(*parts):
+    return hashlib.sha256(b"\n".join(parts)).digest()
+
+
+def _error(status, message, retry_after=None):
+    response = jsonify({"error": message})
+    response.status_code = status
+    if retry_after is not None:
+        response.headers["Retry-After"] = str(max(1, math.ceil(retry_after)))
+    return response
+
+
+def _before_request():
+    key = request.headers.get(HEADER)
+    route = metrics.current_route()
+    if not key or request.method != "POST" or route not in IDEMPOTENT_ROUTES:
+        return None
+    if len(key) > MAX_KEY_LENGTH:
+        return _error(400, f"{HEADER} must be at most {MAX_KEY_LENGTH} characters")
+
+    key_hash = _digest(route.encode(), (caller_id() or "").encode(), key.encode())
+    request_hash = _digest(request.get_data())
+    conn = get_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute("SELECT set_config('lock_timeout', %s, true)", (f"{int(IDEMPOTENCY_WAIT_SECONDS * 1000)}ms",))
+        cur.execute(CLAIM_SQL, (key_hash, request_hash, IDEMPOTENCY_TTL_HOURS))
+        if cur.fetchone() is not None:
+            # Held until _after_request stores the response
+            g.idempotency_claim = (conn, cur, key_hash)
+            return None
+        cur.execute("""
+            SELECT request_hash, status_code, response FROM public.idempotency_key WHERE key_hash = %s
+        """, (key_hash,))
+        row = cur.fetchone()
+        conn.commit()
+    except psycopg2.errors.LockNotAvailable:
+        conn.rollback()
+        metrics.IDEMPOTENT_REQUESTS.labels(route, "in_progress").inc()
+        return _error(409, "A request with this Idempotency-Key is still in progress", IDEMPOTENCY_WAIT_SECONDS)
+    finally:
+        if g.get("idempotency_claim") is None:
+            cur.close()
+            conn.close()
+
+    if row is None:
+        return _error(409, "A request with this Idempotency-Key is still in progress", IDEMPOTENCY_WAIT_SECONDS)
+    if bytes(row[0]) != request_hash:
+        metrics.IDEMPOTENT_REQUESTS.labels(route, "mismatch").inc()
+        return _error(422, f"{HEADER} was already used for a different request")
+    metrics.IDEMPOTENT_REQUESTS.labels(route, "replayed").inc()
+    response = Response(bytes(row[2]), status=row[1], mimetype="application/json")
+    response.headers["Idempotent-Replayed"] = "true"
+    return response
+
+
+def _after_request(response):
+    claim = g.pop("idempotency_claim", None)
+    if claim is None:
+        return response
+    conn, cur, key_hash = claim
+    try:
+        if response.status_code >= 500:
+            # Let a retry run the write again
+            conn.rollback()
+            outcome = "released"
+        else:
+            cur.execute("""
+                UPDATE public.idempotency_key SET status_code = %s, response = %s WHERE key_hash = %s
+            """, (response.status_code, response.get_data(), key_hash))
+            conn.commit()
+            outcome = "stored"
+    finally:
+        cur.close()
+        conn.close()
+    metrics.IDEMPOTENT_REQUESTS.labels(metrics.current_route(), outcome).inc()
+    return response
+
+
+def prune(conn, batch=1000):
+    """Delete expired keys, `batch` rows per transaction; returns how many were deleted."""
+    cur = conn.cursor()
+    deleted = batch
+    total = 0
+    while deleted == batch:
+        cur.execute("""
+            DELETE FROM public.idempotency_key WHERE key_hash IN (
+                SELECT key_hash FROM public.idempotency_key
+                WHERE expires_at < now()
+                ORDER BY expires_at
+                LIMIT %s
+            )
+        """, (batch,))
+        deleted = cur.rowcount
+        total += deleted
+        conn.commit()
+    cur.close()
+    return total
+
+
+def init_app(app):
+    """Honour Idempotency-Key on the write routes of a Flask app."""
+    app.before_request(_before_request)
+    app.after_request(_after_request)
@@ -0,0 +1,182 @@
+"""
+Durable background jobs stored in Postgres (migrations/add_job_queue.sql).
+
+Request handlers call enqueue() (ideally with their own cursor, so the job
+commits or rolls back with the request's writes) and return. worker.py runs
+the handlers registered with @handler(kind): jobs are claimed with
+FOR UPDATE SKIP LOCKED, deleted when they succeed, retried with exponential
+backoff when they raise, and kept with status 'dead' once max_attempts is
+used up. A job whose worker died is requeued when its lease expires.
+"""
+import json
+import os
+import random
+
+import psycopg2.errors
+
+from db import get_connection
+
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "5"))
+JOB_BACKOFF_BASE_SECONDS = float(os.getenv("JOB_BACKOFF_BASE_SECONDS", "5"))
+JOB_BACKOFF_MAX_SECONDS = float(os.getenv("JOB_BACKOFF_MAX_SECONDS", "3600"))
+# A running job not finished within this many seconds is assumed lost and requeued
+JOB_LEASE_SECONDS = int(os.getenv("JOB_LEASE_SECONDS", "300"))
+
+_handlers = {}
+
+ENQUEUE_SQL = """
+    INSERT INTO public.job (kind, payload, dedup_key, max_attempts, run_at)
+    VALUES (%s, %s::jsonb, %s, %s, now() + %s * interval '1 second')
+    ON CONFLICT (dedup_key) WHERE status IN ('queued', 'running') DO NOTHING
+"""
+# The same statement for asyncpg (asgi.py)
+ENQUEUE_SQL_ASYNCPG = """
+    INSERT INTO public.job (kind, payload, dedup_key, max_attempts, run_at)
+    VALUES ($1, $2::jsonb, $3, $4, now() + $5 * interval '1 second')
+    ON CONFLICT (dedup_key) WHERE status IN ('queued', 'running') DO NOTHING
+"""
+
+CLAIM_SQL = """
+    UPDATE public.job
+    SET status = 'running', locked_at = now(), locked_by = %s, attempts = attempts + 1
+    WHERE job_id IN (
+        SELECT job_id FROM public.job
+        WHERE status = 'queued' AND run_at <= now()
+        ORDER BY run_at
+        LIMIT %s
+        FOR UPDATE SKIP LOCKED
+    )
+    RETURNING job_id, kind, payload, attempts, max_attempts
+"""
+
+
+def handler(kind):
+    """Register the function that runs jobs of this kind: fn(payload)."""
+    def register(fn):
+        _handlers[kind] = fn
+        return fn
+    return register
+
+
+def get_handler(kind):
+    return _handlers.get(kind)
+
+
+def enqueue_args(kind, payload, dedup_key=None, max_attempts=None, delay=0):
+    """Parameters for ENQUEUE_SQL / ENQUEUE_SQL_ASYNCPG."""
+    return (kind, json.dumps(payload), dedup_key, max_attempts or JOB_MAX_ATTEMPTS, delay)
+
+
+def enqueue(kind, payload, cur=None, dedup_key=None, max_attempts=None, delay=0):
+    """Queue a job. With `cur` it joins the caller's transaction; otherwise it
+    commits on its own connection. A job with the same dedup_key that is still
+    queued or running makes this a no-op."""
+    params = enqueue_args(kind, payload, dedup_key, max_attempts, delay)
+    if cur is not None:
+        cur.execute(ENQUEUE_SQL, params)
+        return
+    conn = get_connection()
+    try:
+        cur = conn.cursor()
+        cur.execute(ENQUEUE_SQL, params)
+        conn.commit()
+        cur.close()
+    finally:
+        conn.close()
+
+
+def claim(conn, worker_id, limit=1):
+    """Lock up to `limit` due jobs for this worker: [(job_id, kind, payload, attempts, max_attempts)]."""
+    cur = conn.cursor()
+    cur.execute(CLAIM_SQL, (worker_id, limit))
+    jobs = cur.fetchall()
+    conn.commit()
+    cur.close()
+    return jobs
+
+
+def complete(conn, job_id, worker_id):
+    """Delete a finished job. Returns False if this worker's lease on it had
+    expired and the job was requeued (and maybe claimed again) meanwhile."""
+    cur = conn.cursor()
+    cur.execute("""
+        DELETE FROM public.job WHERE job_id = %s AND locked_by = %s AND status = 'running'
+    """, (job_id, worker_id))
+    owned = cur.rowcount == 1
+    conn.commit()
+    cur.close()
+    return owned
+
+
+def backoff_seconds(attempts):
+    """Exponential backoff with full jitter after the given number of attempts."""
+    return random.uniform(0, min(JOB_BACKOFF_MAX_SECONDS, JOB_BACKOFF_BASE_SECONDS * 2 ** (attempts - 1)))
+
+
+def fail(conn, job_id, worker_id, attempts, max_attempts, error):
+    """Schedule a retry, or dead-letter the job once its attempts are used up.
+    Returns "retry" or "dead", or None if this worker no longer held the job
+    (see complete())."""
+    dead = attempts >= max_attempts
+    cur = conn.cursor()
+    if dead:
+        cur.execute("""
+            UPDATE public.job SET status = 'dead', locked_at = NULL, locked_by = NULL, last_error = %s
+            WHERE job_id = %s AND locked_by = %s AND status = 'running'
+        """, (error, job_id, worker_id))
+    else:
+        cur.execute("""
+            UPDATE public.job
+            SET status = 'queued', locked_at = NULL, locked_by = NULL, last_error = %s,
+                run_at = now() + %s * interval '1 second'
+            WHERE job_id = %s AND locked_by = %s AND status = 'running'
+        """, (error, backoff_seconds(attempts), job_id, worker_id))
+    owned = cur.rowcount == 1
+    conn.commit()
+    cur.close()
+    if not owned:
+        return None
+    return "dead" if dead else "retry"
+
+
+def requeue_expired(conn):
+    """Put running jobs whose lease has expired back in the queue. Returns how many."""
+    cur = conn.cursor()
+    cur.execute("""
+        UPDATE public.job SET status = 'queued', locked_at = NULL, locked_by = NULL,
+            last_error = 'lease expired'
+        WHERE status = 'running' AND locked_at < now() - %s * interval '1 second'
+    """, (JOB_LEASE_SECONDS,))
+    count = cur.rowcount
+    conn.commit()
+    cur.close()
+    return count
+
+
+def queue_depth(conn):
+    """Job counts by status."""
+    cur = conn.cursor()
+    cur.execute("SELECT status, COUNT(*) FROM public.job GROUP BY status")
+    counts = {"queued": 0, "running": 0, "dead": 0}
+    counts.update(dict(cur.fetchall()))
+    conn.commit()
+    cur.close()
+    return counts
+
+
+def retry_dead(conn, job_id):
+    """Give a dead job a fresh set of attempts. Returns False if it is not dead."""
+    cur = conn.cursor()
+    try:
+        cur.execute("""
+            UPDATE public.job SET status = 'queued', attempts = 0, run_at = now(), last_error = NULL
+            WHERE job_id = %s AND status = 'dead'
+        """, (job_id,))
+    except psycopg2.errors.UniqueViolation:
+        # An equivalent job (same dedup_key) is already pending; this one is redundant
+        conn.rollback()
+        cur.execute("DELETE FROM public.job WHERE job_id = %s AND status = 'dead'", (job_id,))
+    retried = cur.rowcount == 1
+    conn.commit()
+    cur.close()
+    return retried
@@ -0,0 +1,188 @@
+"""
+Prometheus instrumentation for the API, served at /api/metrics.
+
+Per request: latency by route, query count and DB time (from the cursor hook
+in db.py), and error counts. Also connection pool and read replica gauges,
+Supabase call latency, response cache lookups (cache.py), and the background
+job and event stream metrics recorded by worker.py and sse.py (each served by
+that process). Under gunicorn, PROMETHEUS_MULTIPROC_DIR (set in
+gunicorn.conf.py) makes every worker write to shared files so one scrape
+covers all workers.
+"""
+import os
+import time
+
+from flask import g, has_request_context, request
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram,
+    generate_latest, multiprocess,
+)
+
+import db
+
+REQUEST_LATENCY = Histogram(
+    "http_request_duration_seconds", "Request latency by route",
+    ["method", "route", "status"],
+)
+REQUEST_ERRORS = Counter(
+    "http_request_errors_total", "Requests answered with a 5xx status",
+    ["method", "route", "status"],
+)
+REQUEST_QUERIES = Histogram(
+    "db_queries_per_request", "SQL statements executed per request",
+    ["route"], buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 100),
+)
+REQUEST_DB_TIME = Histogram(
+    "db_time_per_request_seconds", "Time spent in SQL per request",
+    ["route"],
+)
+QUERY_BUDGET_EXCEEDED = Counter(
+    "db_query_budget_exceeded_total", "Requests that ran more SQL statements than their route's budget",
+    ["route"],
+)
+POOL_CONNECTIONS = Gauge(
+    "db_pool_connections", "Pooled connections by state",
+    ["state"], multiprocess_mode="livesum",
+)
+REPLICA_HEALTHY = Gauge(
+    "db_replica_healthy", "1 while a read replica is in rotation",
+    ["replica"], multiprocess_mode="livemin",
+)
+REPLICA_LAG = Gauge(
+    "db_replica_lag_seconds", "Read replica replay lag at the last health check",
+    ["replica"], multiprocess_mode="livemax",
+)
+REQUESTS_SHED = Counter(
+    "http_requests_shed_total", "Requests refused by admission control",
+    ["route_class", "reason"],
+)
+ADMISSION_RUNNING = Gauge(
+    "admission_running_requests", "Admitted requests currently running, by route class",
+    ["route_class"], multiprocess_mode="livesum",
+)
+IDEMPOTENT_REQUESTS = Counter(
+    "idempotent_requests_total",
+    "Requests with an Idempotency-Key, by outcome (stored, released, replayed, in_progress, mismatch)",
+    ["route", "outcome"],
+)
+CACHE_REQUESTS = Counter(
+    "cache_requests_total", "Cached route lookups, by result (hit_local, hit_shared, miss)",
+    ["route", "result"],
+)
+CACHE_INVALIDATIONS = Counter(
+    "cache_invalidations_total", "Cache tags invalidated, by kind (table, course, user)",
+    ["kind"],
+)
+CACHE_LOCAL_BYTES = Gauge(
+    "cache_local_bytes", "Response bytes held in the in-process cache tier",
+    multiprocess_mode="livesum",
+)
+SINGLEFLIGHT_REQUESTS = Counter(
+    "singleflight_requests_total",
+    "Coalesced route requests, by role (leader, follower_local, follower_shared, alone)",
+    ["route", "role"],
+)
+JOBS_PROCESSED = Counter(
+    "jobs_processed_total", "Background jobs run by worker.py, by outcome (done, retry, dead, lease_lost)",
+    ["kind", "outcome"],
+)
+JOB_DURATION = Histogram(
+    "job_duration_seconds", "Background job run time",
+    ["kind"],
+)
+JOB_QUEUE_DEPTH = Gauge(
+    "job_queue_depth", "Background jobs by status at the worker's last check",
+    ["status"], multiprocess_mode="livemax",
+)
+SSE_CLIENTS = Gauge(
+    "sse_clients", "Clients connected to the event stream (sse.py)",
+    multiprocess_mode="livesum",
+)
+SSE_EVENTS_SENT = Counter(
+    "sse_events_sent_total", "Events written to event stream clients",
+    ["kind"],
+)
+SSE_CLIENTS_DROPPED = Counter(
+    "sse_clients_dropped_total", "Event stream clients disconnected for falling behind",
+)
+SUPABASE_LATENCY = Histogram(
+    "supabase_request_duration_seconds", "Supabase Auth call latency",
+    ["operation", "status"],
+)
+
+
+def current_route():
+    """Route template of the current request (e.g. /api/courses/<course_id>)."""
+    if has_request_context() and request.url_rule is not None:
+        return request.url_rule.rule
+    return "unmatched"
+
+
+def observe_request(method, route, status, seconds):
+    REQUEST_LATENCY.labels(method, route, status).observe(seconds)
+    if int(status) >= 500:
+        REQUEST_ERRORS.labels(method, route, status).inc()
+
+
+def observe_supabase(operation, status, seconds):
+    SUPABASE_LATENCY.labels(operation, status).observe(seconds)
+
+
+def _on_query(cursor, query, params, seconds):
+    if has_request_context():
+        g.db_queries = g.get("db_queries", 0) + 1
+        g.db_seconds = g.get("db_seconds", 0.0) + seconds
+
+
+def _update_pool_gauges():
+    stats = db.pool_stats()
+    if stats is None:
+        return
+    for state, count in stats.items():
+        POOL_CONNECTIONS.labels(state).set(count)
+
+
+def _update_replica_gauges():
+    for replica in db.replica_stats():
+        REPLICA_HEALTHY.labels(replica["replica"]).set(1 if replica["healthy"] else 0)
+        if replica["lag_seconds"] is not None:
+            REPLICA_LAG.labels(replica["replica"]).set(replica["lag_seconds"])
+
+
+def _before_request():
+    g.request_start = time.perf_counter()
+
+
+def _after_request(response):
+    start = g.get("request_start")
+    if start is not None:
+        route = current_route()
+        observe_request(request.method, route, str(response.status_code), time.perf_counter() - start)
+        REQUEST_QUERIES.labels(route).observe(g.get("db_queries", 0))
+        REQUEST_DB_TIME.labels(route).observe(g.get("db_seconds", 0.0))
+    return response
+
+
+def _teardown_request(exc):
+    # Registered before the app's connection-release teardown, so it runs after it
+    _update_pool_gauges()
+
+
+def render():
+    """Current metrics in Prometheus text format: (body, content_type)."""
+    _update_pool_gauges()
+    _update_replica_gauges()
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
+
+
+def init_app(app):
+    """Attach request instrumentation to a Flask app."""
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.teardown_request(_teardown_request)
+    db.add_query_hook(_on_query)
@@ -0,0 +1,14 @@
+-- Per-student announcement feed (GET /api/student/announcements)
+-- Run this in Supabase SQL Editor (after add_performance_indexes.sql)
+
+-- Announcements newer than this are unread; set by POST /api/student/announcements/seen
+ALTER TABLE public.student ADD COLUMN IF NOT EXISTS announcements_seen_at timestamp;
+
+-- Announcements of a course, newest first, with the id as tie-breaker so the
+-- feed's keyset (created_at, announcement_id) is read straight off the index.
+-- Replaces idx_announcement_course_created, which it covers.
+CREATE INDEX IF NOT EXISTS idx_announcement_course_feed
+    ON public.announcement(course_id, created_at DESC, announcement_id DESC);
+DROP INDEX IF EXISTS public.idx_announcement_course_created;
+
+ANALYZE public.announcement;
@@ -0,0 +1,21 @@
+-- Event log for the dashboard push channel (see events.py and sse.py)
+-- Run this in Supabase SQL Editor
+
+-- Every event is stored so reconnecting clients can resume from their last
+-- event id; sse.py deletes events older than SSE_EVENT_RETENTION_HOURS.
+-- user_id set: only that user gets the event; otherwise everyone in course_id.
+CREATE TABLE IF NOT EXISTS public.app_event (
+    event_id bigserial PRIMARY KEY,
+    kind text NOT NULL,
+    course_id uuid,
+    user_id uuid,
+    data jsonb NOT NULL DEFAULT '{}',
+    created_at timestamptz NOT NULL DEFAULT now()
+);
+
+CREATE INDEX IF NOT EXISTS idx_app_event_created ON public.app_event(created_at);
+
+ALTER TABLE public.app_event ENABLE ROW LEVEL SECURITY;
+
+-- Allow backend/API access (app does its own auth checks)
+CREATE POLICY "Allow all for app_event" ON public.app_event FOR ALL USING (true) WITH CHECK (true);
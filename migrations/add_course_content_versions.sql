@@ -0,0 +1,50 @@
+-- Course content versions and compiled module trees (see course_content.py)
+-- Run this in Supabase SQL Editor
+--
+-- version is bumped by trigger whenever a course's modules or module content
+-- change, however they change. modules holds the student module tree
+-- compiled from modules_version; it is current when that equals version.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS public.course_content (
+    course_id uuid PRIMARY KEY REFERENCES public.course(course_id) ON DELETE CASCADE,
+    version bigint NOT NULL DEFAULT 1,
+    modules jsonb,
+    modules_version bigint
+);
+
+ALTER TABLE public.course_content ENABLE ROW LEVEL SECURITY;
+CREATE POLICY "Allow all for course_content" ON public.course_content FOR ALL USING (true) WITH CHECK (true);
+
+CREATE OR REPLACE FUNCTION public.bump_course_content_version()
+RETURNS trigger AS $$
+DECLARE
+    v_course_id uuid := CASE WHEN TG_OP = 'DELETE' THEN OLD.course_id ELSE NEW.course_id END;
+BEGIN
+    -- The course itself may be going (cascaded delete)
+    INSERT INTO public.course_content (course_id)
+    SELECT course_id FROM public.course WHERE course_id = v_course_id
+    ON CONFLICT (course_id) DO UPDATE SET version = public.course_content.version + 1;
+    IF TG_OP = 'UPDATE' AND OLD.course_id IS DISTINCT FROM NEW.course_id THEN
+        UPDATE public.course_content SET version = version + 1 WHERE course_id = OLD.course_id;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_module_content_version ON public.module;
+CREATE TRIGGER trigger_module_content_version
+AFTER INSERT OR UPDATE OR DELETE ON public.module
+FOR EACH ROW EXECUTE FUNCTION public.bump_course_content_version();
+
+DROP TRIGGER IF EXISTS trigger_module_content_item_version ON public.module_content;
+CREATE TRIGGER trigger_module_content_item_version
+AFTER INSERT OR UPDATE OR DELETE ON public.module_content
+FOR EACH ROW EXECUTE FUNCTION public.bump_course_content_version();
+
+INSERT INTO public.course_content (course_id)
+SELECT course_id FROM public.course
+ON CONFLICT (course_id) DO NOTHING;
+
+COMMIT;
@@ -0,0 +1,114 @@
+-- Waitlist for full courses, with promotion when seats free up
+-- Run this in Supabase SQL Editor (after add_seat_reservations.sql; promotions
+-- after a capacity change are queued on add_job_queue.sql's public.job)
+--
+-- Tickets only grow within a course's queue and leaving leaves a gap, so
+-- joining and leaving write one row however long the queue. A student's
+-- position is counted when it is read (app.py's WAITLIST_SQL). Changes to a
+-- course's queue take lock_course_waitlist() first, so they are applied one
+-- at a time.
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS public.course_waitlist (
+    user_id uuid NOT NULL REFERENCES public.student(user_id) ON DELETE CASCADE,
+    course_id uuid NOT NULL REFERENCES public.course(course_id) ON DELETE CASCADE,
+    ticket int NOT NULL,
+    joined_at timestamptz NOT NULL DEFAULT now(),
+    PRIMARY KEY (user_id, course_id)
+);
+
+-- Queue order within a course: head, tail and positions
+CREATE INDEX IF NOT EXISTS idx_course_waitlist_queue ON public.course_waitlist(course_id, ticket);
+
+ALTER TABLE public.course_waitlist ENABLE ROW LEVEL SECURITY;
+CREATE POLICY "Allow all for course_waitlist" ON public.course_waitlist FOR ALL USING (true) WITH CHECK (true);
+
+-- Serializes changes to one course's queue until the transaction ends. Take it
+-- before dropping an enrollment that may promote (before any seat stripe lock).
+CREATE OR REPLACE FUNCTION public.lock_course_waitlist(p_course_id uuid)
+RETURNS void AS $$
+BEGIN
+    PERFORM pg_advisory_xact_lock(hashtextextended('course_waitlist:' || p_course_id::text, 0));
+END;
+$$ LANGUAGE plpgsql;
+
+-- Enroll waitlisted students, head first, while the course has free seats.
+-- Returns the students enrolled. Called through app.promote_waitlisted(), which
+-- also tells each of them (a waitlist_promoted event), so nothing here calls it.
+CREATE OR REPLACE FUNCTION public.promote_waitlisted(p_course_id uuid)
+RETURNS SETOF uuid AS $$
+DECLARE
+    v_user uuid;
+    v_stripe int;
+BEGIN
+    PERFORM public.lock_course_waitlist(p_course_id);
+    LOOP
+        SELECT user_id INTO v_user
+        FROM public.course_waitlist
+        WHERE course_id = p_course_id
+        ORDER BY ticket
+        LIMIT 1;
+        EXIT WHEN v_user IS NULL;
+
+        v_stripe := public.claim_course_seat(p_course_id);
+        EXIT WHEN v_stripe IS NULL;
+
+        DELETE FROM public.course_waitlist WHERE user_id = v_user AND course_id = p_course_id;
+        INSERT INTO public.enrolled_in (user_id, course_id, status, seat_stripe)
+        VALUES (v_user, p_course_id, 'ongoing', NULLIF(v_stripe, -1))
+        ON CONFLICT (user_id, course_id) DO NOTHING;
+        IF FOUND THEN
+            RETURN NEXT v_user;
+        ELSIF v_stripe >= 0 THEN
+            -- Already has an enrollment row: the seat goes to the next in line
+            UPDATE public.course_seat_stripe SET taken = taken - 1
+            WHERE course_id = p_course_id AND stripe = v_stripe;
+        END IF;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Put a student at the back of a course's queue. Returns the ticket, or NULL
+-- if the student was already waiting. The caller then promotes, in case seats
+-- are free.
+CREATE OR REPLACE FUNCTION public.join_course_waitlist(p_course_id uuid, p_user_id uuid)
+RETURNS int AS $$
+DECLARE
+    v_ticket int;
+BEGIN
+    PERFORM public.lock_course_waitlist(p_course_id);
+    INSERT INTO public.course_waitlist (user_id, course_id, ticket)
+    SELECT p_user_id, p_course_id, COALESCE(MAX(ticket), 0) + 1
+    FROM public.course_waitlist
+    WHERE course_id = p_course_id
+    ON CONFLICT (user_id, course_id) DO NOTHING
+    RETURNING ticket INTO v_ticket;
+    RETURN v_ticket;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Earlier versions renumbered the queue behind everyone who left
+DROP TRIGGER IF EXISTS trigger_close_waitlist_gap ON public.course_waitlist;
+DROP FUNCTION IF EXISTS public.close_waitlist_gap();
+
+-- Raising a course's capacity queues a promote_waitlist job (app.py), which
+-- promotes from its waitlist and tells the students promoted
+CREATE OR REPLACE FUNCTION public.sync_course_capacity()
+RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' OR NEW.total_vacancies IS DISTINCT FROM OLD.total_vacancies THEN
+        PERFORM public.lock_course_waitlist(NEW.course_id);
+        PERFORM public.set_course_capacity(NEW.course_id, NEW.total_vacancies);
+        IF EXISTS (SELECT 1 FROM public.course_waitlist WHERE course_id = NEW.course_id) THEN
+            INSERT INTO public.job (kind, payload, dedup_key)
+            VALUES ('promote_waitlist', jsonb_build_object('course_id', NEW.course_id),
+                    'promote_waitlist:' || NEW.course_id)
+            ON CONFLICT (dedup_key) WHERE status IN ('queued', 'running') DO NOTHING;
+        END IF;
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+COMMIT;
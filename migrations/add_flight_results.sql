@@ -0,0 +1,17 @@
+-- Responses shared between processes by singleflight.py
+-- Run this in Supabase SQL Editor
+
+-- One row per request key, overwritten by each leader. UNLOGGED: rows are
+-- only useful for seconds, so they need no WAL and may be lost on a crash.
+CREATE UNLOGGED TABLE IF NOT EXISTS public.flight_result (
+    key text PRIMARY KEY,
+    status smallint NOT NULL,
+    mimetype text NOT NULL,
+    body bytea NOT NULL,
+    finished_at timestamptz NOT NULL
+);
+
+ALTER TABLE public.flight_result ENABLE ROW LEVEL SECURITY;
+
+-- Allow backend/API access (app does its own auth checks)
+CREATE POLICY "Allow all for flight_result" ON public.flight_result FOR ALL USING (true) WITH CHECK (true);
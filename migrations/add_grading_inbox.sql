@@ -0,0 +1,10 @@
+-- Ungraded submissions for the instructor inbox (GET /api/instructor/needs-grading)
+-- Run this in Supabase SQL Editor (after add_assignment_tables.sql)
+
+-- Only ungraded rows are indexed, so the index shrinks as grading catches up
+-- and the inbox reads each assignment's waiting submissions oldest first.
+CREATE INDEX IF NOT EXISTS idx_submission_ungraded
+    ON public.assignment_submission(assignment_id, submitted_at, submission_id)
+    WHERE marks_obtained IS NULL;
+
+ANALYZE public.assignment_submission;
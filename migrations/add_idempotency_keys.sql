@@ -0,0 +1,21 @@
+-- Stored responses for Idempotency-Key retries (see idempotency.py)
+-- Run this in Supabase SQL Editor
+
+-- One row per key: hashes instead of the raw key and body keep rows small.
+-- A row is inserted when a request claims its key and committed with the
+-- response, so other requests only ever see finished ones.
+CREATE TABLE IF NOT EXISTS public.idempotency_key (
+    key_hash bytea PRIMARY KEY,
+    request_hash bytea NOT NULL,
+    status_code smallint,
+    response bytea,
+    expires_at timestamptz NOT NULL
+);
+
+-- Expired rows are pruned oldest first by worker.py
+CREATE INDEX IF NOT EXISTS idx_idempotency_key_expires ON public.idempotency_key(expires_at);
+
+ALTER TABLE public.idempotency_key ENABLE ROW LEVEL SECURITY;
+
+-- Allow backend/API access (app does its own auth checks)
+CREATE POLICY "Allow all for idempotency_key" ON public.idempotency_key FOR ALL USING (true) WITH CHECK (true);
@@ -0,0 +1,31 @@
+-- Background job queue (see jobs.py and worker.py)
+-- Run this in Supabase SQL Editor
+
+CREATE TABLE IF NOT EXISTS public.job (
+    job_id bigserial PRIMARY KEY,
+    kind text NOT NULL,
+    payload jsonb NOT NULL DEFAULT '{}',
+    status text NOT NULL DEFAULT 'queued' CHECK (status IN ('queued', 'running', 'dead')),
+    attempts int NOT NULL DEFAULT 0,
+    max_attempts int NOT NULL DEFAULT 5,
+    run_at timestamptz NOT NULL DEFAULT now(),
+    locked_at timestamptz,
+    locked_by text,
+    last_error text,
+    dedup_key text,
+    created_at timestamptz NOT NULL DEFAULT now()
+);
+
+-- Workers claim the oldest due job; only queued rows are indexed
+CREATE INDEX IF NOT EXISTS idx_job_due ON public.job(run_at) WHERE status = 'queued';
+
+-- Expired leases are found among running jobs
+CREATE INDEX IF NOT EXISTS idx_job_running ON public.job(locked_at) WHERE status = 'running';
+
+-- At most one pending job per dedup key
+CREATE UNIQUE INDEX IF NOT EXISTS idx_job_dedup ON public.job(dedup_key) WHERE status IN ('queued', 'running');
+
+ALTER TABLE public.job ENABLE ROW LEVEL SECURITY;
+
+-- Allow backend/API access (app does its own auth checks)
+CREATE POLICY "Allow all for job" ON public.job FOR ALL USING (true) WITH CHECK (true);
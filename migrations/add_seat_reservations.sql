@@ -0,0 +1,155 @@
+-- Course capacity (course.total_vacancies) enforced at enrollment
+-- Run this in Supabase SQL Editor (after add_performance_indexes.sql)
+--
+-- A course's seats are split over 16 stripe rows. An enrollment takes a seat
+-- from any stripe with room, skipping stripes other enrollments have locked,
+-- so concurrent enrollments in one course rarely wait on each other and the
+-- stripe capacities add up to the course capacity, which can never be
+-- exceeded. total_vacancies is the total number of seats; NULL means
+-- unlimited. Dropping or deleting an enrollment gives its seat back.
+--
+-- This also drops trigger_update_course_enrollment_count: it recounted the
+-- course's enrollments and updated the course row on every enrollment, which
+-- serialized enrollments in a course on that row. The column it maintained,
+-- course.total_enrollments, is dropped with it (nothing reads it; the counts
+-- come from enrolled_in, and course_seats has live counts for courses with a
+-- capacity).
+
+BEGIN;
+
+CREATE TABLE IF NOT EXISTS public.course_seat_stripe (
+    course_id uuid NOT NULL REFERENCES public.course(course_id) ON DELETE CASCADE,
+    stripe smallint NOT NULL,
+    capacity int NOT NULL,
+    taken int NOT NULL DEFAULT 0 CHECK (taken >= 0),
+    PRIMARY KEY (course_id, stripe)
+);
+
+ALTER TABLE public.course_seat_stripe ENABLE ROW LEVEL SECURITY;
+CREATE POLICY "Allow all for course_seat_stripe" ON public.course_seat_stripe FOR ALL USING (true) WITH CHECK (true);
+
+-- Stripe an enrollment's seat came from (NULL: before capacity applied, counted in stripe 0)
+ALTER TABLE public.enrolled_in ADD COLUMN IF NOT EXISTS seat_stripe smallint;
+
+CREATE OR REPLACE VIEW public.course_seats AS
+SELECT course_id, SUM(capacity) AS capacity, SUM(taken) AS taken,
+       GREATEST(SUM(capacity) - SUM(taken), 0) AS available
+FROM public.course_seat_stripe
+GROUP BY course_id;
+
+-- Take a seat in a course. Returns the stripe, -1 if the course has no
+-- capacity limit, or NULL if it is full. The stripe stays locked until the
+-- caller's transaction ends, so a rolled back enrollment frees its seat.
+CREATE OR REPLACE FUNCTION public.claim_course_seat(p_course_id uuid)
+RETURNS int AS $$
+DECLARE
+    v_stripe int;
+BEGIN
+    SELECT stripe INTO v_stripe
+    FROM public.course_seat_stripe
+    WHERE course_id = p_course_id AND taken < capacity
+    ORDER BY random()
+    LIMIT 1
+    FOR UPDATE SKIP LOCKED;
+
+    IF v_stripe IS NULL THEN
+        IF NOT EXISTS (SELECT 1 FROM public.course_seat_stripe WHERE course_id = p_course_id) THEN
+            RETURN -1;
+        END IF;
+        -- Every stripe with room is locked by an enrollment in flight; wait for
+        -- one (its room is rechecked once the lock is ours)
+        SELECT stripe INTO v_stripe
+        FROM public.course_seat_stripe
+        WHERE course_id = p_course_id AND taken < capacity
+        LIMIT 1
+        FOR UPDATE;
+        IF v_stripe IS NULL THEN
+            RETURN NULL;
+        END IF;
+    END IF;
+
+    UPDATE public.course_seat_stripe SET taken = taken + 1
+    WHERE course_id = p_course_id AND stripe = v_stripe;
+    RETURN v_stripe;
+END;
+$$ LANGUAGE plpgsql;
+
+-- (Re)build a course's stripes for a new capacity: recount the seats held in
+-- each stripe and spread the free seats over all of them. NULL removes the limit.
+CREATE OR REPLACE FUNCTION public.set_course_capacity(p_course_id uuid, p_capacity int)
+RETURNS void AS $$
+DECLARE
+    stripes constant int := 16;
+    v_taken int;
+    v_free int;
+BEGIN
+    IF p_capacity IS NULL THEN
+        DELETE FROM public.course_seat_stripe WHERE course_id = p_course_id;
+        RETURN;
+    END IF;
+
+    INSERT INTO public.course_seat_stripe (course_id, stripe, capacity, taken)
+    SELECT p_course_id, s, 0, 0 FROM generate_series(0, stripes - 1) s
+    ON CONFLICT DO NOTHING;
+    -- Wait for enrollments holding a stripe to finish, so the recount is exact
+    PERFORM 1 FROM public.course_seat_stripe WHERE course_id = p_course_id ORDER BY stripe FOR UPDATE;
+
+    UPDATE public.course_seat_stripe st
+    SET taken = COALESCE(x.n, 0)
+    FROM (SELECT s AS stripe,
+                 (SELECT COUNT(*) FROM public.enrolled_in e
+                  WHERE e.course_id = p_course_id AND e.status != 'dropped'
+                    AND COALESCE(e.seat_stripe, 0) = s) AS n
+          FROM generate_series(0, stripes - 1) s) x
+    WHERE st.course_id = p_course_id AND st.stripe = x.stripe;
+
+    SELECT SUM(taken) INTO v_taken FROM public.course_seat_stripe WHERE course_id = p_course_id;
+    v_free := GREATEST(p_capacity - v_taken, 0);
+    UPDATE public.course_seat_stripe
+    SET capacity = taken + v_free / stripes + CASE WHEN stripe < v_free % stripes THEN 1 ELSE 0 END
+    WHERE course_id = p_course_id;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Keep the stripes in line with course.total_vacancies, whatever changes it
+CREATE OR REPLACE FUNCTION public.sync_course_capacity()
+RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' OR NEW.total_vacancies IS DISTINCT FROM OLD.total_vacancies THEN
+        PERFORM public.set_course_capacity(NEW.course_id, NEW.total_vacancies);
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_sync_course_capacity ON public.course;
+CREATE TRIGGER trigger_sync_course_capacity
+AFTER INSERT OR UPDATE OF total_vacancies ON public.course
+FOR EACH ROW EXECUTE FUNCTION public.sync_course_capacity();
+
+-- Give the seat back when an enrollment is dropped or deleted
+CREATE OR REPLACE FUNCTION public.release_course_seat()
+RETURNS trigger AS $$
+BEGIN
+    IF OLD.status != 'dropped' AND (TG_OP = 'DELETE' OR NEW.status = 'dropped') THEN
+        UPDATE public.course_seat_stripe SET taken = taken - 1
+        WHERE course_id = OLD.course_id AND stripe = COALESCE(OLD.seat_stripe, 0) AND taken > 0;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS trigger_release_course_seat ON public.enrolled_in;
+CREATE TRIGGER trigger_release_course_seat
+AFTER UPDATE OF status OR DELETE ON public.enrolled_in
+FOR EACH ROW EXECUTE FUNCTION public.release_course_seat();
+
+DROP TRIGGER IF EXISTS trigger_update_course_enrollment_count ON public.enrolled_in;
+DROP FUNCTION IF EXISTS public.update_course_enrollment_count();
+ALTER TABLE public.course DROP COLUMN IF EXISTS total_enrollments;
+
+SELECT public.set_course_capacity(course_id, total_vacancies)
+FROM public.course
+WHERE total_vacancies IS NOT NULL;
+
+COMMIT;
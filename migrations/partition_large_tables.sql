@@ -0,0 +1,127 @@
+-- OPTIONAL: hash-partition the two unbounded tables
+--   enrolled_in            by course_id      (16 partitions)
+--   assignment_submission  by assignment_id  (16 partitions)
+--
+-- Only worth it once these tables reach tens of millions of rows: per-course
+-- and per-assignment queries then touch one partition, and vacuum/analyze
+-- work on smaller pieces. Run after add_performance_indexes.sql, in a
+-- maintenance window: the tables are copied under an exclusive lock.
+-- Check pruning afterwards with `python -m bench.plans`.
+--
+-- Trade-offs, because every unique key must contain the partition key:
+-- - assignment_submission's primary key becomes (submission_id, assignment_id);
+--   lookups by submission_id alone probe each partition's key index.
+-- - per-student queries (a student's submissions, a student's enrollments)
+--   read one index per partition instead of one index.
+--
+-- Submissions are hashed by assignment_id rather than course_id because the
+-- table has no course_id and (assignment_id, student_id) must stay unique.
+
+BEGIN;
+
+LOCK TABLE public.enrolled_in, public.assignment_submission IN ACCESS EXCLUSIVE MODE;
+
+-- =====================================================
+-- ENROLLMENTS
+-- =====================================================
+ALTER TABLE public.enrolled_in RENAME TO enrolled_in_unpartitioned;
+
+CREATE TABLE public.enrolled_in (
+    LIKE public.enrolled_in_unpartitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS
+) PARTITION BY HASH (course_id);
+
+DO $$
+BEGIN
+    FOR i IN 0..15 LOOP
+        EXECUTE format('CREATE TABLE public.enrolled_in_p%s PARTITION OF public.enrolled_in
+                        FOR VALUES WITH (MODULUS 16, REMAINDER %s)', i, i);
+        EXECUTE format('ALTER TABLE public.enrolled_in_p%s ENABLE ROW LEVEL SECURITY', i);
+    END LOOP;
+END $$;
+
+-- Copy before the counter triggers exist, so the counters are not recomputed per row
+INSERT INTO public.enrolled_in SELECT * FROM public.enrolled_in_unpartitioned;
+DROP TABLE public.enrolled_in_unpartitioned;
+
+ALTER TABLE public.enrolled_in ADD PRIMARY KEY (user_id, course_id);
+ALTER TABLE public.enrolled_in
+    ADD FOREIGN KEY (user_id) REFERENCES public.student(user_id) ON DELETE CASCADE,
+    ADD FOREIGN KEY (course_id) REFERENCES public.course(course_id) ON DELETE CASCADE;
+
+CREATE INDEX idx_enrolled_user ON public.enrolled_in(user_id);
+CREATE INDEX idx_enrolled_course ON public.enrolled_in(course_id);
+CREATE INDEX idx_enrolled_status ON public.enrolled_in(status);
+CREATE INDEX idx_enrolled_active_course
+    ON public.enrolled_in(course_id) INCLUDE (user_id, status)
+    WHERE status <> 'dropped';
+
+CREATE TRIGGER trigger_update_enrollment_count
+AFTER INSERT OR UPDATE OR DELETE ON public.enrolled_in
+FOR EACH ROW EXECUTE FUNCTION update_student_enrollment_count();
+
+CREATE TRIGGER trigger_update_completion_count
+AFTER UPDATE ON public.enrolled_in
+FOR EACH ROW EXECUTE FUNCTION update_student_completion_count();
+
+-- With seat reservations (add_seat_reservations.sql) seats are released by
+-- trigger and the per-course counter trigger is gone
+DO $$
+BEGIN
+    IF to_regproc('public.release_course_seat') IS NOT NULL THEN
+        CREATE TRIGGER trigger_release_course_seat
+        AFTER UPDATE OF status OR DELETE ON public.enrolled_in
+        FOR EACH ROW EXECUTE FUNCTION public.release_course_seat();
+    ELSE
+        CREATE TRIGGER trigger_update_course_enrollment_count
+        AFTER INSERT OR UPDATE OR DELETE ON public.enrolled_in
+        FOR EACH ROW EXECUTE FUNCTION update_course_enrollment_count();
+    END IF;
+END $$;
+
+ALTER TABLE public.enrolled_in ENABLE ROW LEVEL SECURITY;
+CREATE POLICY "Student manage own enrollment"
+ON public.enrolled_in
+FOR ALL
+USING (auth.uid() = user_id);
+
+-- =====================================================
+-- SUBMISSIONS
+-- =====================================================
+ALTER TABLE public.assignment_submission RENAME TO assignment_submission_unpartitioned;
+
+CREATE TABLE public.assignment_submission (
+    LIKE public.assignment_submission_unpartitioned INCLUDING DEFAULTS INCLUDING CONSTRAINTS
+) PARTITION BY HASH (assignment_id);
+
+DO $$
+BEGIN
+    FOR i IN 0..15 LOOP
+        EXECUTE format('CREATE TABLE public.assignment_submission_p%s PARTITION OF public.assignment_submission
+                        FOR VALUES WITH (MODULUS 16, REMAINDER %s)', i, i);
+        EXECUTE format('ALTER TABLE public.assignment_submission_p%s ENABLE ROW LEVEL SECURITY', i);
+    END LOOP;
+END $$;
+
+INSERT INTO public.assignment_submission SELECT * FROM public.assignment_submission_unpartitioned;
+DROP TABLE public.assignment_submission_unpartitioned;
+
+ALTER TABLE public.assignment_submission
+    ADD PRIMARY KEY (submission_id, assignment_id),
+    ADD CONSTRAINT assignment_submission_assignment_id_student_id_key UNIQUE (assignment_id, student_id),
+    ADD FOREIGN KEY (assignment_id) REFERENCES public.assignment(assignment_id) ON DELETE CASCADE,
+    ADD FOREIGN KEY (student_id) REFERENCES public.student(user_id) ON DELETE CASCADE;
+
+CREATE INDEX idx_submission_student
+    ON public.assignment_submission(student_id, assignment_id) INCLUDE (marks_obtained);
+CREATE INDEX idx_submission_assignment_submitted
+    ON public.assignment_submission(assignment_id, submitted_at DESC);
+CREATE INDEX idx_submission_ungraded
+    ON public.assignment_submission(assignment_id, submitted_at, submission_id)
+    WHERE marks_obtained IS NULL;
+
+ALTER TABLE public.assignment_submission ENABLE ROW LEVEL SECURITY;
+CREATE POLICY "Allow all for assignment_submission" ON public.assignment_submission FOR ALL USING (true) WITH CHECK (true);
+
+COMMIT;
+
+ANALYZE public.enrolled_in, public.assignment_submission;
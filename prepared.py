@@ -0,0 +1,117 @@
+"""
+Hot statements prepared once per connection.
+
+    USER_ROLE = prepared.statement("user_role", "SELECT role FROM public.users WHERE user_id = %s")
+    prepared.execute(cur, USER_ROLE, (user_id,))
+
+A registered statement is PREPAREd the first time a connection runs it (in
+the same round trip as its first EXECUTE) and EXECUTEd by name after that, so
+Postgres parses it once per connection and, once it settles on a generic
+plan, stops planning it. Each connection remembers what it has prepared, so
+a new connection (after a reconnect) prepares again.
+
+When the server no longer has a statement (its session was reset) or its
+cached plan cannot be used any more (a table it reads changed columns), it
+is prepared again: on the spot when it was the first statement of its
+transaction, otherwise that transaction fails and the next use re-prepares.
+
+Prepared statements live in the server session, which PgBouncer in
+transaction mode (the Supabase pooler's port 6543) does not keep per
+connection, so PREPARED_STATEMENTS is off by default on that port and the
+statements run as plain queries.
+"""
+import os
+import re
+import threading
+import weakref
+
+import psycopg2.errors
+import psycopg2.extensions
+
+PREPARED_STATEMENTS = os.getenv("PREPARED_STATEMENTS", "off" if os.getenv("DB_PORT") == "6543" else "on")
+
+# name -> (sql, PREPARE statement, EXECUTE statement)
+_statements = {}
+# connection -> {name: True when prepared, False when it must be replaced}
+_prepared = weakref.WeakKeyDictionary()
+_prepared_lock = threading.Lock()
+
+_EXECUTE_RE = re.compile(r"EXECUTE (\w+)(?: \(.*\))?\s*$", re.DOTALL)
+
+
+def statement(name, sql):
+    """Register `sql`, with %s parameters, under `name`; returns the name."""
+    if not re.fullmatch(r"[a-z_][a-z0-9_]*", name):
+        raise ValueError(f"invalid statement name {name!r}")
+    if name in _statements:
+        raise ValueError(f"statement {name!r} is already registered")
+    parts = sql.split("%s")
+    numbered = parts[0] + "".join(f"${i}{part}" for i, part in enumerate(parts[1:], 1))
+    arguments = f" ({', '.join(['%s'] * (len(parts) - 1))})" if len(parts) > 1 else ""
+    _statements[name] = (sql, f"PREPARE {name} AS {numbered}", f"EXECUTE {name}{arguments}")
+    return name
+
+
+def registered():
+    """{name: sql} of every registered statement."""
+    return {name: entry[0] for name, entry in _statements.items()}
+
+
+def plain_sql(query):
+    """The registered SQL behind a captured EXECUTE (or PREPARE + EXECUTE)
+    statement, so it can be EXPLAINed on any connection; other queries as they are."""
+    if isinstance(query, bytes):
+        query = query.decode()
+    match = _EXECUTE_RE.search(query)
+    if match and match.group(1) in _statements:
+        return _statements[match.group(1)][0]
+    return query
+
+
+def _state(conn):
+    with _prepared_lock:
+        state = _prepared.get(conn)
+        if state is None:
+            state = _prepared[conn] = {}
+        return state
+
+
+def execute(cur, name, params=()):
+    """Run a registered statement on `cur`, preparing it on its connection if needed."""
+    sql, prepare_sql, execute_sql = _statements[name]
+    if PREPARED_STATEMENTS == "off":
+        return cur.execute(sql, params or None)
+    conn = cur.connection
+    state = _state(conn)
+    # Only a failed first statement can be retried without losing the caller's work
+    first = conn.info.transaction_status == psycopg2.extensions.TRANSACTION_STATUS_IDLE
+    while True:
+        prepared = state.get(name)
+        if prepared:
+            query = execute_sql
+        elif prepared is None:
+            query = f"{prepare_sql};\n{execute_sql}"
+        else:
+            query = f"DEALLOCATE {name};\n{prepare_sql};\n{execute_sql}"
+        try:
+            cur.execute(query, params or None)
+            state[name] = True
+            return
+        except psycopg2.errors.DuplicatePreparedStatement:
+            # Prepared by an attempt whose EXECUTE failed
+            state[name] = True
+            if not first:
+                raise
+        except psycopg2.errors.InvalidSqlStatementName:
+            state.pop(name, None)
+            if not first:
+                raise
+        except psycopg2.errors.FeatureNotSupported:
+            # "cached plan must not change result type"
+            if not prepared:
+                raise
+            state[name] = False
+            if not first:
+                raise
+        conn.rollback()
+        first = False
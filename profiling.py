@@ -0,0 +1,166 @@
+"""
+On-demand request profiling.
+
+A request carrying the header `X-Profile: <admin user_id>` from an
+administrator runs under a stack-sampling profiler and tracemalloc. The run is
+saved to PROFILE_DIR as folded stacks (flamegraph.pl / speedscope input) and a
+top-allocations report, keeping the newest PROFILE_MAX_RUNS runs, and its id
+is returned in the X-Profile-Id response header. Runs are listed and fetched
+through /api/admin/profiles. Requests without the header only pay for one
+header lookup.
+"""
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter
+
+from flask import g, request
+
+from metrics import current_route
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(tempfile.gettempdir(), "mooc-profiles"))
+PROFILE_MAX_RUNS = int(os.getenv("PROFILE_MAX_RUNS", "50"))
+PROFILE_SAMPLE_INTERVAL_MS = float(os.getenv("PROFILE_SAMPLE_INTERVAL_MS", "5"))
+PROFILE_TOP_ALLOCATIONS = 30
+
+# tracemalloc is process-wide, so only one request is profiled at a time
+_profile_lock = threading.Lock()
+# Files written for each run, keyed by report kind
+REPORTS = {"folded": "folded.txt", "allocations": "allocations.txt"}
+
+log = logging.getLogger("profiling")
+
+
+class StackSampler(threading.Thread):
+    """Samples one thread's Python stack at a fixed interval into folded-stack counts."""
+
+    def __init__(self, thread_id, interval):
+        super().__init__(daemon=True)
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            frames = []
+            while frame is not None:
+                frames.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+                frame = frame.f_back
+            # A sample taken after stop() was requested shows stop() itself
+            if frames and not self._stop_event.is_set():
+                self.stacks[";".join(reversed(frames))] += 1
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+
+
+def _start(admin_user_id, authorize):
+    if not authorize(admin_user_id) or not _profile_lock.acquire(blocking=False):
+        return
+    try:
+        g.profile_id = time.strftime("%Y%m%d-%H%M%S-") + uuid.uuid4().hex[:8]
+        g.profile_started = time.perf_counter()
+        tracemalloc.start()
+        g.profile_alloc_start = tracemalloc.take_snapshot()
+        sampler = StackSampler(threading.get_ident(), PROFILE_SAMPLE_INTERVAL_MS / 1000)
+        sampler.start()
+        # Set last: _finish() runs for the request only once this is in g
+        g.profile_sampler = sampler
+    except Exception:
+        # The request runs unprofiled; the next one may try again
+        log.exception("could not start profiling")
+        tracemalloc.stop()
+        _profile_lock.release()
+
+
+def _finish():
+    sampler = g.pop("profile_sampler")
+    try:
+        sampler.stop()
+        seconds = time.perf_counter() - g.profile_started
+        alloc_stats = tracemalloc.take_snapshot().compare_to(g.profile_alloc_start, "lineno")
+    finally:
+        tracemalloc.stop()
+        _profile_lock.release()
+
+    run_dir = os.path.join(PROFILE_DIR, g.profile_id)
+    os.makedirs(run_dir, exist_ok=True)
+    with open(os.path.join(run_dir, REPORTS["folded"]), "w") as f:
+        for stack, count in sampler.stacks.most_common():
+            f.write(f"{stack} {count}\n")
+    with open(os.path.join(run_dir, REPORTS["allocations"]), "w") as f:
+        for stat in alloc_stats[:PROFILE_TOP_ALLOCATIONS]:
+            f.write(f"{stat}\n")
+    with open(os.path.join(run_dir, "meta.json"), "w") as f:
+        json.dump({
+            "profile_id": g.profile_id,
+            "method": request.method,
+            "route": current_route(),
+            "path": request.path,
+            "duration_ms": round(seconds * 1000, 2),
+            "samples": sum(sampler.stacks.values()),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime()),
+        }, f)
+    _prune()
+
+
+def _prune():
+    runs = sorted(os.listdir(PROFILE_DIR))
+    for old in runs[:max(0, len(runs) - PROFILE_MAX_RUNS)]:
+        old_dir = os.path.join(PROFILE_DIR, old)
+        for name in os.listdir(old_dir):
+            os.remove(os.path.join(old_dir, name))
+        os.rmdir(old_dir)
+
+
+def list_runs():
+    """Metadata of the stored profiles, newest first."""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    runs = []
+    for run_id in sorted(os.listdir(PROFILE_DIR), reverse=True):
+        try:
+            with open(os.path.join(PROFILE_DIR, run_id, "meta.json")) as f:
+                runs.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return runs
+
+
+def report_path(profile_id, kind):
+    """Path of a stored report, or None if the id or kind is unknown."""
+    if kind not in REPORTS or os.path.basename(profile_id) != profile_id:
+        return None
+    path = os.path.join(PROFILE_DIR, profile_id, REPORTS[kind])
+    return path if os.path.isfile(path) else None
+
+
+def init_app(app, authorize):
+    """Enable header-triggered profiling; authorize(user_id) must return True for admins."""
+
+    @app.before_request
+    def _profile_before():
+        admin_user_id = request.headers.get(PROFILE_HEADER)
+        if admin_user_id:
+            _start(admin_user_id, authorize)
+
+    @app.after_request
+    def _profile_header(response):
+        if "profile_sampler" in g:
+            response.headers["X-Profile-Id"] = g.profile_id
+        return response
+
+    @app.teardown_request
+    def _profile_teardown(exc):
+        if "profile_sampler" in g:
+            _finish()
@@ -0,0 +1,102 @@
+"""
+Per-route SQL statement budgets.
+
+Each request counts the statements it executes (through the cursor hook in
+db.py) against its route's budget: ROUTE_BUDGETS, else QUERY_BUDGET_DEFAULT.
+A request over budget is logged as a warning listing its repeated statement
+fingerprints, which is what an N+1 loop looks like, and counted in
+db_query_budget_exceeded_total. QUERY_BUDGET_MODE=raise turns overruns into
+QueryBudgetExceeded errors for tests and benchmarks; off disables the check.
+"""
+import os
+from collections import Counter
+
+from flask import current_app, g, has_request_context
+
+import db
+import metrics
+from slow_queries import normalize_sql
+
+QUERY_BUDGET_MODE = os.getenv("QUERY_BUDGET_MODE", "warn")
+QUERY_BUDGET_DEFAULT = int(os.getenv("QUERY_BUDGET_DEFAULT", "10"))
+
+# Route -> statements allowed per request, for routes tighter or looser than the default
+ROUTE_BUDGETS = {
+    "/api/login": 2,
+    "/api/courses": 2,
+    "/api/courses/my-courses": 2,
+    "/api/dashboard": 2,
+    "/api/student/profile": 2,
+    "/api/instructor/courses": 2,
+    "/api/student/courses/<course_id>/modules": 3,
+    "/api/student/courses/<course_id>/assignments": 3,
+    "/api/student/courses/<course_id>/announcements": 3,
+    "/api/student/announcements": 1,
+    "/api/instructor/courses/<course_id>/assignments": 3,
+    "/api/instructor/needs-grading": 1,
+    # Plus up to three statements each for single-flight coalescing (singleflight.py)
+    "/api/analyst/courses": 4,
+    "/api/analyst/insights": 12,
+}
+
+# Fingerprints included in an overrun report
+REPORT_TOP_STATEMENTS = 5
+
+
+class QueryBudgetExceeded(RuntimeError):
+    def __init__(self, route, count, budget, repeated):
+        self.route = route
+        self.count = count
+        self.budget = budget
+        self.repeated = repeated
+        super().__init__(format_overrun(route, count, budget, repeated))
+
+
+def budget_for(route):
+    return ROUTE_BUDGETS.get(route, QUERY_BUDGET_DEFAULT)
+
+
+def repeated_statements(statements):
+    """[(fingerprint, count)] of statements run more than once, most frequent first."""
+    fingerprints = Counter()
+    for query, count in statements.items():
+        fingerprints[normalize_sql(query)] += count
+    return [(sql, count) for sql, count in fingerprints.most_common(REPORT_TOP_STATEMENTS) if count > 1]
+
+
+def format_overrun(route, count, budget, repeated):
+    lines = [f"{route} ran {count} SQL statements (budget {budget})"]
+    lines += [f"  {count}x {sql[:200]}" for sql, count in repeated]
+    return "\n".join(lines)
+
+
+def _on_query(cursor, query, params, seconds):
+    if has_request_context():
+        statements = g.setdefault("budget_statements", Counter())
+        statements[query] += 1
+
+
+def _after_request(response):
+    statements = g.get("budget_statements")
+    route = metrics.current_route()
+    if not statements or route == "unmatched":
+        return response
+    count = sum(statements.values())
+    budget = budget_for(route)
+    if count <= budget:
+        return response
+
+    metrics.QUERY_BUDGET_EXCEEDED.labels(route).inc()
+    repeated = repeated_statements(statements)
+    if QUERY_BUDGET_MODE == "raise":
+        raise QueryBudgetExceeded(route, count, budget, repeated)
+    current_app.logger.warning(format_overrun(route, count, budget, repeated))
+    return response
+
+
+def init_app(app):
+    """Check every request of a Flask app against its query budget (unless mode is off)."""
+    if QUERY_BUDGET_MODE == "off":
+        return
+    app.after_request(_after_request)
+    db.add_query_hook(_on_query)
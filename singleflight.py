@@ -0,0 +1,147 @@
+"""
+Single-flight for expensive read routes.
+
+    @api.route("/api/analyst/overview", methods=["GET"])
+    @cache.cached(ttl=ANALYST_CACHE_TTL, tags=["table:course"])
+    @singleflight.coalesce
+    @reads_from_replica
+    def analyst_overview():
+
+Identical requests (same route, path and query parameters, see
+cache.request_key) that arrive while one of them is being computed wait for
+it and get its response instead of running the same queries again.
+
+Within a process, the first request leads and the others wait on it in
+memory. Across processes, a leader takes a transaction-level advisory lock on
+the key (on a second pooled connection, counted in db.CONNECTIONS_PER_THREAD)
+for as long as it computes, and stores its response in public.flight_result
+(migrations/add_flight_results.sql) in the same transaction. A leader that found the lock taken waits for it and
+serves the response stored after it started waiting, if there is one.
+
+Waits last at most SINGLEFLIGHT_WAIT_SECONDS, after which a request computes
+its own response. Only 200 responses are shared: after anything else, the
+next waiter computes. SINGLEFLIGHT=off disables it.
+"""
+import os
+import threading
+from functools import wraps
+
+import psycopg2.errors
+from flask import Response, current_app, request
+
+import metrics
+from cache import request_key
+from db import get_connection
+
+SINGLEFLIGHT = os.getenv("SINGLEFLIGHT", "on")
+SINGLEFLIGHT_WAIT_SECONDS = float(os.getenv("SINGLEFLIGHT_WAIT_SECONDS", "10"))
+# Stored responses older than this are pruned by worker.py
+RESULT_RETENTION = "1 hour"
+
+LOCK_KEY = "hashtextextended('singleflight:' || %s, 0)"
+
+# A response finished since this transaction began (before the lock wait)
+RESULT_SQL = """
+    SELECT status, mimetype, body FROM public.flight_result
+    WHERE key = %s AND finished_at >= now()
+"""
+
+STORE_SQL = """
+    INSERT INTO public.flight_result (key, status, mimetype, body, finished_at)
+    VALUES (%s, %s, %s, %s, clock_timestamp())
+    ON CONFLICT (key) DO UPDATE
+        SET status = EXCLUDED.status, mimetype = EXCLUDED.mimetype,
+            body = EXCLUDED.body, finished_at = EXCLUDED.finished_at
+"""
+
+
+class _Flight:
+    """A computation in progress in this process, and its 200 response once done."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+_flights = {}
+_flights_lock = threading.Lock()
+
+
+def _response(result):
+    status, mimetype, body = result
+    return Response(body, status=status, mimetype=mimetype)
+
+
+def _lead(view, args, kwargs, key, route):
+    conn = get_connection()
+    cur = conn.cursor()
+    try:
+        cur.execute(f"SELECT pg_try_advisory_xact_lock({LOCK_KEY})", (key,))
+        if not cur.fetchone()[0]:
+            try:
+                cur.execute(f"SET LOCAL lock_timeout = %s; SELECT pg_advisory_xact_lock({LOCK_KEY})",
+                            (f"{int(SINGLEFLIGHT_WAIT_SECONDS * 1000)}ms", key))
+            except psycopg2.errors.LockNotAvailable:
+                conn.rollback()
+                metrics.SINGLEFLIGHT_REQUESTS.labels(route, "alone").inc()
+                return current_app.make_response(view(*args, **kwargs))
+            cur.execute(RESULT_SQL, (key,))
+            row = cur.fetchone()
+            if row is not None:
+                conn.commit()
+                metrics.SINGLEFLIGHT_REQUESTS.labels(route, "follower_shared").inc()
+                return _response((row[0], row[1], bytes(row[2])))
+
+        metrics.SINGLEFLIGHT_REQUESTS.labels(route, "leader").inc()
+        response = current_app.make_response(view(*args, **kwargs))
+        if response.status_code == 200 and not response.is_streamed:
+            cur.execute(STORE_SQL, (key, 200, response.mimetype, response.get_data()))
+        conn.commit()
+        return response
+    finally:
+        cur.close()
+        conn.close()
+
+
+def coalesce(view):
+    """Let identical concurrent GET requests to a route share one computation.
+    Put it below @cache.cached, so it only runs on cache misses."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if SINGLEFLIGHT == "off" or request.method != "GET":
+            return view(*args, **kwargs)
+        route = metrics.current_route()
+        key = request_key(kwargs)
+        with _flights_lock:
+            flight = _flights.get(key)
+            leading = flight is None
+            if leading:
+                flight = _flights[key] = _Flight()
+
+        if not leading:
+            if flight.done.wait(SINGLEFLIGHT_WAIT_SECONDS) and flight.result is not None:
+                metrics.SINGLEFLIGHT_REQUESTS.labels(route, "follower_local").inc()
+                return _response(flight.result)
+            metrics.SINGLEFLIGHT_REQUESTS.labels(route, "alone").inc()
+            return view(*args, **kwargs)
+
+        try:
+            response = _lead(view, args, kwargs, key, route)
+            if response.status_code == 200 and not response.is_streamed:
+                flight.result = (200, response.mimetype, response.get_data())
+            return response
+        finally:
+            with _flights_lock:
+                del _flights[key]
+            flight.done.set()
+    return wrapper
+
+
+def prune(conn):
+    """Delete stored responses too old to be waited for; returns how many were deleted."""
+    cur = conn.cursor()
+    cur.execute(f"DELETE FROM public.flight_result WHERE finished_at < now() - interval '{RESULT_RETENTION}'")
+    deleted = cur.rowcount
+    conn.commit()
+    cur.close()
+    return deleted
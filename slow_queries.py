@@ -0,0 +1,113 @@
+"""
+Slow query log.
+
+Any statement slower than SLOW_QUERY_MS (default 200) is recorded with its
+route, normalized SQL, parameter shape and duration in a bounded in-memory
+ring buffer (SLOW_QUERY_LOG_SIZE entries, per worker process). A fraction
+SLOW_QUERY_EXPLAIN_SAMPLE (0-1, default 0) of slow SELECTs is re-run under
+EXPLAIN (ANALYZE, BUFFERS) in the same transaction and the plan is attached.
+The re-run is always rolled back to a savepoint, since a SELECT can still
+write through the functions it calls (promotions, NOTIFY, locks).
+Entries are served to administrators at /api/admin/slow-queries.
+"""
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+
+import psycopg2.extensions
+
+import db
+import metrics
+
+SLOW_QUERY_MS = float(os.getenv("SLOW_QUERY_MS", "200"))
+SLOW_QUERY_LOG_SIZE = int(os.getenv("SLOW_QUERY_LOG_SIZE", "200"))
+SLOW_QUERY_EXPLAIN_SAMPLE = float(os.getenv("SLOW_QUERY_EXPLAIN_SAMPLE", "0"))
+
+_entries = deque(maxlen=SLOW_QUERY_LOG_SIZE)
+_lock = threading.Lock()
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_sql(query):
+    """Collapse whitespace and replace literals with '?' so equal statements group together."""
+    if isinstance(query, bytes):
+        query = query.decode("utf-8", "replace")
+    query = _STRING_LITERAL.sub("?", str(query))
+    query = _NUMBER_LITERAL.sub("?", query)
+    return _WHITESPACE.sub(" ", query).strip()
+
+
+def params_shape(params):
+    """Parameter types only (never values), e.g. ['str', 'int']."""
+    if params is None:
+        return None
+    if isinstance(params, dict):
+        return {key: type(value).__name__ for key, value in params.items()}
+    return [type(value).__name__ for value in params]
+
+
+def _explain(cursor, query, params):
+    """EXPLAIN (ANALYZE, BUFFERS) a SELECT inside a savepoint, rolled back
+    afterwards so neither its effects nor a failure reach the request's
+    transaction. Returns the plan text or an error."""
+    conn = cursor.connection
+    if conn.autocommit or conn.info.transaction_status != psycopg2.extensions.TRANSACTION_STATUS_INTRANS:
+        return None
+    # A plain cursor so the EXPLAIN does not re-enter the query hooks
+    cur = conn.cursor(cursor_factory=psycopg2.extensions.cursor)
+    try:
+        cur.execute("SAVEPOINT slow_query_explain")
+        try:
+            cur.execute("EXPLAIN (ANALYZE, BUFFERS) " + query, params)
+            plan = "\n".join(row[0] for row in cur.fetchall())
+        except psycopg2.Error as e:
+            plan = f"EXPLAIN failed: {e}".strip()
+        # ANALYZE ran the statement: undo whatever it did the second time
+        cur.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+        cur.execute("RELEASE SAVEPOINT slow_query_explain")
+        return plan
+    finally:
+        cur.close()
+
+
+def _on_query(cursor, query, params, seconds):
+    duration_ms = seconds * 1000
+    if duration_ms < SLOW_QUERY_MS:
+        return
+    sql = normalize_sql(query)
+    entry = {
+        "at": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime()),
+        "route": metrics.current_route(),
+        "sql": sql,
+        "params_shape": params_shape(params),
+        "duration_ms": round(duration_ms, 2),
+        "explain": None,
+    }
+    if SLOW_QUERY_EXPLAIN_SAMPLE > 0 and sql.upper().startswith("SELECT") \
+            and random.random() < SLOW_QUERY_EXPLAIN_SAMPLE:
+        entry["explain"] = _explain(cursor, query, params)
+    with _lock:
+        _entries.append(entry)
+
+
+def recent(limit=None):
+    """Most recent slow statements first."""
+    with _lock:
+        entries = list(_entries)
+    entries.reverse()
+    return entries[:limit] if limit else entries
+
+
+def clear():
+    with _lock:
+        _entries.clear()
+
+
+def init_app(app):
+    db.add_query_hook(_on_query)
@@ -0,0 +1,384 @@
+"""
+Push channel for dashboards: Server-Sent Events fed by Postgres LISTEN/NOTIFY.
+
+    uvicorn sse:app --host 0.0.0.0 --port 5001
+
+Route /api/events to this process at the proxy. GET /api/events?user_id=...
+streams the events published with events.publish() for that user (their
+grades) and for the courses they are enrolled in or teach (announcements).
+
+Each process holds one LISTEN connection and fans every notification out to
+its clients. Clients get a heartbeat comment every SSE_HEARTBEAT_SECONDS.
+On reconnect, EventSource sends Last-Event-ID and the missed events are
+replayed from public.app_event. Events go out in event id order, so that
+id is a safe resume point (see Listener); a client too far behind for that
+gets a `reset` event and should reload its data. Each client has a bounded
+queue: a client that cannot keep up is disconnected rather than buffered
+without limit, and catches up through the same replay when it reconnects.
+
+LISTEN needs a session of its own: behind the Supabase pooler, point DB_PORT
+at the session-mode port (5432), not the transaction-mode one.
+"""
+import asyncio
+import json
+import logging
+import os
+import uuid
+from contextlib import asynccontextmanager
+
+import asyncpg
+from dotenv import load_dotenv
+from starlette.applications import Starlette
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+import events
+import metrics
+from db import get_connection_params
+
+load_dotenv()
+
+SSE_HEARTBEAT_SECONDS = float(os.getenv("SSE_HEARTBEAT_SECONDS", "15"))
+# Events buffered per client before it is considered too slow and disconnected
+SSE_CLIENT_QUEUE = int(os.getenv("SSE_CLIENT_QUEUE", "100"))
+# Most events replayed on reconnect; further behind gets a reset
+SSE_REPLAY_LIMIT = int(os.getenv("SSE_REPLAY_LIMIT", "500"))
+# How often a connected client's course list is reloaded
+SSE_SUBSCRIPTION_REFRESH_SECONDS = float(os.getenv("SSE_SUBSCRIPTION_REFRESH_SECONDS", "60"))
+SSE_EVENT_RETENTION_HOURS = float(os.getenv("SSE_EVENT_RETENTION_HOURS", "24"))
+SSE_DB_POOL_SIZE = int(os.getenv("SSE_DB_POOL_SIZE", "5"))
+# Longest an event waits for a lower, uncommitted event id to commit or roll
+# back. After that the gap is passed over, and the missing event is sent live
+# (without an id) if it commits later.
+SSE_GAP_WAIT_SECONDS = float(os.getenv("SSE_GAP_WAIT_SECONDS", "30"))
+# How often held events are re-checked while they wait
+SSE_GAP_POLL_SECONDS = 0.5
+# Reconnection delay suggested to EventSource
+SSE_RETRY_MS = 3000
+
+log = logging.getLogger("sse")
+
+EVENT_COLUMNS = "event_id, kind, course_id, user_id, data, created_at"
+
+db_pool = None
+listener = None
+_clients = set()
+
+
+def _connect_args():
+    params = get_connection_params()
+    return {
+        "host": params["host"],
+        "port": int(params["port"]),
+        "user": params["user"],
+        "password": params["password"],
+        "database": params["database"],
+        "ssl": "require" if params["sslmode"] == "require" else False,
+        "statement_cache_size": 0,
+    }
+
+
+def _format(row, with_id=True):
+    """One event in text/event-stream framing. Without the id, EventSource
+    keeps its last one as the resume point."""
+    event_id = f"id: {row['event_id']}\n" if with_id else ""
+    return f"{event_id}event: {row['kind']}\ndata: {row['data']}\n\n"
+
+
+class Client:
+    """One open stream, with the courses it follows and its bounded queue."""
+
+    def __init__(self, user_id, courses):
+        self.user_id = user_id
+        self.courses = courses
+        self.queue = asyncio.Queue(SSE_CLIENT_QUEUE)
+        self.dropped = False
+
+    def wants(self, row):
+        if row["user_id"] is not None:
+            return str(row["user_id"]) == self.user_id
+        return row["course_id"] in self.courses
+
+    def offer(self, row, text):
+        if self.dropped:
+            return
+        try:
+            self.queue.put_nowait((row["event_id"], row["kind"], text))
+        except asyncio.QueueFull:
+            # Too slow: drop what is buffered and tell the stream to close
+            self.dropped = True
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait(None)
+            metrics.SSE_CLIENTS_DROPPED.inc()
+
+
+class Listener:
+    """Holds the LISTEN connection and hands events to the clients that want
+    them, in event id order.
+
+    last_event_id is the frontier: every event up to it has been sent or will
+    never commit. An event above a missing id is held while the transactions
+    running when the gap was first seen are still running (events.py makes
+    sure the gap's holder is one of them), for up to SSE_GAP_WAIT_SECONDS.
+    Events below the frontier that commit later (those that were running at
+    startup, or that outlived the wait) are sent live without an id."""
+
+    def __init__(self):
+        self.last_event_id = None
+        self._startup_id = None
+        # (highest event id seen, xids running then, loop time) while events are held
+        self._barrier = None
+        self._passed_over = set()
+        self._pending = []
+        self._wake = asyncio.Event()
+
+    def _on_notify(self, _conn, _pid, _channel, payload):
+        self._pending.append(json.loads(payload)["event_id"])
+        self._wake.set()
+
+    async def run(self):
+        """Keep a LISTEN connection open, reconnecting (and catching up) after failures."""
+        delay = 1
+        while True:
+            conn = None
+            try:
+                conn = await asyncpg.connect(**_connect_args())
+                await conn.add_listener(events.CHANNEL, self._on_notify)
+                if self.last_event_id is None:
+                    self.last_event_id = self._startup_id = await conn.fetchval(
+                        "SELECT COALESCE(MAX(event_id), 0) FROM public.app_event"
+                    )
+                # Events published while we were not listening
+                self._wake.set()
+                delay = 1
+                while True:
+                    await asyncio.sleep(SSE_HEARTBEAT_SECONDS)
+                    await conn.fetchval("SELECT 1")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                log.warning("event listener connection lost (%s); reconnecting in %ss", e, delay)
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30)
+            finally:
+                if conn is not None and not conn.is_closed():
+                    await conn.close()
+
+    async def dispatch_notified(self):
+        """Send newly committed events, re-checking held ones while a gap is open."""
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), SSE_GAP_POLL_SECONDS if self._barrier else None)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            if self.last_event_id is None:
+                continue
+            ids, self._pending = self._pending, []
+            try:
+                async with db_pool.acquire() as conn:
+                    await self._send_late(conn, ids)
+                    await self._advance(conn)
+            except Exception:
+                log.exception("could not load events after %s", self.last_event_id)
+
+    async def _advance(self, conn):
+        """Send the events above the frontier, in order, up to the first open gap."""
+        async with conn.transaction(isolation="repeatable_read", readonly=True):
+            rows = await conn.fetch(
+                f"SELECT {EVENT_COLUMNS} FROM public.app_event WHERE event_id > $1 ORDER BY event_id",
+                self.last_event_id,
+            )
+            running = set(await conn.fetchval(
+                "SELECT ARRAY(SELECT pg_snapshot_xip(pg_current_snapshot())::text)"
+            ))
+        now = asyncio.get_running_loop().time()
+        # Missing ids up to `closed` are final: whoever held them has finished
+        closed, timed_out = 0, False
+        if self._barrier is not None:
+            upto, xids, since = self._barrier
+            timed_out = now - since >= SSE_GAP_WAIT_SECONDS
+            if timed_out or not xids & running:
+                closed, self._barrier = upto, None
+        for row in rows:
+            event_id = row["event_id"]
+            if event_id > self.last_event_id + 1:
+                if running and event_id > closed:
+                    if self._barrier is None:
+                        self._barrier = (rows[-1]["event_id"], running, now)
+                    return
+                if timed_out:
+                    log.warning("passed over uncommitted event ids %s-%s", self.last_event_id + 1, event_id - 1)
+                    self._passed_over.update(range(self.last_event_id + 1, event_id))
+            self._dispatch(row, _format(row))
+            self.last_event_id = event_id
+
+    async def _send_late(self, conn, ids):
+        """Send notified events that committed after the frontier passed them."""
+        late = [i for i in ids if i <= self._startup_id or i in self._passed_over]
+        if not late:
+            return
+        self._passed_over.difference_update(late)
+        rows = await conn.fetch(
+            f"SELECT {EVENT_COLUMNS} FROM public.app_event WHERE event_id = ANY($1::bigint[]) ORDER BY event_id",
+            late,
+        )
+        for row in rows:
+            self._dispatch(row, _format(row, with_id=False))
+
+    def _dispatch(self, row, text):
+        # A scan of this process's clients per event; events are rare next to reads
+        for client in list(_clients):
+            if client.wants(row):
+                client.offer(row, text)
+
+
+async def prune_events():
+    """Delete events older than the retention period, hourly."""
+    while True:
+        try:
+            async with db_pool.acquire() as conn:
+                await conn.execute(
+                    "DELETE FROM public.app_event WHERE created_at < now() - $1 * interval '1 hour'",
+                    SSE_EVENT_RETENTION_HOURS,
+                )
+        except Exception:
+            log.exception("could not prune events")
+        await asyncio.sleep(3600)
+
+
+@asynccontextmanager
+async def lifespan(_app):
+    global db_pool, listener
+    db_pool = await asyncpg.create_pool(min_size=1, max_size=SSE_DB_POOL_SIZE, **_connect_args())
+    listener = Listener()
+    tasks = [
+        asyncio.create_task(listener.run()),
+        asyncio.create_task(listener.dispatch_notified()),
+        asyncio.create_task(prune_events()),
+    ]
+    try:
+        yield
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await db_pool.close()
+
+
+async def _followed_courses(user_id):
+    """Courses a user is enrolled in (not dropped) or teaches, or None if the user does not exist."""
+    async with db_pool.acquire() as conn:
+        if not await conn.fetchval("SELECT 1 FROM public.users WHERE user_id = $1::uuid", user_id):
+            return None
+        rows = await conn.fetch("""
+            SELECT course_id FROM public.enrolled_in WHERE user_id = $1::uuid AND status != 'dropped'
+            UNION
+            SELECT course_id FROM public.teaches WHERE instructor_id = $1::uuid
+        """, user_id)
+    return {r["course_id"] for r in rows}
+
+
+async def _replay(client, last_event_id):
+    """Missed events after last_event_id, or None if there are too many to replay.
+    Only up to the listener's frontier: the client is registered, so the
+    listener sends it the rest in order."""
+    frontier = listener.last_event_id or 0
+    async with db_pool.acquire() as conn:
+        rows = await conn.fetch(f"""
+            SELECT {EVENT_COLUMNS} FROM public.app_event
+            WHERE event_id > $1 AND event_id <= $5
+              AND (user_id = $2::uuid OR (user_id IS NULL AND course_id = ANY($3::uuid[])))
+            ORDER BY event_id
+            LIMIT $4
+        """, last_event_id, client.user_id, list(client.courses), SSE_REPLAY_LIMIT + 1, frontier)
+        oldest = await conn.fetchval("SELECT MIN(event_id) FROM public.app_event")
+    if len(rows) > SSE_REPLAY_LIMIT or (oldest is not None and last_event_id < oldest - 1):
+        return None
+    return rows
+
+
+async def stream(request):
+    """Event stream for one user."""
+    user_id = request.query_params.get("user_id")
+    if not user_id:
+        return JSONResponse({"error": "user_id is required"}, 400)
+    try:
+        user_id = str(uuid.UUID(user_id))
+    except ValueError:
+        return JSONResponse({"error": "Invalid user_id"}, 400)
+    last_event_id = request.headers.get("last-event-id") or request.query_params.get("last_event_id")
+    try:
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        return JSONResponse({"error": "Invalid last event id"}, 400)
+    courses = await _followed_courses(user_id)
+    if courses is None:
+        return JSONResponse({"error": "User not found"}, 404)
+
+    # Registered before the replay so nothing published in between is missed
+    client = Client(user_id, courses)
+    _clients.add(client)
+    metrics.SSE_CLIENTS.inc()
+
+    async def body():
+        try:
+            yield f"retry: {SSE_RETRY_MS}\n\n"
+            # Events the replay sent, which may also be queued already
+            replayed = set()
+            if last_event_id is not None:
+                rows = await _replay(client, last_event_id)
+                if rows is None:
+                    yield f"id: {listener.last_event_id or 0}\nevent: reset\ndata: {{}}\n\n"
+                else:
+                    for row in rows:
+                        yield _format(row)
+                        replayed.add(row["event_id"])
+                        metrics.SSE_EVENTS_SENT.labels(row["kind"]).inc()
+            refresh_at = asyncio.get_running_loop().time() + SSE_SUBSCRIPTION_REFRESH_SECONDS
+            while True:
+                try:
+                    item = await asyncio.wait_for(client.queue.get(), SSE_HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    yield ": ping\n\n"
+                    if asyncio.get_running_loop().time() >= refresh_at:
+                        client.courses = await _followed_courses(user_id) or set()
+                        refresh_at = asyncio.get_running_loop().time() + SSE_SUBSCRIPTION_REFRESH_SECONDS
+                    continue
+                if item is None:
+                    return  # fell behind; the client reconnects and replays
+                event_id, kind, text = item
+                if event_id in replayed:
+                    replayed.discard(event_id)
+                    continue
+                yield text
+                metrics.SSE_EVENTS_SENT.labels(kind).inc()
+        finally:
+            _clients.discard(client)
+            metrics.SSE_CLIENTS.dec()
+
+    return StreamingResponse(body(), media_type="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        # Stop nginx from buffering the stream
+        "X-Accel-Buffering": "no",
+    })
+
+
+async def metrics_endpoint(_request):
+    body, content_type = metrics.render()
+    return Response(body, media_type=content_type)
+
+
+app = Starlette(
+    routes=[
+        Route("/api/events", stream, methods=["GET"]),
+        Route("/api/events/metrics", metrics_endpoint, methods=["GET"]),
+    ],
+    middleware=[
+        Middleware(CORSMiddleware, allow_origins=["*"], allow_methods=["GET"], allow_headers=["*"]),
+    ],
+    lifespan=lifespan,
+)
@@ -0,0 +1,102 @@
+"""
+Sparse fieldsets and compact encodings for the large list routes.
+
+A list route describes its payload, {"success": true, <key>: [rows]}, as a
+ListQuery: each field is a SQL expression yielding a JSON-ready value, so the
+rows need no per-row conversion whichever way they are rendered. Clients may
+then ask for:
+
+    ?fields=course_id,title     only these fields, in the SELECT list too
+    ?format=compact             {"success": true, "columns": [...], <key>: [[values], ...]}
+    Accept: application/msgpack the same payload as MessagePack (needs the
+                                msgpack package; JSON otherwise)
+
+JSON is built by Postgres when JSON_RENDERING is "db" (see app.py) and from
+the fetched rows otherwise; MessagePack is always packed from the rows.
+"""
+from flask import Response, jsonify, request
+
+MSGPACK = "application/msgpack"
+
+try:
+    import msgpack
+except ImportError:  # optional: MessagePack is then never negotiated
+    msgpack = None
+
+
+class ListQuery:
+    """A list payload under `key`, built from `fields` (name -> SQL expression,
+    in payload order) selected `source` ("FROM ... WHERE ...") ordered by `order_by`."""
+
+    def __init__(self, key, fields, source, order_by):
+        self.key = key
+        self.fields = fields
+        self.source = source
+        self.order_by = order_by
+
+    def requested_fields(self):
+        """The fields named in ?fields=, every field without it. Raises
+        ValueError for names that are not fields."""
+        value = request.args.get("fields")
+        if not value:
+            return list(self.fields)
+        names = list(dict.fromkeys(name.strip() for name in value.split(",") if name.strip()))
+        unknown = [name for name in names if name not in self.fields]
+        if unknown or not names:
+            raise ValueError(f"Unknown fields: {', '.join(unknown) or value}. "
+                             f"Available: {', '.join(self.fields)}")
+        return names
+
+    def rows_sql(self, names):
+        columns = ",\n           ".join(self.fields[name] for name in names)
+        return f"SELECT {columns}\n    {self.source}\n    ORDER BY {self.order_by}"
+
+    def json_sql(self, names, compact=False):
+        """One statement returning the whole payload as JSON text."""
+        if compact:
+            header = "'columns', json_build_array(" + ", ".join(f"'{name}'" for name in names) + "), "
+            row = "json_build_array(" + ", ".join(self.fields[name] for name in names) + ")"
+        else:
+            header = ""
+            row = "json_build_object(" + ", ".join(f"'{name}', {self.fields[name]}" for name in names) + ")"
+        return (f"SELECT json_build_object('success', true, {header}'{self.key}', "
+                f"COALESCE(json_agg({row} ORDER BY {self.order_by}), '[]'))::text\n    {self.source}")
+
+
+def response_encoding():
+    """The encoding to respond in: "msgpack" when the client prefers it to JSON
+    and msgpack is installed, else "json"."""
+    if msgpack is not None and request.accept_mimetypes.best_match(["application/json", MSGPACK]) == MSGPACK:
+        return "msgpack"
+    return "json"
+
+
+def is_default():
+    """True when the request asks for neither a fieldset nor another format."""
+    return not request.args.get("fields") and request.args.get("format") != "compact" \
+        and response_encoding() == "json"
+
+
+def respond(cur, query, params, db_json):
+    """Run `query` on `cur` for the fields and format the request asks for and
+    return the response; `db_json` has Postgres render JSON payloads."""
+    try:
+        names = query.requested_fields()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    compact = request.args.get("format") == "compact"
+    encoding = response_encoding()
+
+    if encoding == "json" and db_json:
+        cur.execute(query.json_sql(names, compact), params)
+        return Response(cur.fetchone()[0], mimetype="application/json")
+
+    cur.execute(query.rows_sql(names), params)
+    rows = cur.fetchall()
+    if compact:
+        payload = {"success": True, "columns": names, query.key: [list(row) for row in rows]}
+    else:
+        payload = {"success": True, query.key: [dict(zip(names, row)) for row in rows]}
+    if encoding == "msgpack":
+        return Response(msgpack.packb(payload), mimetype=MSGPACK)
+    return jsonify(payload)
@@ -0,0 +1,152 @@
+"""
+Background job worker (see jobs.py).
+
+    python worker.py --concurrency 4
+
+Runs alongside the API, as many copies as needed: each claims due jobs with
+FOR UPDATE SKIP LOCKED, so workers never run the same job twice. SIGTERM or
+Ctrl-C lets running jobs finish before exiting. With JOB_WORKER_METRICS_PORT
+set, job metrics are served for Prometheus on that port.
+"""
+import argparse
+import logging
+import os
+import signal
+import socket
+import threading
+import time
+
+from dotenv import load_dotenv
+from prometheus_client import start_http_server
+
+load_dotenv()
+
+import app  # noqa: E402,F401  registers the job handlers
+import db  # noqa: E402
+import idempotency  # noqa: E402
+import jobs  # noqa: E402
+import metrics  # noqa: E402
+import singleflight  # noqa: E402
+
+# How often expired leases are requeued, expired idempotency keys and
+# single-flight responses pruned and the queue depth gauge refreshed
+REAPER_INTERVAL_SECONDS = float(os.getenv("JOB_REAPER_INTERVAL_SECONDS", "30"))
+
+log = logging.getLogger("worker")
+
+
+def run_job(worker_id, job_id, kind, payload, attempts, max_attempts):
+    """Run one claimed job and record its outcome."""
+    fn = jobs.get_handler(kind)
+    start = time.perf_counter()
+    error = None
+    try:
+        if fn is None:
+            raise LookupError(f"no handler registered for job kind {kind!r}")
+        fn(payload)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    finally:
+        metrics.JOB_DURATION.labels(kind).observe(time.perf_counter() - start)
+
+    conn = db.get_connection()
+    try:
+        if error is None:
+            outcome = "done" if jobs.complete(conn, job_id, worker_id) else None
+        else:
+            outcome = jobs.fail(conn, job_id, worker_id, attempts, max_attempts, error)
+            if outcome == "dead":
+                log.error("job %s (%s) dead after %s attempts: %s", job_id, kind, attempts, error)
+            elif outcome == "retry":
+                log.warning("job %s (%s) attempt %s failed: %s", job_id, kind, attempts, error)
+    finally:
+        conn.close()
+    if outcome is None:
+        # Its lease expired while it ran: the job is requeued and its new run decides
+        outcome = "lease_lost"
+        log.warning("job %s (%s) outlived its lease; outcome left to its next run", job_id, kind)
+    metrics.JOBS_PROCESSED.labels(kind, outcome).inc()
+
+
+def work(worker_id, stop, poll_interval):
+    """Claim and run jobs one at a time until `stop` is set."""
+    while not stop.is_set():
+        try:
+            conn = db.get_connection()
+            try:
+                claimed = jobs.claim(conn, worker_id)
+            finally:
+                conn.close()
+            if not claimed:
+                stop.wait(poll_interval)
+                continue
+            run_job(worker_id, *claimed[0])
+        except Exception:
+            log.exception("job loop error")
+            stop.wait(poll_interval)
+        finally:
+            # Connections a handler left open
+            db.release_connections()
+
+
+def reap(stop):
+    """Requeue jobs whose worker died, prune idempotency keys and single-flight
+    responses, and refresh the queue depth gauge."""
+    while not stop.is_set():
+        try:
+            conn = db.get_connection()
+            try:
+                requeued = jobs.requeue_expired(conn)
+                idempotency.prune(conn)
+                singleflight.prune(conn)
+                depth = jobs.queue_depth(conn)
+            finally:
+                conn.close()
+            if requeued:
+                log.warning("requeued %s jobs with expired leases", requeued)
+            for status, count in depth.items():
+                metrics.JOB_QUEUE_DEPTH.labels(status).set(count)
+        except Exception:
+            log.exception("reaper error")
+        stop.wait(REAPER_INTERVAL_SECONDS)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--concurrency", type=int, default=int(os.getenv("JOB_WORKER_CONCURRENCY", "4")),
+                        help="jobs run at once by this process")
+    parser.add_argument("--poll-interval", type=float, default=float(os.getenv("JOB_POLL_INTERVAL_SECONDS", "1")),
+                        help="seconds a thread waits when the queue is empty")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    metrics_port = os.getenv("JOB_WORKER_METRICS_PORT")
+    if metrics_port:
+        start_http_server(int(metrics_port))
+
+    # One connection per job thread plus one for the reaper
+    db.init_pool(maxconn=args.concurrency + 1)
+    stop = threading.Event()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signum, lambda *_: stop.set())
+
+    prefix = f"{socket.gethostname()}:{os.getpid()}"
+    threads = [threading.Thread(target=reap, args=(stop,), name="reaper", daemon=True)]
+    threads += [
+        threading.Thread(target=work, args=(f"{prefix}:{i}", stop, args.poll_interval), name=f"job-{i}")
+        for i in range(args.concurrency)
+    ]
+    for thread in threads:
+        thread.start()
+    log.info("worker %s started with %s threads", prefix, args.concurrency)
+
+    while not stop.is_set():
+        stop.wait(1)
+    log.info("stopping; waiting for running jobs")
+    for thread in threads[1:]:
+        thread.join()
+    db.close_pool()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,10 @@
+"""
+WSGI entry point for production servers.
+
+    gunicorn -c gunicorn.conf.py wsgi:app
+
+`python app.py` starts Flask's debug server and is for local development only.
+"""
+from app import create_app
+
+app = create_app()